@@ -1,7 +1,16 @@
-from flask import Flask, jsonify, request
+import time
+
+# Process start, for time-to-ready
+STARTED = time.perf_counter()
+
+from flask import Flask, Response, jsonify, request, g
 from flask_cors import CORS
 from database import MongoDB
 from embeddings import EmbeddingGenerator
+from session import SessionStore
+from embedding_queue import EmbeddingQueue
+from metrics import HTTP_REQUEST_SECONDS, render_metrics, start_metrics_flusher
+from tracing import Tracer
 import signal
 import sys
 import os
@@ -12,6 +21,9 @@ CORS(app)  # Enable CORS for all routes
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully"""
     print('\nShutting down server gracefully...')
+    # Persist any queued conversation writes before closing the connection
+    SessionStore.flush()
+    Tracer.flush()
     # Cleanup MongoDB connection
     MongoDB().cleanup()
     print('Server shutdown complete.')
@@ -28,17 +40,48 @@ except Exception as e:
     print(f"Failed to initialize MongoDB connection: {e}")
     sys.exit(1)
 
-# Initialize SBERT model at server start
-print("Initializing SBERT model...")
-EmbeddingGenerator.initialize()
-print("SBERT model initialization complete!")
+# Load the SBERT model in the background so the worker starts serving
+# straight away; /ready reports when it can take traffic
+EmbeddingGenerator.initialize_async(started=STARTED)
+
+# Embed new and edited profiles in the background once the model is loaded
+EmbeddingQueue.start()
+
+# Share this worker's metrics with the others when METRICS_DIR is set
+start_metrics_flusher()
 
 # Register blueprints
 from routes.person import person_bp
 from routes.vonage import vonage_bp
+from routes.admin import admin_bp
 
 app.register_blueprint(person_bp, url_prefix='/api/person')
 app.register_blueprint(vonage_bp, url_prefix='/api/vonage')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
+
+@app.before_request
+def start_request_timer():
+    """Start timing the request and clear any call bound by a previous request on this thread"""
+    g.request_started = time.perf_counter()
+    Tracer.bind(None)
+
+@app.after_request
+def record_request_latency(response):
+    """Record per-endpoint latency, keyed by route rule to keep label cardinality bounded"""
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for stages, endpoints and external providers, across workers when METRICS_DIR is set"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health')
 def health_check():
@@ -48,6 +91,22 @@ def health_check():
         'message': 'Service is running'
     })
 
+@app.route('/ready')
+def readiness_check():
+    """Readiness probe: succeeds once the models are loaded and warmed up"""
+    status = EmbeddingGenerator.status()
+    if not status['ready']:
+        return jsonify({
+            'status': 'failed' if status['error'] else 'starting',
+            'message': status['error'] or 'Models are still loading',
+            'startup_seconds': status['startup_seconds']
+        }), 503
+    return jsonify({
+        'status': 'ready',
+        'message': 'Models loaded and warmed up',
+        'startup_seconds': status['startup_seconds']
+    })
+
 @app.route('/test-db')
 def test_db():
     try:
@@ -1,16 +1,64 @@
 import os
 import atexit
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.errors import ConnectionFailure
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.write_concern import WriteConcern
 from datetime import datetime
+from db_monitor import DatabaseMonitor
 
 # Load environment variables
 load_dotenv()
 
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+def build_read_preference(mode, max_staleness=-1):
+    """Build a read preference from its mode name (maxStalenessSeconds doesn't apply to primary)"""
+    if mode == 'primary':
+        return Primary()
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+def build_write_concern(w, timeout_ms=None):
+    """Build a write concern from a w value such as '1' or 'majority'"""
+    return WriteConcern(w=int(w) if str(w).isdigit() else w, wtimeout=timeout_ms)
+
+# Read preference and write concern per class of operation:
+# - default: reads that must see the latest writes (caller lookups, history)
+# - analytics: heavy read-only scans (/list, /conversations, /similar
+#   candidates) that can run on secondaries, away from webhook writes
+# - conversations: write-behind conversation batches, acknowledged by the
+#   primary only to keep the writer fast
+# - profiles: person creates and updates, acknowledged by a majority
+WORKLOADS = {
+    'default': {},
+    'analytics': {
+        'read_preference': build_read_preference(
+            os.getenv('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred'),
+            int(os.getenv('MONGO_ANALYTICS_MAX_STALENESS', -1))
+        )
+    },
+    'conversations': {
+        'write_concern': build_write_concern(os.getenv('MONGO_CONVERSATION_WRITE_CONCERN', '1'))
+    },
+    'profiles': {
+        'write_concern': build_write_concern(
+            os.getenv('MONGO_PROFILE_WRITE_CONCERN', 'majority'),
+            int(os.getenv('MONGO_PROFILE_WRITE_TIMEOUT_MS', 5000))
+        )
+    }
+}
+
 class MongoDB:
     _instance = None
     _db = None  # Store the database instance
+    _workloads = {}  # Database handles per workload
 
     def __new__(cls):
         if cls._instance is None:
@@ -31,15 +79,32 @@ class MongoDB:
             # Use the exact connection string provided by DigitalOcean
             uri = f"mongodb+srv://{os.getenv('MONGO_USERNAME')}:{os.getenv('MONGO_PASSWORD')}@{os.getenv('MONGO_HOST')}/{os.getenv('MONGO_DB')}?authSource=admin&tls=true"
             
-            # Create MongoDB client
-            self.client = MongoClient(uri)
+            # Create MongoDB client, with command and connection pool monitoring.
+            # zstd/snappy need the zstandard/python-snappy packages; the driver
+            # skips any compressor it can't load and negotiates the rest with the server.
+            self.client = MongoClient(
+                uri,
+                maxPoolSize=int(os.getenv('MONGO_MAX_POOL_SIZE', 20)),
+                minPoolSize=int(os.getenv('MONGO_MIN_POOL_SIZE', 2)),
+                maxIdleTimeMS=int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000)),
+                waitQueueTimeoutMS=int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+                compressors=os.getenv('MONGO_COMPRESSORS', 'zstd,snappy,zlib'),
+                event_listeners=DatabaseMonitor.listeners()
+            )
+            DatabaseMonitor.attach(self.client)
             
-            # Store database instance
+            # Store database instance, plus a handle per workload
             self._db = self.client[os.getenv('MONGO_DB')]
+            self._workloads = {
+                name: self._db.with_options(**options) if options else self._db
+                for name, options in WORKLOADS.items()
+            }
             
             # Test connection
             self.client.admin.command('ping')
             print("Successfully connected to MongoDB!")
+            
+            self._ensure_indexes()
         
         except ConnectionFailure as e:
             print(f"Failed to connect to MongoDB: {e}")
@@ -48,6 +113,27 @@ class MongoDB:
             print(f"An error occurred: {e}")
             raise
 
+    def _ensure_indexes(self):
+        """Create the indexes the app's queries rely on (no-op when they exist)"""
+        try:
+            # Finding another person with the same profile text to share its embedding
+            self._db.persons.create_index([('profileHash', 1), ('embeddingVersion', 1)])
+            # Embedding queue workers claiming due jobs
+            self._db.embedding_jobs.create_index([('status', 1), ('available_at', 1)])
+            # Location lookups: by normalized region, and geo queries on coordinates
+            self._db.persons.create_index([('locationInfo.region', 1)])
+            self._db.persons.create_index([('geo', '2dsphere')])
+            # Match table maintenance: lists a person is in, and the lowest entry threshold
+            self._db.matches.create_index([('matches.phone', 1)])
+            self._db.matches.create_index([('threshold', 1)])
+            # Near-duplicate candidates by LSH band key, and cluster lookups
+            self._db.persons.create_index([('lshBands', 1)])
+            self._db.persons.create_index([('duplicateCluster', 1)], sparse=True)
+            # Call traces expire a day (TRACE_TTL) after their last span
+            self._db.traces.create_index([('updated_at', 1)], expireAfterSeconds=int(os.getenv('TRACE_TTL', 86400)))
+        except Exception as e:
+            print(f"Error creating indexes: {e}")
+
     def get_conversation_history(self, call_uuid):
         """Get conversation history for a specific call"""
         try:
@@ -63,48 +149,72 @@ class MongoDB:
             print(f"Error getting conversation history: {e}")
             return []
 
+    @staticmethod
+    def build_conversation_messages(user_message=None, assistant_message=None):
+        """Build timestamped message entries for a conversation turn"""
+        timestamp = datetime.utcnow().isoformat()
+        messages = []
+        
+        if user_message:
+            messages.append({
+                "role": "user",
+                "content": user_message,
+                "timestamp": timestamp
+            })
+            
+        if assistant_message:
+            messages.append({
+                "role": "assistant",
+                "content": assistant_message,
+                "timestamp": timestamp
+            })
+            
+        return messages
+
+    @staticmethod
+    def build_conversation_update(call_uuid, messages, fields=None):
+        """Build the filter and update document that append messages to a call's conversation"""
+        current_time = datetime.utcnow().isoformat()
+        update = {
+            '$setOnInsert': {'created_at': current_time},
+            '$set': {**(fields or {}), 'updated_at': current_time}
+        }
+        if messages:
+            update['$push'] = {'messages': {'$each': messages}}
+        return {'call_uuid': call_uuid}, update
+
     def update_conversation(self, call_uuid, user_message=None, assistant_message=None):
         """Update conversation history with new messages"""
         try:
-            # Get current timestamp
-            timestamp = datetime.utcnow().isoformat()
-            
-            # Create update operations
-            update_ops = []
-            
-            if user_message:
-                update_ops.append({
-                    "role": "user",
-                    "content": user_message,
-                    "timestamp": timestamp
-                })
-                
-            if assistant_message:
-                update_ops.append({
-                    "role": "assistant",
-                    "content": assistant_message,
-                    "timestamp": timestamp
-                })
+            update_ops = self.build_conversation_messages(user_message, assistant_message)
                 
             if update_ops:
                 # Update or create conversation document
-                current_time = datetime.utcnow().isoformat()
-                self._db.conversations.update_one(
-                    {'call_uuid': call_uuid},
-                    {
-                        '$push': {'messages': {'$each': update_ops}},
-                        '$setOnInsert': {'created_at': current_time},
-                        '$set': {'updated_at': current_time}
-                    },
-                    upsert=True
-                )
+                query, update = self.build_conversation_update(call_uuid, update_ops)
+                self.get_db('conversations').conversations.update_one(query, update, upsert=True)
                 
         except Exception as e:
             print(f"Error updating conversation: {e}")
 
-    def get_db(self):
-        """Get the database instance"""
-        return self._db
+    def bulk_update_conversations(self, updates):
+        """Apply a batch of (call_uuid, messages, fields) updates in a single round trip"""
+        operations = [
+            UpdateOne(*self.build_conversation_update(call_uuid, messages, fields), upsert=True)
+            for call_uuid, messages, fields in updates
+        ]
+        if operations:
+            self.get_db('conversations').conversations.bulk_write(operations, ordered=True)
+
+    def get_db(self, workload='default'):
+        """
+        Get the database instance.
+        
+        Args:
+            workload (str): Class of operation, one of 'default', 'analytics',
+                'conversations' or 'profiles', which picks the read
+                preference and write concern
+        """
+        return self._workloads.get(workload, self._db)
 
     def cleanup(self):
         """Cleanup resources"""
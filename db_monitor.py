@@ -0,0 +1,346 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import monitoring
+from logs import get_logger
+from metrics import Counter, Gauge, Histogram
+
+logger = get_logger('mongo')
+
+# Commands slower than this are kept in the slow-query log
+SLOW_QUERY_MS = float(os.getenv('MONGO_SLOW_QUERY_MS', 100))
+# Reads slower than this get their query plan captured with explain()
+EXPLAIN_MS = float(os.getenv('MONGO_EXPLAIN_MS', 250))
+# Explain each query shape at most once per interval
+EXPLAIN_INTERVAL = float(os.getenv('MONGO_EXPLAIN_INTERVAL', 300))
+SLOW_QUERY_BUFFER = int(os.getenv('MONGO_SLOW_QUERY_BUFFER', 100))
+
+# Read commands explain() can be run on
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+# Driver housekeeping that isn't worth a histogram series
+IGNORED = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'explain', 'saslStart', 'saslContinue'}
+
+MONGO_COMMAND_SECONDS = Histogram(
+    'boardy_mongo_command_seconds',
+    'MongoDB command latency by collection and operation',
+    ['collection', 'command', 'outcome']
+)
+MONGO_SLOW_QUERIES = Counter(
+    'boardy_mongo_slow_queries_total',
+    'MongoDB commands slower than MONGO_SLOW_QUERY_MS',
+    ['collection', 'command']
+)
+MONGO_POOL_CHECKOUT_SECONDS = Histogram(
+    'boardy_mongo_pool_checkout_seconds',
+    'Time spent waiting to check a connection out of the pool'
+)
+MONGO_POOL_EVENTS = Counter(
+    'boardy_mongo_pool_events_total',
+    'Connection pool events (checkout failures, pool clears)',
+    ['event']
+)
+
+def query_shape(value):
+    """Replace literal values in a filter or pipeline with '?', keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value]
+    return '?'
+
+def _command_collection(command_name, command):
+    """The collection a command targets, or '-' for database-level commands"""
+    target = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+    return target if isinstance(target, str) else '-'
+
+def _plan_stages(plan):
+    """Flatten a winning plan into its stage names, outermost first"""
+    stages = []
+    while plan:
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        if 'queryPlan' in plan:
+            plan = plan['queryPlan']
+        elif 'inputStage' in plan:
+            plan = plan['inputStage']
+        elif plan.get('inputStages'):
+            for child in plan['inputStages']:
+                stages.extend(_plan_stages(child))
+            break
+        else:
+            break
+    return stages
+
+def _winning_plan(explain):
+    """Find the winning plan in find/aggregate explain output"""
+    planner = explain.get('queryPlanner')
+    if planner is None:
+        for stage in explain.get('stages', []):
+            if '$cursor' in stage:
+                planner = stage['$cursor'].get('queryPlanner')
+                break
+    return (planner or {}).get('winningPlan', {})
+
+class _LatencyStats:
+    """Counts and a recent latency window, e.g. for one collection/command pair"""
+    WINDOW = 200
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.max_ms = 0.0
+        self.latencies = deque(maxlen=self.WINDOW)
+
+    def add(self, duration_ms, failed):
+        self.count += 1
+        self.errors += int(failed)
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.latencies.append(duration_ms)
+
+    def summary(self):
+        samples = sorted(self.latencies)
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2) if samples else None
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(self.max_ms, 2)
+            }
+        }
+
+class DatabaseMonitor:
+    """
+    Watches every command and pooled connection of the MongoDB client.
+
+    Command latencies feed per-collection/operation histograms. Commands
+    over MONGO_SLOW_QUERY_MS go into a ring buffer with their query shape
+    (literal values stripped), and slow reads over MONGO_EXPLAIN_MS have
+    their query plan captured with explain() in the background, so a
+    COLLSCAN shows up without anyone reading the code. Like the other
+    in-memory stats this is per worker process.
+    """
+    _commands = {}
+    _stats = {}
+    _slow_queries = deque(maxlen=SLOW_QUERY_BUFFER)
+    _explained = {}
+    _checkout_waits = _LatencyStats()
+    _pool = {'open': 0, 'checked_out': 0, 'max_open': 0, 'checkout_failures': 0, 'cleared': 0}
+    _lock = threading.Lock()
+    _local = threading.local()
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mongo-explain')
+    _client = None
+
+    @classmethod
+    def listeners(cls):
+        """Event listeners to pass to MongoClient(event_listeners=...)"""
+        return [_CommandListener(), _PoolListener()]
+
+    @classmethod
+    def attach(cls, client):
+        """Remember the client used to run explain()"""
+        cls._client = client
+
+    @classmethod
+    def command_started(cls, event):
+        if event.command_name in IGNORED:
+            return
+        collection = _command_collection(event.command_name, event.command)
+        command = None
+        if event.command_name in EXPLAINABLE:
+            # Keep the query itself in case it turns out to be slow enough to explain
+            command = {
+                key: value for key, value in event.command.items()
+                if not key.startswith('$') and key not in ('lsid', 'txnNumber', 'readConcern', 'cursor')
+            }
+            if event.command_name == 'aggregate':
+                command['cursor'] = {}
+        with cls._lock:
+            cls._commands[(event.connection_id, event.request_id)] = (collection, command, event.database_name)
+
+    @classmethod
+    def command_finished(cls, event, failed):
+        with cls._lock:
+            entry = cls._commands.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        collection, command, database_name = entry
+        duration_ms = event.duration_micros / 1000
+        MONGO_COMMAND_SECONDS.observe(
+            duration_ms / 1000,
+            collection=collection,
+            command=event.command_name,
+            outcome='error' if failed else 'success'
+        )
+        with cls._lock:
+            stats = cls._stats.setdefault(f"{collection}.{event.command_name}", _LatencyStats())
+            stats.add(duration_ms, failed)
+
+        if duration_ms >= SLOW_QUERY_MS:
+            cls._record_slow(event.command_name, collection, command, database_name, duration_ms)
+
+    @classmethod
+    def _record_slow(cls, command_name, collection, command, database_name, duration_ms):
+        """Add a slow command to the ring buffer and explain it if it's a slow read"""
+        MONGO_SLOW_QUERIES.inc(collection=collection, command=command_name)
+        shape = None
+        if command is not None:
+            shape = query_shape(command.get('filter', command.get('query', command.get('pipeline', {}))))
+        slow = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'collection': collection,
+            'command': command_name,
+            'duration_ms': round(duration_ms, 2),
+            'shape': shape,
+            'explain': None
+        }
+        with cls._lock:
+            cls._slow_queries.append(slow)
+        logger.warning(
+            "Slow query on %s.%s took %.0fms",
+            collection, command_name, duration_ms,
+            shape=shape
+        )
+
+        if command is None or duration_ms < EXPLAIN_MS or cls._client is None:
+            return
+        key = (collection, command_name, repr(shape))
+        now = time.monotonic()
+        with cls._lock:
+            explained_at, previous = cls._explained.get(key, (float('-inf'), None))
+            if now - explained_at < EXPLAIN_INTERVAL:
+                # Same query shape was explained recently, reuse its plan
+                slow['explain'] = previous['explain']
+                return
+            cls._explained[key] = (now, slow)
+        cls._executor.submit(cls._explain, slow, command, database_name)
+
+    @classmethod
+    def _explain(cls, slow, command, database_name):
+        """Capture the query plan of a slow read (runs off the request thread)"""
+        try:
+            explain = cls._client[database_name].command({'explain': command, 'verbosity': 'queryPlanner'})
+            plan = _winning_plan(explain)
+            stages = _plan_stages(plan)
+            result = {
+                'stages': stages,
+                'collection_scan': 'COLLSCAN' in stages,
+                'winning_plan': plan
+            }
+            if result['collection_scan']:
+                logger.warning(
+                    "Slow query on %s.%s is a collection scan",
+                    slow['collection'], slow['command'],
+                    shape=slow['shape']
+                )
+        except Exception as e:
+            result = {'error': str(e)}
+        with cls._lock:
+            slow['explain'] = result
+
+    @classmethod
+    def checkout_started(cls):
+        cls._local.checkout_started = time.perf_counter()
+
+    @classmethod
+    def checked_out(cls, duration):
+        if duration is None:
+            started = getattr(cls._local, 'checkout_started', None)
+            duration = time.perf_counter() - started if started is not None else None
+        if duration is not None:
+            MONGO_POOL_CHECKOUT_SECONDS.observe(duration)
+            with cls._lock:
+                cls._checkout_waits.add(duration * 1000, failed=False)
+        cls._pool_change('checked_out', 1)
+
+    @classmethod
+    def checkout_failed(cls, reason):
+        MONGO_POOL_EVENTS.inc(event=f"checkout_failed_{reason}")
+        cls._pool_change('checkout_failures', 1)
+
+    @classmethod
+    def pool_cleared(cls):
+        MONGO_POOL_EVENTS.inc(event='cleared')
+        cls._pool_change('cleared', 1)
+
+    @classmethod
+    def _pool_change(cls, name, amount):
+        with cls._lock:
+            cls._pool[name] += amount
+            cls._pool['max_open'] = max(cls._pool['max_open'], cls._pool['open'])
+
+    @classmethod
+    def pool_gauge(cls):
+        with cls._lock:
+            return {('open',): cls._pool['open'], ('checked_out',): cls._pool['checked_out']}
+
+    @classmethod
+    def stats(cls):
+        """Per-command latency, the slow-query log and connection pool state"""
+        with cls._lock:
+            commands = {name: stats.summary() for name, stats in sorted(cls._stats.items())}
+            slow_queries = [dict(slow) for slow in reversed(cls._slow_queries)]
+            pool = dict(cls._pool)
+            pool['checkout_wait'] = cls._checkout_waits.summary()
+        return {
+            'thresholds_ms': {'slow_query': SLOW_QUERY_MS, 'explain': EXPLAIN_MS},
+            'commands': commands,
+            'slow_queries': slow_queries,
+            'pool': pool
+        }
+
+class _CommandListener(monitoring.CommandListener):
+    def started(self, event):
+        DatabaseMonitor.command_started(event)
+
+    def succeeded(self, event):
+        DatabaseMonitor.command_finished(event, failed=False)
+
+    def failed(self, event):
+        DatabaseMonitor.command_finished(event, failed=True)
+
+class _PoolListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        DatabaseMonitor.pool_cleared()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        DatabaseMonitor._pool_change('open', 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        DatabaseMonitor._pool_change('open', -1)
+
+    def connection_check_out_started(self, event):
+        DatabaseMonitor.checkout_started()
+
+    def connection_check_out_failed(self, event):
+        DatabaseMonitor.checkout_failed(event.reason)
+
+    def connection_checked_out(self, event):
+        DatabaseMonitor.checked_out(getattr(event, 'duration', None))
+
+    def connection_checked_in(self, event):
+        DatabaseMonitor._pool_change('checked_out', -1)
+
+MONGO_POOL_CONNECTIONS = Gauge(
+    'boardy_mongo_pool_connections',
+    'Pooled MongoDB connections that are open or checked out',
+    ['state'],
+    callback=DatabaseMonitor.pool_gauge
+)
@@ -0,0 +1,244 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from database import MongoDB
+from generations import Generations
+from logs import get_logger
+from metrics import Counter
+
+logger = get_logger('dedup')
+
+# Cosine similarity at which two profiles count as the same person
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.95))
+
+# Signature layout: LSH_BANDS bands of LSH_ROWS bits. A pair with cosine s
+# shares a band with probability 1 - (1 - p^ROWS)^BANDS, p = 1 - acos(s)/pi:
+# ~0.98 at s=0.95, ~0.03 at s=0.5 for the defaults
+LSH_BANDS = int(os.getenv('LSH_BANDS', 20))
+LSH_ROWS = int(os.getenv('LSH_ROWS', 16))
+LSH_SEED = int(os.getenv('LSH_SEED', 20240601))
+
+# Most candidates an insert verifies exactly
+MAX_CANDIDATES = 200
+
+class LSHSignature:
+    """
+    Random-hyperplane signatures with banding.
+
+    Each bit is the side of a random hyperplane an embedding falls on, so
+    two embeddings agree on a bit with probability 1 - angle/pi. Bits are
+    grouped into bands; two embeddings become candidates when every bit
+    of at least one band matches. The hyperplanes come from a fixed seed
+    so every process (and the batch job) computes the same keys.
+    """
+    _planes = {}
+
+    @classmethod
+    def planes(cls, dimensions):
+        if dimensions not in cls._planes:
+            rng = np.random.default_rng(LSH_SEED)
+            cls._planes[dimensions] = rng.standard_normal((dimensions, LSH_BANDS * LSH_ROWS)).astype(np.float32)
+        return cls._planes[dimensions]
+
+    @classmethod
+    def band_keys(cls, embeddings):
+        """
+        Band keys for a matrix of embeddings.
+
+        Args:
+            embeddings (np.ndarray): One embedding per row
+
+        Returns:
+            np.ndarray: (rows, LSH_BANDS) int64 keys, each unique to its
+                band: band index in the high bits, the band's bits below
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        bits = (embeddings @ cls.planes(embeddings.shape[1]) > 0).reshape(len(embeddings), LSH_BANDS, LSH_ROWS)
+        weights = 1 << np.arange(LSH_ROWS, dtype=np.int64)
+        values = bits.astype(np.int64) @ weights
+        return values + (np.arange(LSH_BANDS, dtype=np.int64) << LSH_ROWS)
+
+def lsh_duplicate_pairs(matrix, threshold=DUPLICATE_THRESHOLD, max_bucket=1000):
+    """
+    All pairs of rows with cosine >= threshold that share an LSH band.
+
+    Args:
+        matrix (np.ndarray): Unit-normalized embeddings, one per row
+        threshold (float): Cosine similarity to count as a duplicate
+        max_bucket (int): Buckets larger than this are skipped, as they
+            only form around degenerate (e.g. empty) profiles
+
+    Returns:
+        tuple: (pairs as an (n, 2) array of row numbers with i < j, number
+            of candidate pairs verified)
+    """
+    count = len(matrix)
+    if count < 2:
+        return np.empty((0, 2), dtype=np.int64), 0
+    keys = np.concatenate([
+        LSHSignature.band_keys(matrix[start:start + 65536]) for start in range(0, count, 65536)
+    ])
+
+    # Candidate pairs as codes i * count + j (i < j), repeated across bands
+    codes = []
+    for band in range(LSH_BANDS):
+        order = np.argsort(keys[:, band], kind='stable')
+        sorted_keys = keys[order, band]
+        # Runs of equal keys are the band's buckets; drop oversized ones
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, count])
+        keep = np.repeat(sizes <= max_bucket, sizes)
+        # Pair every position with the ones `offset` further along its bucket
+        positions = np.flatnonzero(keep[:-1] & (sorted_keys[1:] == sorted_keys[:-1]))
+        offset = 1
+        while len(positions):
+            first, second = order[positions], order[positions + offset]
+            codes.append(np.minimum(first, second) * count + np.maximum(first, second))
+            offset += 1
+            positions = positions[positions + offset < count]
+            positions = positions[sorted_keys[positions + offset] == sorted_keys[positions]]
+    candidates = np.sort(np.concatenate(codes)) if codes else np.empty(0, dtype=np.int64)
+    candidates = candidates[np.r_[True, candidates[1:] != candidates[:-1]]] if len(candidates) else candidates
+
+    # Verify by exact cosine a chunk at a time
+    pairs = []
+    for start in range(0, len(candidates), 65536):
+        chunk = candidates[start:start + 65536]
+        first, second = chunk // count, chunk % count
+        scores = np.einsum('ij,ij->i', matrix[first], matrix[second])
+        found = scores >= threshold
+        pairs.append(np.stack([first[found], second[found]], axis=1))
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+    return pairs, len(candidates)
+
+def clusters_from_pairs(count, pairs):
+    """Union-find over duplicate pairs; returns each row's cluster root (itself when unique)"""
+    parent = np.arange(count)
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(row) for row in range(count)])
+
+def cosine(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+
+class DuplicateDetector:
+    """
+    Flags near-duplicate persons (cosine >= DUPLICATE_THRESHOLD).
+
+    Every person with an embedding stores its LSH band keys in lshBands
+    (multikey-indexed). check() runs when a person's embedding changes:
+    people sharing a band key are verified by exact cosine, and duplicates
+    join one cluster, recorded as duplicateCluster = the phone number of
+    its earliest member on every member. Searches collapse each cluster to
+    its best hit. jobs.find_duplicates recomputes every key and cluster in
+    bulk and can merge clusters, hiding all but the canonical member from
+    search with mergedInto.
+
+    Incremental checks only ever add to clusters; a profile edited away
+    from its duplicates leaves its cluster, but anyone left pointing at it
+    keeps the old cluster until the next batch run.
+    """
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dedup')
+
+    @classmethod
+    def schedule(cls, phone_number, embedding):
+        """Check a changed embedding off the request path"""
+        if not embedding:
+            return
+        cls._executor.submit(cls._check_logged, phone_number, embedding)
+
+    @classmethod
+    def _check_logged(cls, phone_number, embedding):
+        try:
+            cls.check(phone_number, embedding)
+        except Exception as e:
+            logger.exception("Duplicate check failed for a person: %s", e)
+
+    @classmethod
+    def check(cls, phone_number, embedding):
+        """
+        Store a person's band keys and flag them if they duplicate someone.
+
+        Args:
+            phone_number (str): The person
+            embedding (list): Their new embedding
+
+        Returns:
+            str: Their cluster id, or None when they have no duplicate
+        """
+        persons = MongoDB().get_db('profiles').persons
+        bands = LSHSignature.band_keys(embedding)[0].tolist()
+        candidates = persons.find(
+            {'lshBands': {'$in': bands}, 'phoneNumber': {'$ne': phone_number}},
+            {'_id': 0, 'phoneNumber': 1, 'vectorEmbedding': 1, 'duplicateCluster': 1, 'createdAt': 1}
+        ).limit(MAX_CANDIDATES)
+        duplicates = [
+            person for person in candidates
+            if person.get('vectorEmbedding') and cosine(embedding, person['vectorEmbedding']) >= DUPLICATE_THRESHOLD
+        ]
+        DUPLICATE_CHECKS.inc(outcome='duplicate' if duplicates else 'unique')
+
+        if not duplicates:
+            previous = persons.find_one_and_update(
+                {'phoneNumber': phone_number},
+                {'$set': {'lshBands': bands}, '$unset': {'duplicateCluster': ''}},
+                projection={'_id': 0, 'duplicateCluster': 1}
+            )
+            # Leaving a cluster changes what reads and /similar collapsing see
+            if previous and previous.get('duplicateCluster'):
+                Generations.bump()
+            return None
+
+        # Join an existing cluster, or start one around the earliest duplicate
+        clusters = sorted(person['duplicateCluster'] for person in duplicates if person.get('duplicateCluster'))
+        if clusters:
+            cluster = clusters[0]
+        else:
+            earliest = min(duplicates, key=lambda person: (
+                person.get('createdAt') is None, person.get('createdAt'), person['phoneNumber']
+            ))
+            cluster = earliest['phoneNumber']
+        persons.update_one(
+            {'phoneNumber': phone_number},
+            {'$set': {'lshBands': bands, 'duplicateCluster': cluster}}
+        )
+        persons.update_many(
+            {'phoneNumber': {'$in': [person['phoneNumber'] for person in duplicates]}, 'duplicateCluster': {'$exists': False}},
+            {'$set': {'duplicateCluster': cluster}}
+        )
+        Generations.bump()
+        logger.info("Duplicate profile flagged", cluster=cluster, duplicates=len(duplicates))
+        return cluster
+
+    @classmethod
+    def stats(cls):
+        """Number of clusters, flagged and merged persons"""
+        persons = MongoDB().get_db('analytics').persons
+        clusters = list(persons.aggregate([
+            {'$match': {'duplicateCluster': {'$exists': True}}},
+            {'$group': {'_id': '$duplicateCluster', 'size': {'$sum': 1}}},
+            {'$sort': {'size': -1}},
+            {'$limit': 20}
+        ]))
+        return {
+            'flagged': persons.count_documents({'duplicateCluster': {'$exists': True}}),
+            'merged': persons.count_documents({'mergedInto': {'$exists': True}}),
+            'largest_clusters': [{'cluster': c['_id'], 'size': c['size']} for c in clusters]
+        }
+
+DUPLICATE_CHECKS = Counter(
+    'boardy_duplicate_checks_total',
+    'Incremental near-duplicate checks by outcome',
+    ['outcome']
+)
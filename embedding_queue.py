@@ -0,0 +1,304 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument, UpdateOne
+from database import MongoDB
+from embeddings import EmbeddingGenerator, EMBEDDING_VERSION, build_profile_text
+from inference import InferenceOverloaded
+from logs import get_logger
+from metrics import Counter
+from profiles import EMBEDDING_READY, EMBEDDING_FAILED
+from vector_index import VectorIndex
+from matches import MatchTable
+from dedup import DuplicateDetector
+from snapshot import EmbeddingSnapshot, embedding_stamp
+from generations import Generations
+
+logger = get_logger('embedding_queue')
+
+class EmbeddingQueue:
+    """
+    Durable queue of person embeddings still to compute, kept in MongoDB.
+
+    Creating or updating a person writes it straight away with
+    embeddingStatus: pending and enqueues a job; background workers in each
+    gunicorn process claim jobs in batches under a lease, encode them in
+    one model call and write the embeddings back. There is one job per
+    phone number, so repeated edits collapse into the latest profile.
+
+    A worker that dies mid-batch leaves its leases to expire after
+    LEASE_SECONDS, when any worker can claim the jobs again. Failed jobs
+    are retried with exponential backoff; after MAX_ATTEMPTS they are kept
+    as dead letters with status 'dead' and the person is marked
+    embeddingStatus: failed. Saving the profile again re-enqueues it.
+    """
+    WORKERS = int(os.getenv('EMBEDDING_QUEUE_WORKERS', 1))
+    BATCH_SIZE = int(os.getenv('EMBEDDING_QUEUE_BATCH_SIZE', 32))
+    LEASE_SECONDS = float(os.getenv('EMBEDDING_QUEUE_LEASE_SECONDS', 60))
+    POLL_INTERVAL = float(os.getenv('EMBEDDING_QUEUE_POLL_INTERVAL', 2.0))
+    MAX_ATTEMPTS = int(os.getenv('EMBEDDING_QUEUE_MAX_ATTEMPTS', 5))
+    RETRY_BASE_SECONDS = float(os.getenv('EMBEDDING_QUEUE_RETRY_BASE_SECONDS', 5))
+    # How long to back off when the executor is busy serving searches
+    OVERLOADED_DELAY = 1.0
+
+    QUEUED = 'queued'
+    LEASED = 'leased'
+    DEAD = 'dead'
+
+    _wake = threading.Event()
+    _lock = threading.Lock()
+    _workers = []
+
+    @classmethod
+    def collection(cls):
+        return MongoDB().get_db().embedding_jobs
+
+    @classmethod
+    def enqueue(cls, phone_number, profile_hash):
+        """
+        Queue (or re-queue) the embedding of a person's current profile.
+
+        Args:
+            phone_number (str): The person to embed
+            profile_hash (str): Hash of the profile text the job is for; the
+                result is only written while the person still has it
+        """
+        now = datetime.now(timezone.utc)
+        cls.collection().update_one(
+            {'_id': phone_number},
+            {
+                '$set': {
+                    'profileHash': profile_hash,
+                    'status': cls.QUEUED,
+                    'attempts': 0,
+                    'available_at': now,
+                    'lease_owner': None,
+                    'lease_until': None,
+                    'last_error': None
+                },
+                '$setOnInsert': {'enqueued_at': now}
+            },
+            upsert=True
+        )
+        EMBEDDING_JOBS.inc(outcome='enqueued')
+        cls._wake.set()
+
+    @classmethod
+    def start(cls):
+        """Start the background workers for this process (once)"""
+        with cls._lock:
+            if cls._workers:
+                return
+            for index in range(cls.WORKERS):
+                owner = f"{socket.gethostname()}:{os.getpid()}:{index}:{uuid.uuid4().hex[:8]}"
+                worker = threading.Thread(
+                    target=cls._run_worker,
+                    args=(owner,),
+                    name=f'embedding-queue-{index}',
+                    daemon=True
+                )
+                worker.start()
+                cls._workers.append(worker)
+
+    @classmethod
+    def _run_worker(cls, owner):
+        """Background loop that claims and processes batches of jobs"""
+        while True:
+            try:
+                # Nothing to do until the model has loaded
+                if not EmbeddingGenerator.ready():
+                    time.sleep(cls.POLL_INTERVAL)
+                    continue
+                jobs = cls.claim(owner)
+                if not jobs:
+                    cls._wake.wait(cls.POLL_INTERVAL)
+                    cls._wake.clear()
+                    continue
+                cls.process(jobs, owner)
+            except Exception as e:
+                logger.exception("Embedding queue worker error: %s", e)
+                time.sleep(cls.POLL_INTERVAL)
+
+    @classmethod
+    def claim(cls, owner):
+        """Lease up to BATCH_SIZE due jobs: queued ones, or leased ones whose lease has expired"""
+        now = datetime.now(timezone.utc)
+        lease_until = now + timedelta(seconds=cls.LEASE_SECONDS)
+        jobs = []
+        for _ in range(cls.BATCH_SIZE):
+            job = cls.collection().find_one_and_update(
+                {
+                    '$or': [
+                        {'status': cls.QUEUED, 'available_at': {'$lte': now}},
+                        {'status': cls.LEASED, 'lease_until': {'$lte': now}}
+                    ]
+                },
+                {
+                    '$set': {'status': cls.LEASED, 'lease_owner': owner, 'lease_until': lease_until},
+                    '$inc': {'attempts': 1}
+                },
+                sort=[('available_at', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    @classmethod
+    def process(cls, jobs, owner):
+        """Embed a batch of leased jobs and write the results back"""
+        phones = [job['_id'] for job in jobs]
+        persons = {
+            person['phoneNumber']: person
+            for person in MongoDB().get_db('profiles').persons.find(
+                {'phoneNumber': {'$in': phones}},
+                {'_id': 0, 'phoneNumber': 1, 'interests': 1, 'skills': 1, 'bio': 1, 'profileHash': 1, 'locationInfo': 1}
+            )
+        }
+
+        work = []
+        for job in jobs:
+            person = persons.get(job['_id'])
+            if person is None or person.get('profileHash') != job['profileHash']:
+                # Deleted, or edited again since; a newer job (if any) covers it
+                cls.complete(job, owner)
+                EMBEDDING_JOBS.inc(outcome='stale')
+                continue
+            work.append((job, build_profile_text(person.get('interests'), person.get('skills'), person.get('bio'))))
+        if not work:
+            return
+
+        started = time.perf_counter()
+        try:
+            embeddings = EmbeddingGenerator.get_instance().generate_embeddings([text for _, text in work])
+        except InferenceOverloaded:
+            # Searches have the executor; give the jobs back without using up an attempt
+            for job, _ in work:
+                cls.release(job, owner, delay=cls.OVERLOADED_DELAY, attempts=job['attempts'] - 1)
+            EMBEDDING_JOBS.inc(len(work), outcome='deferred')
+            return
+        except Exception as e:
+            for job, _ in work:
+                cls.fail(job, owner, e)
+            return
+
+        now = datetime.now(timezone.utc)
+        result = MongoDB().get_db('profiles').persons.bulk_write([
+            UpdateOne(
+                # Only if the profile text is still the one that was embedded
+                {'phoneNumber': job['_id'], 'profileHash': job['profileHash']},
+                {'$set': {
+                    'vectorEmbedding': embedding,
+                    'embeddingVersion': EMBEDDING_VERSION,
+                    'embeddingStatus': EMBEDDING_READY,
+                    'embeddedAt': now
+                }}
+            )
+            for (job, _), embedding in zip(work, embeddings)
+        ], ordered=False)
+        # Other workers' next index builds map these instead of reading them back from MongoDB
+        EmbeddingSnapshot.append([
+            (
+                job['_id'],
+                (persons[job['_id']].get('locationInfo') or {}).get('region'),
+                embedding_stamp(job['profileHash'], EMBEDDING_VERSION),
+                embedding
+            )
+            for (job, _), embedding in zip(work, embeddings)
+        ])
+        VectorIndex.invalidate()
+        Generations.bump()
+        for (job, _), embedding in zip(work, embeddings):
+            cls.complete(job, owner)
+            MatchTable.schedule(job['_id'], embedding)
+            DuplicateDetector.schedule(job['_id'], embedding)
+        EMBEDDING_JOBS.inc(len(work), outcome='embedded')
+        logger.info(
+            "Embedded batch",
+            jobs=len(work),
+            written=result.matched_count,
+            seconds=round(time.perf_counter() - started, 3)
+        )
+
+    @classmethod
+    def complete(cls, job, owner):
+        """Delete a finished job, unless it was re-enqueued for newer text while leased"""
+        cls.collection().delete_one({
+            '_id': job['_id'],
+            'status': cls.LEASED,
+            'lease_owner': owner,
+            'profileHash': job['profileHash']
+        })
+
+    @classmethod
+    def release(cls, job, owner, delay, attempts, error=None):
+        """Put a leased job back in the queue to run again after delay seconds"""
+        cls.collection().update_one(
+            {'_id': job['_id'], 'status': cls.LEASED, 'lease_owner': owner},
+            {'$set': {
+                'status': cls.QUEUED,
+                'attempts': attempts,
+                'available_at': datetime.now(timezone.utc) + timedelta(seconds=delay),
+                'lease_owner': None,
+                'lease_until': None,
+                'last_error': error
+            }}
+        )
+
+    @classmethod
+    def fail(cls, job, owner, error):
+        """Retry a failed job with exponential backoff, or dead-letter it after MAX_ATTEMPTS"""
+        message = f"{type(error).__name__}: {error}"
+        if job['attempts'] < cls.MAX_ATTEMPTS:
+            delay = cls.RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+            cls.release(job, owner, delay=delay, attempts=job['attempts'], error=message)
+            EMBEDDING_JOBS.inc(outcome='retried')
+            logger.warning("Embedding job failed, retrying in %.0fs: %s", delay, message, attempts=job['attempts'])
+            return
+
+        result = cls.collection().update_one(
+            {'_id': job['_id'], 'status': cls.LEASED, 'lease_owner': owner},
+            {'$set': {
+                'status': cls.DEAD,
+                'lease_owner': None,
+                'lease_until': None,
+                'last_error': message,
+                'failed_at': datetime.now(timezone.utc)
+            }}
+        )
+        if result.matched_count:
+            MongoDB().get_db('profiles').persons.update_one(
+                {'phoneNumber': job['_id'], 'profileHash': job['profileHash']},
+                {'$set': {'embeddingStatus': EMBEDDING_FAILED}}
+            )
+            Generations.bump()
+        EMBEDDING_JOBS.inc(outcome='dead')
+        logger.error("Embedding job dead-lettered: %s", message, attempts=job['attempts'])
+
+    @classmethod
+    def stats(cls, dead_limit=20):
+        """Job counts by status and the most recent dead letters"""
+        collection = cls.collection()
+        counts = {cls.QUEUED: 0, cls.LEASED: 0, cls.DEAD: 0}
+        for row in collection.aggregate([{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]):
+            counts[row['_id']] = row['count']
+        oldest = collection.find_one({'status': cls.QUEUED}, sort=[('enqueued_at', 1)])
+        dead = list(collection.find({'status': cls.DEAD}).sort('failed_at', -1).limit(dead_limit))
+        for job in dead:
+            job['phoneNumber'] = job.pop('_id')
+        return {
+            'counts': counts,
+            'oldest_queued_at': oldest['enqueued_at'].isoformat() if oldest else None,
+            'dead_letters': dead,
+            'workers': len(cls._workers)
+        }
+
+EMBEDDING_JOBS = Counter(
+    'boardy_embedding_jobs_total',
+    'Embedding queue jobs by outcome',
+    ['outcome']
+)
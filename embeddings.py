@@ -1,56 +1,254 @@
-from sentence_transformers import SentenceTransformer, CrossEncoder
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
+from logs import get_logger
+from metrics import Counter, Gauge
+from inference import InferenceExecutor
+
+logger = get_logger('models')
+
+# Hugging Face ids of the models we serve
+SBERT_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+CROSS_ENCODER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+# Stored on each person with its embedding. Bump the suffix whenever
+# build_profile_text changes, so stored embeddings are recognised as stale.
+EMBEDDING_VERSION = f"{SBERT_MODEL}:profile-v1"
+
+# Embeddings of recently seen texts, shared by every caller in the process
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))
+
+# Models bundled into the image by `python -m jobs.bundle_models`
+MODEL_DIR = os.getenv('MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+MANIFEST_NAME = 'manifest.json'
+# Refuse to reach the Hugging Face hub; models must come from MODEL_DIR
+MODEL_OFFLINE = os.getenv('MODEL_OFFLINE', 'false').lower() == 'true'
+# Check bundled files against the manifest's sha256 hashes before loading
+MODEL_VERIFY = os.getenv('MODEL_VERIFY', 'true').lower() != 'false'
+
+def build_profile_text(interests, skills, bio=None):
+    """
+    Build the text a person's profile embedding is generated from.
+
+    This is the only place profile text is assembled, so creates, updates
+    and backfills all embed exactly the same input.
+    """
+    text = ""
+    if interests:
+        text += "Interests: " + ", ".join(interests) + ". "
+    if skills:
+        text += "Skills: " + ", ".join(skills) + ". "
+    if bio:
+        text += "Bio: " + bio
+    return text
+
+def text_hash(text):
+    """sha256 of a text, used as its identity for caching and change detection"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def bundle_path(model_id):
+    """Directory a model is bundled into under MODEL_DIR"""
+    return os.path.join(MODEL_DIR, model_id.replace('/', '__'))
+
+def file_sha256(path):
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def resolve_model(model_id):
+    """
+    Find where to load a model from.
+
+    Returns the bundled directory when it has a manifest (after verifying
+    every file's hash), otherwise the hub id unless offline mode is on.
+
+    Raises:
+        RuntimeError: The bundle is corrupt, or missing in offline mode
+    """
+    path = bundle_path(model_id)
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        if MODEL_OFFLINE:
+            raise RuntimeError(f"{model_id} is not bundled in {MODEL_DIR} and MODEL_OFFLINE is set")
+        logger.warning("%s is not bundled, loading from the Hugging Face hub", model_id)
+        return model_id
+
+    if MODEL_VERIFY:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        for name, expected in manifest['files'].items():
+            file_path = os.path.join(path, name)
+            if not os.path.exists(file_path) or file_sha256(file_path) != expected:
+                raise RuntimeError(f"Bundled {model_id} failed verification at {name}")
+    return path
 
 class EmbeddingGenerator:
     _instance = None
     _model = None
     _cross_encoder = None
+    _ready = threading.Event()
+    _load_lock = threading.Lock()
+    _startup = {}  # Seconds spent in each startup phase
+    _error = None
+    _cache = OrderedDict()  # text hash -> embedding
+    _cache_lock = threading.Lock()
 
     @classmethod
     def initialize(cls):
-        """Initialize the SBERT model and cross-encoder at server start"""
-        if cls._model is None:
-            print("Loading SBERT model...")
-            cls._model = SentenceTransformer('all-MiniLM-L6-v2')
-            print("SBERT model loaded successfully!")
-            
-            print("Loading cross-encoder model...")
-            cls._cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            print("Cross-encoder model loaded successfully!")
+        """Load the SBERT model and cross-encoder and warm them up (blocks until ready)"""
+        with cls._load_lock:
+            if cls._model is not None:
+                return cls._instance
+            try:
+                # Imported here so the process can start serving before torch loads
+                started = time.perf_counter()
+                from sentence_transformers import SentenceTransformer, CrossEncoder
+                cls._startup['import'] = time.perf_counter() - started
+                InferenceExecutor.configure_torch()
+                
+                started = time.perf_counter()
+                logger.info("Loading SBERT model...")
+                model = SentenceTransformer(resolve_model(SBERT_MODEL))
+                logger.info("Loading cross-encoder model...")
+                cross_encoder = CrossEncoder(resolve_model(CROSS_ENCODER_MODEL))
+                cls._startup['load'] = time.perf_counter() - started
+                
+                # The first encode/predict pays for lazy allocations; do it before serving
+                started = time.perf_counter()
+                model.encode("warm up", convert_to_tensor=False)
+                cross_encoder.predict([["warm up", "warm up"]])
+                cls._startup['warm_up'] = time.perf_counter() - started
+                
+                cls._cross_encoder = cross_encoder
+                cls._model = model
+                cls._error = None
+                cls._ready.set()
+                logger.info(
+                    "Models ready",
+                    import_s=round(cls._startup['import'], 2),
+                    load_s=round(cls._startup['load'], 2),
+                    warm_up_s=round(cls._startup['warm_up'], 2)
+                )
+            except Exception as e:
+                cls._error = str(e)
+                logger.exception("Failed to load models: %s", e)
+                raise
         return cls._instance
 
+    @classmethod
+    def initialize_async(cls, started=None):
+        """
+        Load the models on a background thread; see ready().
+
+        Args:
+            started (float, optional): time.perf_counter() at process start,
+                used to log the total time to ready
+        """
+        def load():
+            try:
+                cls.initialize()
+            except Exception:
+                return
+            if started is not None:
+                cls._startup['total'] = time.perf_counter() - started
+                logger.info("Time to ready: %.2fs", cls._startup['total'])
+        threading.Thread(target=load, name='model-loader', daemon=True).start()
+
+    @classmethod
+    def ready(cls):
+        """Whether the models are loaded and warmed up"""
+        return cls._ready.is_set()
+
+    @classmethod
+    def status(cls):
+        """Readiness, the load error if any, and time spent per startup phase"""
+        return {
+            'ready': cls.ready(),
+            'error': cls._error,
+            'startup_seconds': {name: round(value, 3) for name, value in cls._startup.items()}
+        }
+
     @classmethod
     def get_instance(cls):
-        """Get the singleton instance"""
+        """Get the singleton instance, waiting for the models if they are still loading"""
         if cls._instance is None:
             cls._instance = super(EmbeddingGenerator, cls).__new__(cls)
-            if cls._model is None:
-                cls.initialize()
+        if cls._model is None:
+            cls.initialize()
         return cls._instance
 
-    def generate_embedding(self, text):
-        """Generate embedding for a single text"""
+    def generate_embedding(self, text, wait=None):
+        """
+        Generate embedding for a single text
+        
+        Args:
+            text (str): Text to embed
+            wait (float, optional): Longest to wait for an inference slot,
+                see InferenceExecutor.run
+        
+        Raises:
+            InferenceOverloaded: The inference executor is saturated
+        """
         if not text:
             return []
         if self._model is None:
             raise RuntimeError("SBERT model not initialized")
-        embedding = self._model.encode(text, convert_to_tensor=False)
-        return embedding.tolist()
+        
+        # Identical texts share one embedding
+        key = text_hash(text)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                EMBEDDING_CACHE.inc(result='hit')
+                return list(cached)
+        EMBEDDING_CACHE.inc(result='miss')
+        
+        embedding = InferenceExecutor.run('encode', self._model.encode, text, convert_to_tensor=False, wait=wait).tolist()
+        with self._cache_lock:
+            self._cache[key] = tuple(embedding)
+            while len(self._cache) > EMBEDDING_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return embedding
+
+    @classmethod
+    def cached_embedding(cls, text):
+        """The cached embedding of a text, or None without running the model"""
+        with cls._cache_lock:
+            cached = cls._cache.get(text_hash(text))
+        return list(cached) if cached is not None else None
+
+    def generate_embeddings(self, texts, wait=None):
+        """
+        Generate embeddings for a batch of texts in one model call
+        
+        Raises:
+            InferenceOverloaded: The inference executor is saturated
+        """
+        if not texts:
+            return []
+        if self._model is None:
+            raise RuntimeError("SBERT model not initialized")
+        embeddings = InferenceExecutor.run(
+            'encode_batch', self._model.encode, list(texts), batch_size=32, convert_to_tensor=False, wait=wait
+        ).tolist()
+        with self._cache_lock:
+            for text, embedding in zip(texts, embeddings):
+                self._cache[text_hash(text)] = tuple(embedding)
+            while len(self._cache) > EMBEDDING_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return embeddings
 
     def generate_combined_embedding(self, interests, skills, bio=None):
         """Generate a combined embedding from interests, skills, and bio"""
-        # Combine interests, skills, and bio into a single descriptive text
-        combined_text = ""
-        
-        if interests:
-            combined_text += "Interests: " + ", ".join(interests) + ". "
-        
-        if skills:
-            combined_text += "Skills: " + ", ".join(skills) + ". "
-            
-        if bio:
-            combined_text += "Bio: " + bio
-            
+        combined_text = build_profile_text(interests, skills, bio)
         if not combined_text:
             return []
             
@@ -65,18 +263,16 @@ class EmbeddingGenerator:
         pairs = []
         for candidate in candidates:
             # Create descriptive text for candidate
-            candidate_text = ""
-            if candidate.get('interests'):
-                candidate_text += "Interests: " + ", ".join(candidate['interests']) + ". "
-            if candidate.get('skills'):
-                candidate_text += "Skills: " + ", ".join(candidate['skills']) + ". "
-            if candidate.get('bio'):
-                candidate_text += "Bio: " + candidate['bio']
+            candidate_text = build_profile_text(
+                candidate.get('interests'),
+                candidate.get('skills'),
+                candidate.get('bio')
+            )
             
             pairs.append([query_text, candidate_text])
             
         # Get cross-encoder scores
-        scores = self._cross_encoder.predict(pairs)
+        scores = InferenceExecutor.run('predict', self._cross_encoder.predict, pairs)
         
         # Add scores to candidates
         scored_candidates = []
@@ -87,4 +283,16 @@ class EmbeddingGenerator:
                 
         # Sort by score descending
         scored_candidates.sort(key=lambda x: x['similarity'], reverse=True)
-        return scored_candidates 
\ No newline at end of file
+        return scored_candidates 
+
+STARTUP_SECONDS = Gauge(
+    'boardy_startup_seconds',
+    'Seconds spent in each startup phase (import, load, warm_up, total)',
+    ['phase'],
+    callback=lambda: {(phase,): value for phase, value in EmbeddingGenerator._startup.items()}
+)
+EMBEDDING_CACHE = Counter(
+    'boardy_embedding_cache_total',
+    'Embedding cache lookups by result',
+    ['result']
+)
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from pymongo import ReturnDocument
+from database import MongoDB
+from logs import get_logger
+
+logger = get_logger('generations')
+
+# How long a worker trusts the last generation it read before asking
+# MongoDB again: its own writes show at once, other workers' within this
+GENERATION_CHECK_SECONDS = float(os.getenv('GENERATION_CHECK_SECONDS', 1))
+
+class Generations:
+    """
+    Change counters per collection, for versioning cached reads.
+
+    Every write to a collection bumps its counter in the `generations`
+    collection, so a value cached under one generation is known to be
+    current while the generation hasn't moved, in whichever worker (or
+    job) made the write. Reads are cached for GENERATION_CHECK_SECONDS,
+    so checking a generation rarely costs a round trip.
+    """
+    _seen = {}  # collection -> (generation, time.monotonic() when read)
+    _lock = threading.Lock()
+
+    @classmethod
+    def _remember(cls, collection, generation):
+        """Store a generation just read or written, and return the latest known"""
+        with cls._lock:
+            seen = cls._seen.get(collection)
+            # Counters only go up; a slow read must not roll one back
+            if seen is not None and generation < seen[0]:
+                return seen[0]
+            cls._seen[collection] = (generation, time.monotonic())
+            return generation
+
+    @classmethod
+    def bump(cls, collection='persons'):
+        """
+        Record a write to a collection.
+
+        A failed bump is logged rather than raised, since the write it
+        follows has already happened; the local reading is dropped so this
+        worker asks MongoDB again.
+
+        Returns:
+            int: The new generation, or None when the bump failed
+        """
+        try:
+            document = MongoDB().get_db().generations.find_one_and_update(
+                {'_id': collection},
+                {'$inc': {'generation': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logger.warning("Could not bump the %s generation: %s", collection, e)
+            with cls._lock:
+                cls._seen.pop(collection, None)
+            return None
+        return cls._remember(collection, document['generation'])
+
+    @classmethod
+    def current(cls, collection='persons'):
+        """
+        A collection's generation, at most GENERATION_CHECK_SECONDS old.
+
+        Returns:
+            int: The generation, 0 before the first write, or None when
+                MongoDB can't be reached (nothing cached under it is current)
+        """
+        with cls._lock:
+            seen = cls._seen.get(collection)
+        if seen is not None and time.monotonic() - seen[1] < GENERATION_CHECK_SECONDS:
+            return seen[0]
+        try:
+            document = MongoDB().get_db().generations.find_one({'_id': collection})
+        except Exception as e:
+            logger.warning("Could not read the %s generation: %s", collection, e)
+            return None
+        return cls._remember(collection, document['generation'] if document else 0)
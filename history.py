@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logs import get_logger
+
+logger = get_logger('history')
+
+SUMMARY_PROMPT = """You keep notes about a caller for a voice assistant that connects people with like minded peers.
+
+Update the notes with any new facts from the conversation excerpt. Keep every fact from the existing notes unless the caller corrected it. Only record facts about the caller: name, location, interests, skills, and background for their bio, plus anything they asked the assistant to remember.
+
+Reply with the updated notes only, as short bullet points that start with a label, for example "- Location: Raleigh NC", "- Interests: photography, hiking", "- Skills: web dev", "- Bio: ...". If there are no facts yet, reply with "None"."""
+
+# Marks where the running summary starts in the system message
+SUMMARY_HEADER = "What you already know about the caller from earlier in this call:"
+
+class HistoryManager:
+    """
+    Fits a call's conversation history into a prompt token budget.
+
+    The most recent turns are sent verbatim. Older turns are replaced by a
+    running summary of the profile facts extracted from them, which is
+    updated incrementally in the background so summarization never adds
+    latency to a turn. Older messages the summary hasn't caught up with yet
+    are still sent verbatim, budget permitting, so nothing is lost while the
+    summary is being computed.
+    """
+    # Total prompt token budget, including the system prompt
+    TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 2500))
+    # Number of most recent user/assistant turns that are always sent verbatim
+    RECENT_TURNS = int(os.getenv('HISTORY_RECENT_TURNS', 4))
+    SUMMARY_MODEL = os.getenv('HISTORY_SUMMARY_MODEL', 'llama-3.1-8b-instant')
+    # Drop summaries for calls that never sent a completed event
+    STATE_TTL = 3600
+
+    def __init__(self, client):
+        """
+        Args:
+            client: Groq client used to compute summaries
+        """
+        self.client = client
+        self._summaries = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='history-summary')
+
+    @staticmethod
+    def estimate_tokens(messages):
+        """Cheap token estimate: ~4 characters per token plus per-message overhead"""
+        return sum(len(msg.get('content') or '') // 4 + 4 for msg in messages)
+
+    def build_messages(self, call_uuid, system_prompt, history, user_message):
+        """
+        Build the message list for a turn within the token budget.
+
+        Args:
+            call_uuid (str): The call the turn belongs to
+            system_prompt (str): The assistant's system prompt
+            history (list): Full conversation history for the call
+            user_message (str): What the caller just said
+
+        Returns:
+            list: Messages to send to the LLM
+        """
+        recent_count = self.RECENT_TURNS * 2
+        older = history[:-recent_count] if len(history) > recent_count else []
+        recent = history[len(older):]
+
+        with self._lock:
+            self._prune()
+            state = self._summaries.setdefault(call_uuid, {
+                'summary': '',
+                'covered': 0,
+                'pending': False
+            })
+            state['touched'] = time.monotonic()
+            summary = state['summary']
+            covered = min(state['covered'], len(older))
+
+            # Fold newly aged-out messages into the summary off the critical path
+            if covered < len(older) and not state['pending']:
+                state['pending'] = True
+                self._executor.submit(self._update_summary, call_uuid, summary, covered, older[covered:])
+
+        system_content = system_prompt
+        if summary:
+            system_content += f"\n\n{SUMMARY_HEADER}\n{summary}"
+
+        head = [{"role": "system", "content": system_content}]
+        tail = recent + [{"role": "user", "content": user_message}]
+        uncovered = list(older[covered:])
+
+        # Drop the oldest verbatim messages until the prompt fits
+        while uncovered and self.estimate_tokens(head + uncovered + tail) > self.TOKEN_BUDGET:
+            uncovered.pop(0)
+        while len(tail) > 1 and self.estimate_tokens(head + tail) > self.TOKEN_BUDGET:
+            tail.pop(0)
+
+        messages = head + uncovered + tail
+        logger.info(
+            "~%d prompt tokens (%d history messages, %d summarized, %d verbatim)",
+            self.estimate_tokens(messages), len(history), covered, len(uncovered) + len(tail) - 1,
+            call_uuid=call_uuid
+        )
+        return messages
+
+    def discard(self, call_uuid):
+        """Forget the summary for a call once it has completed"""
+        with self._lock:
+            self._summaries.pop(call_uuid, None)
+
+    def _prune(self):
+        """Drop summaries for stale calls (caller must hold the lock)"""
+        cutoff = time.monotonic() - self.STATE_TTL
+        for call_uuid in [k for k, v in self._summaries.items() if v['touched'] < cutoff]:
+            del self._summaries[call_uuid]
+
+    def _update_summary(self, call_uuid, summary, covered, messages):
+        """Fold messages into the call's running summary"""
+        try:
+            excerpt = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+            response = self.client.chat.completions.create(
+                model=self.SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"Existing notes:\n{summary or 'None'}\n\nConversation excerpt:\n{excerpt}"}
+                ],
+                temperature=0.0,
+                max_completion_tokens=300,
+                stream=False
+            )
+            new_summary = response.choices[0].message.content.strip()
+            if new_summary.lower() == 'none':
+                new_summary = ''
+        except Exception as e:
+            logger.warning("Error updating summary: %s", e, call_uuid=call_uuid)
+            with self._lock:
+                state = self._summaries.get(call_uuid)
+                if state is not None:
+                    state['pending'] = False
+            return
+
+        with self._lock:
+            state = self._summaries.get(call_uuid)
+            if state is None:
+                return
+            state['summary'] = new_summary
+            state['covered'] = covered + len(messages)
+            state['pending'] = False
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from logs import get_logger
+from metrics import Counter, Gauge, Histogram
+
+logger = get_logger('inference')
+
+class InferenceOverloaded(Exception):
+    """Raised when the inference executor can't take more work"""
+    pass
+
+class InferenceExecutor:
+    """
+    Admission control for model inference (encode and predict).
+
+    At most SLOTS inferences run at once per worker process, each using
+    TORCH_THREADS intra-op threads, so concurrent requests queue instead of
+    oversubscribing the CPU. At most QUEUE_LIMIT callers wait for a slot,
+    each for up to QUEUE_TIMEOUT seconds; anyone beyond that is rejected
+    straight away with InferenceOverloaded so the endpoint can shed load
+    long before the gunicorn timeout.
+    """
+    SLOTS = int(os.getenv('INFERENCE_SLOTS', 1))
+    QUEUE_LIMIT = int(os.getenv('INFERENCE_QUEUE_LIMIT', 4))
+    QUEUE_TIMEOUT = float(os.getenv('INFERENCE_QUEUE_TIMEOUT', 2.0))
+    # Split the cores between every slot of every gunicorn worker on the host
+    TORCH_THREADS = int(os.getenv(
+        'TORCH_NUM_THREADS',
+        max(1, (os.cpu_count() or 1) // (SLOTS * int(os.getenv('WEB_CONCURRENCY', 2))))
+    ))
+
+    _slots = threading.BoundedSemaphore(SLOTS)
+    _lock = threading.Lock()
+    _waiting = 0
+    _running = 0
+
+    @classmethod
+    def configure_torch(cls):
+        """Pin torch's thread pools; call once torch is imported, before the first inference"""
+        import torch
+        torch.set_num_threads(cls.TORCH_THREADS)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before torch runs any parallel work
+            pass
+        logger.info(
+            "Inference executor configured",
+            slots=cls.SLOTS,
+            queue_limit=cls.QUEUE_LIMIT,
+            torch_threads=cls.TORCH_THREADS
+        )
+
+    @classmethod
+    def run(cls, operation, fn, *args, wait=None, **kwargs):
+        """
+        Run an inference call in one of the executor's slots.
+
+        Args:
+            operation (str): Label for metrics, e.g. 'encode' or 'predict'
+            fn (callable): The model call
+            wait (float, optional): Longest to wait for a slot, defaults to
+                QUEUE_TIMEOUT; 0 runs only if a slot is free right now
+
+        Raises:
+            InferenceOverloaded: The queue is full or no slot freed up in time
+        """
+        wait = cls.QUEUE_TIMEOUT if wait is None else wait
+
+        # Fast path: a slot is free
+        acquired = cls._slots.acquire(blocking=False)
+        if not acquired:
+            with cls._lock:
+                if wait <= 0 or cls._waiting >= cls.QUEUE_LIMIT:
+                    INFERENCE_REJECTIONS.inc(operation=operation, reason='queue_full' if wait > 0 else 'busy')
+                    raise InferenceOverloaded(f"Inference queue is full ({cls._waiting} waiting)")
+                cls._waiting += 1
+            started = time.perf_counter()
+            try:
+                acquired = cls._slots.acquire(timeout=wait)
+            finally:
+                with cls._lock:
+                    cls._waiting -= 1
+            INFERENCE_WAIT_SECONDS.observe(time.perf_counter() - started, operation=operation)
+            if not acquired:
+                INFERENCE_REJECTIONS.inc(operation=operation, reason='timeout')
+                raise InferenceOverloaded(f"No inference slot free after {wait:.1f}s")
+
+        with cls._lock:
+            cls._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with cls._lock:
+                cls._running -= 1
+            cls._slots.release()
+
+    @classmethod
+    def state(cls):
+        with cls._lock:
+            return {'waiting': cls._waiting, 'running': cls._running}
+
+INFERENCE_REJECTIONS = Counter(
+    'boardy_inference_rejections_total',
+    'Inference calls rejected because the executor was saturated',
+    ['operation', 'reason']
+)
+INFERENCE_WAIT_SECONDS = Histogram(
+    'boardy_inference_queue_wait_seconds',
+    'Time inference calls waited for a free slot',
+    ['operation']
+)
+INFERENCE_QUEUE = Gauge(
+    'boardy_inference_queue',
+    'Inference calls waiting for a slot and running in one',
+    ['state'],
+    callback=lambda: {(state,): value for state, value in InferenceExecutor.state().items()}
+)
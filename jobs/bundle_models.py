@@ -0,0 +1,44 @@
+import json
+import os
+import shutil
+import sys
+import time
+from embeddings import SBERT_MODEL, CROSS_ENCODER_MODEL, MODEL_DIR, MANIFEST_NAME, bundle_path, file_sha256
+
+def bundle(model_id, loader):
+    """
+    Download a model and save it under MODEL_DIR with a manifest of file hashes.
+
+    The model is written to a temporary directory first and renamed into
+    place, so an interrupted build never leaves a half-written bundle that
+    passes the manifest check.
+    """
+    path = bundle_path(model_id)
+    staging = path + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+
+    started = time.perf_counter()
+    loader(model_id).save(staging)
+
+    files = {}
+    for root, _, names in os.walk(staging):
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            files[os.path.relpath(file_path, staging)] = file_sha256(file_path)
+    with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+        json.dump({'model': model_id, 'files': files}, f, indent=2, sort_keys=True)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    print(f"Bundled {model_id} ({len(files)} files) into {path} in {time.perf_counter() - started:.1f}s")
+
+def main():
+    from sentence_transformers import SentenceTransformer, CrossEncoder
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    bundle(SBERT_MODEL, SentenceTransformer)
+    bundle(CROSS_ENCODER_MODEL, CrossEncoder)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
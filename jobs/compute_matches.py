@@ -0,0 +1,98 @@
+"""
+Rebuild the matches collection: the top-k most similar people for everyone.
+
+    python -m jobs.compute_matches [--top-k 20] [--workers 8] [--block-size 512]
+
+The normalized embedding matrix is multiplied against itself a block of
+rows at a time, keeping each row's top k, with blocks spread over a
+thread pool (numpy releases the GIL in the matrix product and the
+partial sort, so the blocks run on separate cores). Each block's lists
+are written as soon as it finishes. Between runs the API keeps the table
+current incrementally, see matches.MatchTable.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import ReplaceOne
+from database import MongoDB
+from matches import MATCHES_TOP_K, match_document
+
+# Keep each block's score matrix under this many bytes
+BLOCK_MEMORY_BYTES = 64 * 1024 * 1024
+
+def load_embeddings(db):
+    """Phone numbers and the unit-normalized embedding matrix of everyone with an embedding"""
+    phones = []
+    vectors = []
+    for person in db.persons.find(
+        {'vectorEmbedding': {'$exists': True, '$ne': None}},
+        {'_id': 0, 'phoneNumber': 1, 'vectorEmbedding': 1}
+    ):
+        vector = np.asarray(person['vectorEmbedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            phones.append(person['phoneNumber'])
+            vectors.append(vector / norm)
+    return np.array(phones, dtype=object), np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
+
+def top_k_block(matrix, start, stop, top_k):
+    """Top-k neighbor rows and scores for rows start:stop, leaving each row out of its own list"""
+    scores = matrix[start:stop] @ matrix.T
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    keep = min(top_k, matrix.shape[0] - 1)
+    if keep <= 0:
+        return np.empty((stop - start, 0), dtype=np.int64), np.empty((stop - start, 0), dtype=np.float32)
+    top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute every person's top-k matches")
+    parser.add_argument('--top-k', type=int, default=MATCHES_TOP_K)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--block-size', type=int, default=None, help="rows per block (default: fit the memory budget)")
+    args = parser.parse_args()
+
+    db = MongoDB().get_db()
+    started = time.perf_counter()
+    phones, matrix = load_embeddings(db)
+    total = len(phones)
+    block_size = args.block_size or max(1, min(4096, BLOCK_MEMORY_BYTES // (4 * max(total, 1))))
+    print(f"Loaded {total} embeddings in {time.perf_counter() - started:.1f}s; blocks of {block_size} rows, {args.workers} workers")
+
+    computed_at = datetime.now(timezone.utc)
+
+    def run_block(start):
+        stop = min(start + block_size, total)
+        rows, scores = top_k_block(matrix, start, stop, args.top_k)
+        operations = []
+        for i in range(stop - start):
+            scored = [(score, phones[row]) for row, score in zip(rows[i], scores[i]) if score > 0]
+            operations.append(ReplaceOne(
+                {'_id': phones[start + i]},
+                match_document(phones[start + i], scored, computed_at, top_k=args.top_k),
+                upsert=True
+            ))
+        if operations:
+            db.matches.bulk_write(operations, ordered=False)
+        return stop - start
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for count in pool.map(run_block, range(0, total, block_size)):
+            done += count
+            elapsed = time.perf_counter() - started
+            print(f"{done}/{total} persons, {done / elapsed:.0f} persons/sec")
+
+    # Lists of people who no longer have an embedding
+    removed = db.matches.delete_many({'computedAt': {'$lt': computed_at}}).deleted_count
+    print(f"Done in {time.perf_counter() - started:.1f}s, removed {removed} stale lists")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
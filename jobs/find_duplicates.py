@@ -0,0 +1,101 @@
+"""
+Find near-duplicate persons in bulk and flag (or merge) their clusters.
+
+    python -m jobs.find_duplicates [--threshold 0.95] [--merge]
+
+Every embedding gets its LSH band keys; pairs sharing a band are checked
+by exact cosine and joined into clusters with union-find. Each member of
+a cluster gets duplicateCluster = the phone number of its earliest
+created member, and everyone gets their lshBands for the incremental
+check on later writes. With --merge every member but that earliest one
+also gets mergedInto, which leaves it out of search; profiles themselves
+are not changed or deleted.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import UpdateOne
+from database import MongoDB
+from dedup import DUPLICATE_THRESHOLD, LSHSignature, clusters_from_pairs, lsh_duplicate_pairs
+from generations import Generations
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag or merge near-duplicate persons")
+    parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument('--merge', action='store_true', help="hide every duplicate but the earliest from search")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    db = MongoDB().get_db('profiles')
+    started = time.perf_counter()
+    people = []
+    vectors = []
+    for person in db.persons.find(
+        {'vectorEmbedding': {'$exists': True, '$ne': None}},
+        {'_id': 1, 'phoneNumber': 1, 'vectorEmbedding': 1, 'createdAt': 1}
+    ):
+        vector = np.asarray(person['vectorEmbedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            people.append(person)
+            vectors.append(vector / norm)
+    if not people:
+        print("No embeddings to check")
+        return 0
+    matrix = np.vstack(vectors)
+    loaded = time.perf_counter()
+
+    pairs, candidates = lsh_duplicate_pairs(matrix, args.threshold)
+    roots = clusters_from_pairs(len(people), pairs)
+    keys = LSHSignature.band_keys(matrix)
+    found = time.perf_counter()
+
+    # Earliest created member of each cluster
+    canonical = {}
+    epoch = datetime.min.replace(tzinfo=timezone.utc)
+    for row, root in enumerate(roots):
+        person = people[row]
+        created = person.get('createdAt') or epoch
+        created = created if created.tzinfo else created.replace(tzinfo=timezone.utc)
+        best = canonical.get(root)
+        if best is None or (created, person['phoneNumber']) < best[0]:
+            canonical[root] = ((created, person['phoneNumber']), person['phoneNumber'])
+    sizes = np.bincount(roots, minlength=len(people))
+
+    operations = []
+    flagged = merged = 0
+    for row, person in enumerate(people):
+        root = roots[row]
+        update = {'$set': {'lshBands': keys[row].tolist()}, '$unset': {}}
+        if sizes[root] > 1:
+            cluster = canonical[root][1]
+            update['$set']['duplicateCluster'] = cluster
+            flagged += 1
+            if args.merge and person['phoneNumber'] != cluster:
+                update['$set']['mergedInto'] = cluster
+                merged += 1
+            else:
+                update['$unset']['mergedInto'] = ''
+        else:
+            update['$unset'] = {'duplicateCluster': '', 'mergedInto': ''}
+        if not update['$unset']:
+            del update['$unset']
+        operations.append(UpdateOne({'_id': person['_id']}, update))
+        if len(operations) >= args.batch_size:
+            db.persons.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.persons.bulk_write(operations, ordered=False)
+    Generations.bump()
+
+    print(
+        f"{len(people)} persons: {candidates} candidate pairs, {len(pairs)} duplicate pairs, "
+        f"{int((sizes > 1).sum())} clusters, {flagged} flagged, {merged} merged; "
+        f"load {loaded - started:.1f}s, LSH {found - loaded:.1f}s, write {time.perf_counter() - found:.1f}s"
+    )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""
+Fill in locationInfo and geo for persons saved before locations were normalized,
+or for everyone after the gazetteer in data/ changes.
+
+    python -m jobs.normalize_locations [--all] [--batch-size 500]
+"""
+import argparse
+import sys
+from pymongo import UpdateOne
+from database import MongoDB
+from generations import Generations
+from locations import location_fields
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize person locations with the bundled gazetteer")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--all', action='store_true', help="re-normalize persons that already have locationInfo")
+    args = parser.parse_args()
+
+    db = MongoDB().get_db('profiles')
+    query = {} if args.all else {'locationInfo': {'$exists': False}}
+    operations = []
+    processed = located = 0
+    for person in db.persons.find(query, {'location': 1}):
+        fields = location_fields(person.get('location', ''))
+        operations.append(UpdateOne({'_id': person['_id']}, {'$set': fields}))
+        processed += 1
+        located += fields['locationInfo'] is not None
+        if len(operations) >= args.batch_size:
+            db.persons.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.persons.bulk_write(operations, ordered=False)
+    Generations.bump()
+
+    print(f"Normalized {processed} persons, {located} matched the gazetteer")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Re-embed every person, e.g. after changing the embedding model or build_profile_text.
+
+    python -m jobs.reembed [--workers 4] [--batch-size 256] [--shadow] [--restart] [--force]
+
+Persons are streamed in _id order and encoded in batches across a process
+pool, each worker holding its own copy of the model. Progress is
+checkpointed in the jobs collection after every batch, so an interrupted
+run picks up where it stopped.
+
+With --shadow the new embeddings go to vectorEmbeddingNext (and
+profileHashNext / embeddingVersionNext) while search keeps using the live
+fields. Once every person has one, a single server-side update copies them
+into the live fields; run the job again without --shadow afterwards to
+catch anyone whose profile changed in the meantime.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from database import MongoDB
+from generations import Generations
+from embeddings import SBERT_MODEL, EMBEDDING_VERSION, build_profile_text, text_hash, resolve_model
+from profiles import EMBEDDING_READY, SHADOW_FIELDS, SHADOW_ONLY_FIELDS
+
+LIVE_FIELDS = ('vectorEmbedding', 'profileHash', 'embeddingVersion')
+
+_model = None
+
+def _init_worker(threads):
+    """Load one model copy per worker process"""
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(resolve_model(SBERT_MODEL))
+
+def _encode(batch):
+    """
+    Encode a batch of (key, text, hash) in a worker; returns (key, hash, embedding) for each.
+    An empty profile gets no embedding, as in profile_embedding_fields.
+    """
+    texts = [text for _, text, _ in batch if text]
+    embeddings = iter(_model.encode(texts, batch_size=64, convert_to_numpy=True).tolist() if texts else [])
+    return [(key, profile_hash, next(embeddings) if text else None) for key, text, profile_hash in batch]
+
+class ReembedJob:
+    """One run of the backfill, resumable through its checkpoint document"""
+
+    def __init__(self, batch_size, workers, shadow=False, force=False, restart=False):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.shadow = shadow
+        self.force = force
+        self.db = MongoDB().get_db()
+        self.fields = SHADOW_FIELDS if shadow else LIVE_FIELDS
+        self.checkpoint_id = f"reembed:{'shadow' if shadow else 'live'}:{EMBEDDING_VERSION}"
+        if restart:
+            self.db.jobs.delete_one({'_id': self.checkpoint_id})
+        self.checkpoint = self.db.jobs.find_one({'_id': self.checkpoint_id}) or {
+            '_id': self.checkpoint_id,
+            'last_id': None,
+            'processed': 0,
+            'embedded': 0,
+            'skipped': 0,
+            'conflicts': 0,
+            'status': 'running',
+            'started_at': datetime.now(timezone.utc)
+        }
+        # Bounds how many batches are read ahead of the workers
+        self._in_flight = threading.Semaphore(workers * 2)
+        self._stopped = False
+
+    def is_current(self, person, profile_hash):
+        """Whether the target fields already hold an embedding of this text by this model"""
+        embedding_field, hash_field, version_field = self.fields
+        return (
+            person.get(hash_field) == profile_hash
+            and person.get(version_field) == EMBEDDING_VERSION
+            # An empty profile's current embedding is None
+            and (bool(person.get(embedding_field)) or profile_hash == text_hash(''))
+        )
+
+    def read_batches(self):
+        """Stream persons after the checkpoint in _id order, yielding batches that need encoding"""
+        last_id = self.checkpoint['last_id']
+        projection = {'interests': 1, 'skills': 1, 'bio': 1, 'updatedAt': 1, **{field: 1 for field in self.fields}}
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            persons = list(self.db.persons.find(query, projection).sort('_id', 1).limit(self.batch_size))
+            if not persons:
+                return
+            last_id = persons[-1]['_id']
+
+            batch = []
+            skipped = 0
+            for person in persons:
+                text = build_profile_text(person.get('interests'), person.get('skills'), person.get('bio'))
+                profile_hash = text_hash(text)
+                if not self.force and self.is_current(person, profile_hash):
+                    skipped += 1
+                    continue
+                # Only what the write needs goes to the worker and back
+                batch.append(((person['_id'], person.get('updatedAt')), text, profile_hash))
+
+            self._in_flight.acquire()
+            if self._stopped:
+                return
+            # Carry the batch's last _id so the checkpoint covers skipped persons too
+            yield batch, last_id, len(persons), skipped
+
+    def write(self, encoded):
+        """Write a batch of embeddings, skipping persons edited since they were read"""
+        embedding_field, hash_field, version_field = self.fields
+        operations = []
+        for (person_id, updated_at), profile_hash, embedding in encoded:
+            fields = {
+                embedding_field: embedding or None,
+                hash_field: profile_hash,
+                version_field: EMBEDDING_VERSION
+            }
+            if self.shadow:
+                # Lets the switch tell whether the profile changed after this was embedded
+                fields['sourceUpdatedAtNext'] = updated_at
+            else:
+                # Settles anyone still waiting on the embedding queue for this text
+                fields['embeddingStatus'] = EMBEDDING_READY
+            operations.append(UpdateOne({'_id': person_id, 'updatedAt': updated_at}, {'$set': fields}))
+        if not operations:
+            return 0
+        result = self.db.persons.bulk_write(operations, ordered=False)
+        if not self.shadow:
+            Generations.bump()
+        return len(operations) - result.matched_count
+
+    def save_checkpoint(self, **changes):
+        self.checkpoint.update(changes, updated_at=datetime.now(timezone.utc))
+        self.db.jobs.replace_one({'_id': self.checkpoint_id}, self.checkpoint, upsert=True)
+
+    def run(self):
+        if self.checkpoint.get('status') == 'done':
+            print(f"{self.checkpoint_id} already finished, use --restart to run it again")
+            return self.checkpoint
+
+        total = self.db.persons.count_documents({})
+        print(
+            f"Re-embedding {total} persons into {self.fields[0]} with {self.workers} workers, "
+            f"batches of {self.batch_size}, resuming after {self.checkpoint['last_id']}"
+        )
+
+        started = time.perf_counter()
+        processed_this_run = 0
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        context = multiprocessing.get_context('spawn')
+
+        with context.Pool(self.workers, initializer=_init_worker, initargs=(threads,)) as pool:
+            try:
+                # imap keeps batch order, so the checkpoint only ever moves forward
+                for encoded, last_id, count, skipped in pool.imap(_encode_with_position, self.read_batches()):
+                    conflicts = self.write(encoded)
+                    self._in_flight.release()
+                    processed_this_run += count
+                    self.save_checkpoint(
+                        last_id=last_id,
+                        processed=self.checkpoint['processed'] + count,
+                        embedded=self.checkpoint['embedded'] + len(encoded) - conflicts,
+                        skipped=self.checkpoint['skipped'] + skipped,
+                        conflicts=self.checkpoint['conflicts'] + conflicts
+                    )
+                    elapsed = time.perf_counter() - started
+                    print(
+                        f"{self.checkpoint['processed']}/{total} persons, "
+                        f"{processed_this_run / elapsed:.1f} profiles/sec"
+                    )
+            except BaseException:
+                # Unblock the reader so the pool can shut down; the checkpoint is already saved
+                self._stopped = True
+                self._in_flight.release()
+                raise
+
+        if self.shadow:
+            self.switch()
+        self.save_checkpoint(status='done')
+
+        elapsed = time.perf_counter() - started
+        print(
+            f"Done in {elapsed:.1f}s: {self.checkpoint['embedded']} embedded, {self.checkpoint['skipped']} "
+            f"already current, {self.checkpoint['conflicts']} edited during the run, "
+            f"{processed_this_run / elapsed if elapsed else 0:.1f} profiles/sec"
+        )
+        return self.checkpoint
+
+    def switch(self):
+        """Copy shadow embeddings into the live fields in one server-side update"""
+        result = self.db.persons.update_many(
+            {
+                'embeddingVersionNext': EMBEDDING_VERSION,
+                # Only where the profile hasn't been edited since it was embedded
+                '$expr': {'$eq': ['$updatedAt', '$sourceUpdatedAtNext']}
+            },
+            [
+                {'$set': {
+                    'vectorEmbedding': '$vectorEmbeddingNext',
+                    'profileHash': '$profileHashNext',
+                    'embeddingVersion': '$embeddingVersionNext',
+                    'embeddingStatus': EMBEDDING_READY
+                }},
+                {'$unset': SHADOW_ONLY_FIELDS}
+            ]
+        )
+        Generations.bump()
+        print(f"Switched {result.modified_count} persons to the new embeddings")
+
+def _encode_with_position(item):
+    batch, last_id, count, skipped = item
+    return _encode(batch), last_id, count, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed every person in batches across a process pool")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--shadow', action='store_true', help="write to the shadow fields and switch over at the end")
+    parser.add_argument('--force', action='store_true', help="re-embed even persons whose embedding is current")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and start from the beginning")
+    args = parser.parse_args()
+
+    ReembedJob(args.batch_size, args.workers, shadow=args.shadow, force=args.force, restart=args.restart).run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
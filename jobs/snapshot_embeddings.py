@@ -0,0 +1,52 @@
+"""
+Write the on-disk embedding snapshot from MongoDB, or compact it.
+
+    python -m jobs.snapshot_embeddings [--compact] [--stats]
+
+Without options every embedding is read from MongoDB and written to a new
+snapshot generation, replacing the old one and its delta; run it when
+deploying to a fresh host (or after jobs.reembed) so the workers' first
+index builds map vectors instead of loading them. --compact folds the
+delta into the snapshot now rather than waiting for it to fill up.
+"""
+import argparse
+import sys
+import time
+import numpy as np
+from database import MongoDB
+from profiles import EMBEDDING_READY
+from snapshot import EmbeddingSnapshot, embedding_stamp
+
+def main():
+    parser = argparse.ArgumentParser(description="Write or compact the embedding snapshot")
+    parser.add_argument('--compact', action='store_true', help="fold the delta into the snapshot")
+    parser.add_argument('--stats', action='store_true', help="only print the snapshot's stats")
+    args = parser.parse_args()
+
+    if not EmbeddingSnapshot.enabled():
+        print("EMBEDDING_SNAPSHOT_DIR is empty; the snapshot is disabled")
+        return 1
+    started = time.perf_counter()
+    if args.compact:
+        EmbeddingSnapshot.compact()
+    elif not args.stats:
+        phones, regions, stamps, vectors = [], [], [], []
+        for person in MongoDB().get_db('analytics').persons.find(
+            # Until it is ready a person's vector predates their profileHash, so it would get the wrong stamp
+            {'vectorEmbedding': {'$exists': True, '$ne': None}, 'embeddingStatus': {'$in': [EMBEDDING_READY, None]}},
+            {'_id': 0, 'phoneNumber': 1, 'vectorEmbedding': 1, 'profileHash': 1, 'embeddingVersion': 1, 'locationInfo': 1}
+        ):
+            phones.append(person['phoneNumber'])
+            regions.append((person.get('locationInfo') or {}).get('region'))
+            stamps.append(embedding_stamp(person.get('profileHash'), person.get('embeddingVersion')))
+            vectors.append(np.asarray(person['vectorEmbedding'], dtype=np.float32))
+        if not vectors:
+            print("No embeddings to snapshot")
+            return 0
+        print(f"Loaded {len(vectors)} embeddings in {time.perf_counter() - started:.1f}s")
+        EmbeddingSnapshot.replace(phones, regions, stamps, np.vstack(vectors))
+    print(f"Done in {time.perf_counter() - started:.1f}s: {EmbeddingSnapshot.stats()}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
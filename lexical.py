@@ -0,0 +1,131 @@
+import math
+import os
+import re
+from collections import Counter as TermCounts
+import numpy as np
+
+# BM25 parameters
+BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+
+# Skills and interests are short, deliberate lists; a hit there counts for more than one in the bio
+FIELD_WEIGHTS = {'skills': 2.0, 'interests': 2.0, 'bio': 1.0}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+#]*")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i i'm in into is it its me my of on or our so "
+    "that the their them they this to was we with you your who want looking someone people".split()
+)
+
+def tokenize(text):
+    """
+    Normalized terms of a text: lowercase words without stopwords, plus
+    adjacent word pairs joined with '_', so an exact multi-word skill such
+    as "penetration testing" matches more strongly than its words apart.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Terms, with repeats
+    """
+    words = [word for word in TOKEN_PATTERN.findall(str(text or '').lower()) if word not in STOPWORDS]
+    return words + [f"{first}_{second}" for first, second in zip(words, words[1:])]
+
+def person_terms(person):
+    """Field-weighted term frequencies of a person's interests, skills and bio"""
+    terms = TermCounts()
+    for field, weight in FIELD_WEIGHTS.items():
+        value = person.get(field) or []
+        # Tokenize list items one at a time so pairs never span two items
+        for item in ([value] if isinstance(value, str) else value):
+            for term in tokenize(item):
+                terms[term] += weight
+    return terms
+
+class LexicalIndex:
+    """
+    BM25 inverted index over one partition of people.
+
+    Postings map each term to the rows that contain it and their weighted
+    term frequencies. Document frequencies and the average length come
+    from the whole index, so scores are comparable across partitions.
+    """
+
+    def __init__(self, person_terms_list, document_frequencies, total_documents, average_length):
+        self.total_documents = total_documents
+        self.document_frequencies = document_frequencies
+        self.lengths = np.array([sum(terms.values()) for terms in person_terms_list], dtype=np.float32)
+        self.length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / (average_length or 1.0))
+
+        postings = {}
+        for row, terms in enumerate(person_terms_list):
+            for term, frequency in terms.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(frequency)
+        self.postings = {
+            term: (np.array(rows, dtype=np.int32), np.array(frequencies, dtype=np.float32))
+            for term, (rows, frequencies) in postings.items()
+        }
+
+    def idf(self, term):
+        df = self.document_frequencies.get(term, 0)
+        return math.log(1 + (self.total_documents - df + 0.5) / (df + 0.5))
+
+    def score(self, terms):
+        """
+        BM25 scores of every row in the partition for the query terms.
+
+        Args:
+            terms (list): Query terms from tokenize()
+
+        Returns:
+            np.ndarray: One score per row, 0 where no term matched
+        """
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        for term in set(terms):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            rows, frequencies = posting
+            scores[rows] += self.idf(term) * frequencies * (BM25_K1 + 1) / (frequencies + self.length_norm[rows])
+        return scores
+
+    def candidates(self, terms):
+        """Rows containing any of the query terms"""
+        postings = [self.postings[term][0] for term in set(terms) if term in self.postings]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(postings))
+
+def document_frequencies(person_terms_list):
+    """How many people each term appears in, and the average weighted length"""
+    frequencies = TermCounts()
+    total_length = 0.0
+    for terms in person_terms_list:
+        frequencies.update(terms.keys())
+        total_length += sum(terms.values())
+    return frequencies, total_length / len(person_terms_list) if person_terms_list else 0.0
+
+def reciprocal_rank_fusion(*score_lists, k=60):
+    """
+    Fuse several score arrays over the same items by reciprocal rank.
+
+    Items with a score <= 0 in a list aren't ranked in it and get nothing
+    from that list.
+
+    Args:
+        score_lists (np.ndarray): Scores, one array per ranking
+        k (int): RRF constant; larger flattens the difference between ranks
+
+    Returns:
+        np.ndarray: Fused score per item
+    """
+    fused = np.zeros(len(score_lists[0]), dtype=np.float64)
+    for scores in score_lists:
+        order = np.argsort(-scores, kind='stable')
+        ranks = np.empty(len(scores), dtype=np.float64)
+        ranks[order] = np.arange(1, len(scores) + 1)
+        fused += np.where(scores > 0, 1.0 / (k + ranks), 0.0)
+    return fused
@@ -3,9 +3,15 @@ import os
 import json
 import requests
 from typing import Generator, Optional
-from datetime import datetime, timezone
+from logs import get_logger
 from dotenv import load_dotenv
+from speculative import SpeculativeSearch
+from prefetch import CallerPrefetch
+from tracing import Tracer
+from router import ModelRouter
+from resilience import Resilience, Deadline, DeadlineExceeded, CircuitOpenError
 import re
+import time
 
 # Load environment variables
 load_dotenv()
@@ -13,19 +19,22 @@ load_dotenv()
 # Server URL for API calls
 SERVER_URL = "https://dolphin-app-bsmq7.ondigitalocean.app"
 
-def log(message):
-    """Helper function for consistent logging"""
-    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-    print(f"[{timestamp}] [LLM] {message}")
+# Spoken when Groq is degraded or the turn runs out of time
+FALLBACK_REPLY = "Sorry, I zoned out for a second there. Could you say that again?"
+
+logger = get_logger('llm')
 
 class LLMGeneration:
     def __init__(self):
         """Initialize the LLM generation class with Groq client."""
         self.client = Groq(
-            api_key=os.getenv('GROQ_API_KEY')
+            api_key=os.getenv('GROQ_API_KEY'),
+            # Retries and timeouts are handled by the resilience layer
+            max_retries=0
         )
-        self.model = "llama-3.3-70b-versatile"
-        log(f"Initialized LLM with model: {self.model}")
+        self.router = ModelRouter()
+        self.model = self.router.LARGE_MODEL
+        logger.info("Initialized LLM with models: %s (fast), %s (large)", self.router.FAST_MODEL, self.router.LARGE_MODEL)
 
     def get_system_prompt(self) -> str:
         """Return the system prompt for Boardy."""
@@ -68,7 +77,9 @@ You only have 1 task here, and it is to collect the user's background info, then
                          messages: list, 
                          temperature: float = 1.0,
                          max_tokens: int = 1024,
-                         top_p: float = 1.0) -> Generator:
+                         top_p: float = 1.0,
+                         call_uuid: Optional[str] = None,
+                         deadline: Optional[Deadline] = None) -> Generator:
         """
         Generate a streaming response from the LLM.
         
@@ -77,22 +88,27 @@ You only have 1 task here, and it is to collect the user's background info, then
             temperature (float): Controls randomness in the response
             max_tokens (int): Maximum number of tokens to generate
             top_p (float): Controls diversity via nucleus sampling
+            call_uuid (str, optional): Call this turn belongs to, used to reuse
+                a speculative similarity search for the call
+            deadline (Deadline, optional): Latency budget for the turn
             
         Returns:
             Generator: A generator that yields response chunks
         """
+        deadline = deadline or Deadline(Resilience.TURN_BUDGET)
         try:
-            log("Making request to Groq API")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=temperature,
-                max_completion_tokens=max_tokens,
-                top_p=top_p,
-                stream=False
-            )
+            # Small talk goes to the fast model; likely tool calls go to the large one
+            model, reason = self.router.choose_model(messages)
+            response_content = self._complete(messages, model, reason, temperature, max_tokens, top_p, deadline)
             
-            response_content = response.choices[0].message.content
+            if model != self.router.LARGE_MODEL:
+                failure = self.router.validate(response_content)
+                if failure:
+                    logger.info("Fast model reply failed validation (%s), escalating", failure, call_uuid=call_uuid)
+                    response_content = self._complete(
+                        messages, self.router.LARGE_MODEL, f'escalated_{failure}',
+                        temperature, max_tokens, top_p, deadline
+                    )
             
             # Try to find and parse JSON tool call using regex
             json_pattern = r'\{[^{}]*"name"\s*:\s*"getSimilarPeople"[^{}]*\}'
@@ -104,15 +120,25 @@ You only have 1 task here, and it is to collect the user's background info, then
                     if tool_call.get('name') == 'getSimilarPeople':
                         query = tool_call.get('arguments', {}).get('query')
                             
-                        log(f"Calling similar endpoint with query: {query}")
-                        response = requests.get(
-                            f"{SERVER_URL}/api/person/similar",
-                            params={"query": query}
-                        )
-                        response.raise_for_status()
-                        result = response.json()
-                        
-                        log("Received response from similar endpoint")
+                        with Tracer.span('tool_search') as span:
+                            result = None
+                            if call_uuid:
+                                result = SpeculativeSearch.lookup(call_uuid, query, wait=min(1.0, deadline.remaining()))
+                                
+                            span['speculative_hit'] = result is not None
+                            if result is not None:
+                                logger.info("Reusing speculative search result", call_uuid=call_uuid)
+                            else:
+                                logger.info("Calling similar endpoint with query: %s", query, call_uuid=call_uuid)
+                                result = Resilience.call(
+                                    'similar',
+                                    lambda timeout: self._search_similar(
+                                        query, timeout, call_uuid, CallerPrefetch.caller_phone(call_uuid)
+                                    ),
+                                    deadline
+                                )
+                                
+                                logger.info("Received response from similar endpoint", call_uuid=call_uuid)
                         
                         if result.get('success') and result.get('found'):
                             best_match = result['best_match']
@@ -129,22 +155,68 @@ You only have 1 task here, and it is to collect the user's background info, then
                 except json.JSONDecodeError:
                     # If it's not valid JSON, treat it as a regular response
                     pass
-                except requests.RequestException as e:
-                    log(f"Error calling similar endpoint: {str(e)}")
+                except (requests.RequestException, DeadlineExceeded, CircuitOpenError) as e:
+                    logger.warning("Error calling similar endpoint: %s", e, call_uuid=call_uuid)
                     yield "I encountered an error while searching for similar people. Let's try again later!"
                     return
                 except Exception as e:
-                    log(f"Unexpected error processing tool call: {str(e)}")
+                    logger.exception("Unexpected error processing tool call: %s", e, call_uuid=call_uuid)
                     yield "Something unexpected happened. Let's try again later!"
                     return
             
             # If we get here, it's a regular response
             yield response_content
                     
+        except (DeadlineExceeded, CircuitOpenError) as e:
+            logger.warning("Groq unavailable, using fallback reply: %s", e, call_uuid=call_uuid)
+            yield FALLBACK_REPLY
         except Exception as e:
-            log(f"Error generating response: {str(e)}")
+            logger.exception("Error generating response: %s", e, call_uuid=call_uuid)
             yield f"I apologize, but I encountered an error: {str(e)}"
 
+    def _complete(self, messages, model, reason, temperature, max_tokens, top_p, deadline) -> str:
+        """Run one chat completion on the given model and record its latency"""
+        logger.debug("Making request to Groq API with model: %s", model)
+        started = time.perf_counter()
+        response = Resilience.call(
+            'groq',
+            lambda timeout: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_completion_tokens=max_tokens,
+                top_p=top_p,
+                stream=False,
+                timeout=timeout
+            ),
+            deadline
+        )
+        self.router.record(model, reason, time.perf_counter() - started)
+        
+        if getattr(response, 'usage', None):
+            logger.info(
+                "Groq usage", model=model,
+                prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens
+            )
+            
+        return response.choices[0].message.content
+
+    def _search_similar(self, query, timeout, call_uuid=None, exclude_phone=None) -> dict:
+        """Call the similar endpoint for a getSimilarPeople tool call, excluding the caller"""
+        params = {"query": query}
+        if exclude_phone:
+            params["exclude"] = exclude_phone
+        # Lets the endpoint join its spans to the call's trace
+        headers = {"X-Call-UUID": call_uuid} if call_uuid else {}
+        response = requests.get(
+            f"{SERVER_URL}/api/person/similar",
+            params=params,
+            headers=headers,
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
     def start_conversation(self) -> Generator:
         """
         Start a new conversation with the initial greeting.
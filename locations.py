@@ -0,0 +1,157 @@
+import csv
+import math
+import os
+import re
+import threading
+import numpy as np
+from logs import get_logger
+
+logger = get_logger('locations')
+
+# Bundled offline gazetteer: no geocoding API calls on the write path
+GAZETTEER_DIR = os.getenv('GAZETTEER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+EARTH_RADIUS_KM = 6371.0
+
+def location_key(text):
+    """Lowercase, trim and collapse whitespace and trailing dots for gazetteer lookups"""
+    return re.sub(r'\s+', ' ', str(text or '')).strip().strip('.').lower()
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points given in degrees"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+def distances_km(coords, lat, lon):
+    """Haversine distance in km from a point to each (lat, lon) row of coords (NaN where unknown)"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2 = np.radians(coords[:, 0])
+    lon2 = np.radians(coords[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+class Gazetteer:
+    """
+    City and region lookups from the CSVs in GAZETTEER_DIR.
+
+    Regions are identified by a country-qualified code such as US-CA or
+    GB-ENG, which is also the partition key for the similarity index.
+    Cities sharing a name are kept in file order, most populous first, so
+    an unqualified "Portland" resolves to Portland, OR.
+    """
+    _cities = None   # key -> [city entry]
+    _regions = None  # key -> region code
+    _lock = threading.Lock()
+
+    @classmethod
+    def _load(cls):
+        with cls._lock:
+            if cls._cities is not None:
+                return
+            cities = {}
+            regions = {}
+            with open(os.path.join(GAZETTEER_DIR, 'regions.csv'), newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    code = f"{row['country']}-{row['region']}"
+                    for key in [code, row['region'], row['name'], *row['aliases'].split('|')]:
+                        key = location_key(key)
+                        # Bare codes are ambiguous across countries; the first (US) one wins
+                        if key and key not in regions:
+                            regions[key] = code
+            with open(os.path.join(GAZETTEER_DIR, 'gazetteer.csv'), newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    entry = {
+                        'city': row['city'],
+                        'region': f"{row['country']}-{row['region']}",
+                        'country': row['country'],
+                        'lat': float(row['lat']),
+                        'lon': float(row['lon'])
+                    }
+                    regions.setdefault(location_key(entry['region']), entry['region'])
+                    for key in [row['city'], *row['aliases'].split('|')]:
+                        key = location_key(key)
+                        if key:
+                            cities.setdefault(key, []).append(entry)
+            cls._regions = regions
+            cls._cities = cities
+            logger.info("Gazetteer loaded", cities=len(cities), regions=len(regions))
+
+    @classmethod
+    def resolve_region(cls, text):
+        """
+        Region code for a region name, abbreviation or code.
+
+        Args:
+            text (str): e.g. "California", "CA" or "US-CA"
+
+        Returns:
+            str: The region code, or None if it isn't known
+        """
+        cls._load()
+        return cls._regions.get(location_key(text))
+
+    @classmethod
+    def resolve(cls, text):
+        """
+        Normalize a free-text location.
+
+        Args:
+            text (str): e.g. "San Francisco, CA", "nyc" or "Texas"
+
+        Returns:
+            dict: city, region, country, lat and lon; city and the
+                coordinates are None when only a region matched. None when
+                nothing matched.
+        """
+        cls._load()
+        key = location_key(text)
+        if not key:
+            return None
+        if key in cls._cities:
+            return dict(cls._cities[key][0])
+
+        parts = [part for part in (location_key(part) for part in key.split(',')) if part]
+        if not parts:
+            return None
+        candidates = cls._cities.get(parts[0], [])
+        if len(parts) > 1 and candidates:
+            qualifiers = parts[1:]
+            regions = {cls._regions.get(q) for q in qualifiers}
+            countries = {q.upper() for q in qualifiers}
+            qualified = [c for c in candidates if c['region'] in regions or c['country'] in countries]
+            candidates = qualified or candidates
+        if candidates:
+            return dict(candidates[0])
+
+        # No known city; settle for a region named anywhere in it
+        for part in parts:
+            region = cls._regions.get(part)
+            if region:
+                return {'city': None, 'region': region, 'country': region.split('-')[0], 'lat': None, 'lon': None}
+        return None
+
+def location_fields(location):
+    """
+    Structured location fields to store alongside a person's free-text location.
+
+    Args:
+        location (str): The location as given
+
+    Returns:
+        dict: locationInfo (city, region, country) and a GeoJSON geo point,
+            each None when the gazetteer doesn't know the place or its coordinates
+    """
+    resolved = Gazetteer.resolve(location)
+    if not resolved:
+        return {'locationInfo': None, 'geo': None}
+    return {
+        'locationInfo': {
+            'city': resolved['city'],
+            'region': resolved['region'],
+            'country': resolved['country']
+        },
+        'geo': {
+            'type': 'Point',
+            'coordinates': [resolved['lon'], resolved['lat']]
+        } if resolved['lat'] is not None else None
+    }
@@ -0,0 +1,223 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from metrics import Counter
+
+# Root of every application logger, e.g. boardy.vonage
+ROOT_LOGGER = 'boardy'
+
+# Default level, plus per-logger overrides such as "vonage=DEBUG,search=WARNING"
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# Fraction of INFO/DEBUG records kept per logger, e.g. "vonage.event=0.1"
+LOG_SAMPLING = os.getenv('LOG_SAMPLING', '')
+# 'text' keeps the familiar "[timestamp] [TAG] message" lines, 'json' emits one object per line
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_REDACT_PHONES = os.getenv('LOG_REDACT_PHONES', 'true').lower() != 'false'
+# Records waiting for the writer thread; beyond this they are dropped, not blocked on
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# E.164 numbers and Vonage's bare-digit caller numbers (14155552671)
+PHONE_PATTERN = re.compile(r'(?<![\w.-])\+?\d{6,11}(\d{4})(?![\w.-])')
+
+LOG_RECORDS_DROPPED = Counter(
+    'boardy_log_records_dropped_total',
+    'Log records dropped because the log queue was full'
+)
+
+def redact_phones(text):
+    """Mask phone numbers, keeping the last four digits for correlation"""
+    return PHONE_PATTERN.sub(lambda match: '+*******' + match.group(1), text)
+
+def _parse_pairs(spec):
+    """Parse "a=1,b=2" into {'a': '1', 'b': '2'}"""
+    pairs = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+class Lazy:
+    """
+    Defers building an expensive log argument until a record is written.
+
+    Formatting happens on the writer thread, so a pretty-printed payload only
+    costs anything when its logger is enabled at that level.
+    """
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+def lazy_json(value):
+    """Serialize a value to JSON only when the record is actually written"""
+    return Lazy(lambda: json.dumps(value, default=str))
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of records below WARNING; warnings and errors always pass"""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread without formatting them first.
+
+    The stock QueueHandler formats on the calling thread; here the request
+    thread only enqueues, and drops the record if the writer has fallen
+    behind rather than waiting on stdout.
+    """
+    def prepare(self, record):
+        if record.exc_info:
+            # Tracebacks can't be rendered once the frames are gone
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+class StructuredFormatter(logging.Formatter):
+    """Renders a record and its fields as a text line or a JSON object, with phone numbers masked"""
+    def __init__(self, json_output=False, redact=True):
+        super().__init__()
+        self.json_output = json_output
+        self.redact = redact
+
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, 'fields', None) or {}
+        tag = record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        if self.json_output:
+            entry = {
+                'time': timestamp,
+                'level': record.levelname,
+                'logger': tag,
+                'message': message
+            }
+            entry.update(fields)
+            if record.exc_text:
+                entry['exception'] = record.exc_text
+            line = json.dumps(entry, default=str)
+        else:
+            level = '' if record.levelno == logging.INFO else f" {record.levelname}:"
+            line = f"[{timestamp}] [{tag.upper()}]{level} {message}"
+            if fields:
+                line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+            if record.exc_text:
+                line += '\n' + record.exc_text
+
+        return redact_phones(line) if self.redact else line
+
+class Log:
+    """
+    A named application logger that takes structured fields as keyword arguments.
+
+    Level checks happen before anything is built, so disabled debug calls
+    cost one comparison:
+
+        log = get_logger('vonage')
+        log.info("Speech input received", call_uuid=call_uuid)
+        log.debug("Input data: %s", lazy_json(input_data))
+    """
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _log(self, level, message, args, fields, exc_info=None):
+        if not self.logger.isEnabledFor(level):
+            return
+        if exc_info:
+            exc_info = sys.exc_info()
+        # Build the record directly: Logger._log walks the stack to find the caller on every call
+        record = self.logger.makeRecord(
+            self.logger.name, level, '', 0, message, args, exc_info, extra={'fields': fields}
+        )
+        self.logger.handle(record)
+
+    def enabled(self, level=logging.DEBUG):
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, message, *args, **fields):
+        self._log(logging.DEBUG, message, args, fields)
+
+    def info(self, message, *args, **fields):
+        self._log(logging.INFO, message, args, fields)
+
+    def warning(self, message, *args, **fields):
+        self._log(logging.WARNING, message, args, fields)
+
+    def error(self, message, *args, **fields):
+        self._log(logging.ERROR, message, args, fields)
+
+    def exception(self, message, *args, **fields):
+        self._log(logging.ERROR, message, args, fields, exc_info=True)
+
+_loggers = {}
+_setup_lock = threading.Lock()
+_listener = None
+
+def _setup():
+    """Attach the queue handler to the application root logger and start the writer thread"""
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    root.propagate = False
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(json_output=LOG_FORMAT == 'json', redact=LOG_REDACT_PHONES))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.addHandler(_NonBlockingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name):
+    """
+    Get the application logger for a component, e.g. get_logger('vonage.event').
+
+    Levels from LOG_LEVELS and sample rates from LOG_SAMPLING are applied by
+    name; child loggers inherit their parent's level.
+    """
+    with _setup_lock:
+        if _listener is None:
+            _setup()
+        log = _loggers.get(name)
+        if log is None:
+            logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+            level = _parse_pairs(LOG_LEVELS).get(name)
+            if level:
+                logger.setLevel(getattr(logging, level.upper(), logging.NOTSET))
+            rate = _parse_pairs(LOG_SAMPLING).get(name)
+            if rate is not None:
+                logger.addFilter(SamplingFilter(float(rate)))
+            log = _loggers[name] = Log(logger)
+        return log
+
+def flush_logs():
+    """Write out every queued record, e.g. before the process exits"""
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
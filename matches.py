@@ -0,0 +1,187 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+from pymongo import ReplaceOne
+from database import MongoDB
+from logs import get_logger
+from metrics import Counter
+from vector_index import VectorIndex
+
+logger = get_logger('matches')
+
+# Neighbors kept per person
+MATCHES_TOP_K = int(os.getenv('MATCHES_TOP_K', 20))
+
+def match_document(phone_number, scored, computed_at, top_k=None):
+    """
+    The matches document for one person.
+
+    Args:
+        phone_number (str): Whose list it is
+        scored (list): (score, phone) pairs, best first, at most MATCHES_TOP_K
+        computed_at (datetime): When the list was computed
+        top_k (int, optional): List length, defaults to MATCHES_TOP_K
+
+    Returns:
+        dict: {_id, matches: [{phone, score}], threshold, computedAt}, where
+            threshold is the score a newcomer has to beat to get in: the
+            last score of a full list, 0 while the list has room
+    """
+    top_k = top_k or MATCHES_TOP_K
+    return {
+        '_id': phone_number,
+        'matches': [{'phone': phone, 'score': round(float(score), 6)} for score, phone in scored],
+        'threshold': round(float(scored[-1][0]), 6) if len(scored) >= top_k else 0.0,
+        'computedAt': computed_at
+    }
+
+class MatchTable:
+    """
+    Precomputed top-k neighbors for every person, kept in the matches collection.
+
+    jobs.compute_matches rebuilds the whole table offline. In between,
+    refresh() maintains it incrementally when one person's embedding
+    changes: their own list is recomputed, they are rescored in the lists
+    they were already in (dropping out, and the list being recomputed, if
+    they fell below its tail), and they enter every list whose threshold
+    they now beat. Serving a person's matches is then a single _id lookup.
+
+    Incremental updates score against this process's VectorIndex and run
+    on a background executor; concurrent refreshes can leave small
+    inaccuracies that the next full run clears.
+    """
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='matches')
+
+    @classmethod
+    def collection(cls):
+        return MongoDB().get_db().matches
+
+    @classmethod
+    def get(cls, phone_number):
+        """A person's precomputed matches document, or None"""
+        return cls.collection().find_one({'_id': phone_number})
+
+    @classmethod
+    def schedule(cls, phone_number, embedding):
+        """Refresh the table for a changed embedding off the request path"""
+        if not embedding:
+            return
+        cls._executor.submit(cls._refresh_logged, phone_number, embedding)
+
+    @classmethod
+    def _refresh_logged(cls, phone_number, embedding):
+        try:
+            cls.refresh(phone_number, embedding)
+        except Exception as e:
+            logger.exception("Match table refresh failed for a person: %s", e)
+
+    @classmethod
+    def scores(cls, embedding):
+        """
+        Cosine similarity of an embedding to everyone in the index.
+
+        Returns:
+            tuple: (phones, scores) arrays
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        partitions = VectorIndex.select()
+        if not partitions:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+        return (
+            np.concatenate([partition.phones for partition in partitions]),
+            np.concatenate([partition.matrix @ query for partition in partitions])
+        )
+
+    @classmethod
+    def top_k(cls, phone_number, phones, scores):
+        """The best MATCHES_TOP_K positive (score, phone) pairs, leaving the person out"""
+        keep = (scores > 0) & (phones != phone_number)
+        phones, scores = phones[keep], scores[keep]
+        if len(scores) > MATCHES_TOP_K:
+            top = np.argpartition(-scores, MATCHES_TOP_K - 1)[:MATCHES_TOP_K]
+            phones, scores = phones[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return [(float(scores[i]), phones[i]) for i in order]
+
+    @classmethod
+    def refresh(cls, phone_number, embedding):
+        """
+        Update the table after one person's embedding changed.
+
+        Args:
+            phone_number (str): The person
+            embedding (list): Their new embedding
+        """
+        collection = cls.collection()
+        now = datetime.now(timezone.utc)
+        phones, scores = cls.scores(embedding)
+        score_of = dict(zip(phones.tolist(), scores.tolist()))
+        operations = [ReplaceOne(
+            {'_id': phone_number},
+            match_document(phone_number, cls.top_k(phone_number, phones, scores), now),
+            upsert=True
+        )]
+
+        # Lists the person is in already: rescore, or drop out and recompute the list
+        touched = set()
+        recomputed = 0
+        for document in collection.find({'matches.phone': phone_number}):
+            touched.add(document['_id'])
+            others = [(entry['score'], entry['phone']) for entry in document['matches'] if entry['phone'] != phone_number]
+            score = score_of.get(document['_id'], 0.0)
+            if len(others) + 1 >= MATCHES_TOP_K and others and score < others[-1][0]:
+                # Whoever was just outside the list may now belong in it
+                other_phones, other_scores = cls.scores_for(document['_id'])
+                # The index may still hold this person's previous embedding
+                other_scores = np.where(other_phones == phone_number, score, other_scores)
+                scored = cls.top_k(document['_id'], other_phones, other_scores)
+                recomputed += 1
+            else:
+                scored = sorted(others + ([(score, phone_number)] if score > 0 else []), reverse=True)
+            operations.append(ReplaceOne({'_id': document['_id']}, match_document(document['_id'], scored, now)))
+
+        # Lists the person now enters: anyone whose threshold they beat
+        floor = collection.find_one({}, {'threshold': 1}, sort=[('threshold', 1)])
+        floor = floor['threshold'] if floor else 0.0
+        entering = [phone for phone, score in score_of.items()
+                    if score > floor and score > 0 and phone != phone_number and phone not in touched]
+        entered = 0
+        for start in range(0, len(entering), 1000):
+            for document in collection.find({'_id': {'$in': entering[start:start + 1000]}}):
+                score = score_of[document['_id']]
+                if score <= document['threshold']:
+                    continue
+                scored = sorted(
+                    [(entry['score'], entry['phone']) for entry in document['matches']] + [(score, phone_number)],
+                    reverse=True
+                )[:MATCHES_TOP_K]
+                operations.append(ReplaceOne({'_id': document['_id']}, match_document(document['_id'], scored, now)))
+                entered += 1
+
+        collection.bulk_write(operations, ordered=False)
+        MATCH_TABLE_UPDATES.inc(outcome='refreshed')
+        MATCH_TABLE_UPDATES.inc(len(touched), outcome='rescored')
+        MATCH_TABLE_UPDATES.inc(recomputed, outcome='recomputed')
+        MATCH_TABLE_UPDATES.inc(entered, outcome='entered')
+        logger.debug("Match table refreshed", rescored=len(touched), recomputed=recomputed, entered=entered)
+
+    @classmethod
+    def scores_for(cls, phone_number):
+        """Scores against everyone for a person already in the index"""
+        for partition in VectorIndex.select():
+            row = partition.rows_by_phone.get(phone_number)
+            if row is not None:
+                return cls.scores(partition.matrix[row])
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+
+    @classmethod
+    def remove_all(cls):
+        cls.collection().delete_many({})
+
+MATCH_TABLE_UPDATES = Counter(
+    'boardy_match_table_updates_total',
+    'Incremental match table maintenance: people refreshed, lists rescored, recomputed and entered',
+    ['outcome']
+)
@@ -0,0 +1,283 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from a fast cache hit up to the gunicorn timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 120.0)
+
+# A directory shared by the workers on one host and emptied when the
+# service starts. Each worker writes its metrics there every
+# METRICS_FLUSH_INTERVAL seconds and /metrics adds them up, so a scrape
+# sees the whole host whichever worker answers it. Empty keeps metrics
+# per process.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+_registry = []
+_registry_lock = threading.Lock()
+_flusher = None
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=None):
+    """Render a Prometheus label set"""
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class _Metric:
+    """Base class for metrics kept in this process and rendered in Prometheus text format"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """A copy of this process's values, {label values tuple: value}"""
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, samples, others):
+        """
+        Add other processes' samples to this process's.
+
+        Args:
+            samples (dict): This process's, from samples(); updated in place
+            others (list): (pid, live, samples) of the other workers
+
+        Returns:
+            tuple: The label names and the merged samples
+        """
+        for _, _, values in others:
+            for key, value in values.items():
+                samples[key] = samples.get(key, 0) + value
+        return self.labelnames, samples
+
+    def render(self, others=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        labelnames, samples = self.merge(self.samples(), list(others))
+        lines.extend(self._render_samples(labelnames, sorted(samples.items())))
+        return lines
+
+class Counter(_Metric):
+    """A monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_samples(self, labelnames, items):
+        return [f"{self.name}{_format_labels(labelnames, key)} {value}" for key, value in items]
+
+class Gauge(_Metric):
+    """A value that can go up and down, optionally read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # callback() returns {label values tuple: value}
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            return {tuple(str(value) for value in key): value for key, value in self.callback().items()}
+        return super().samples()
+
+    def merge(self, samples, others):
+        """Gauges don't add up across workers: each live worker's values get a pid label"""
+        if not others:
+            return self.labelnames, samples
+        merged = {key + (str(os.getpid()),): value for key, value in samples.items()}
+        for pid, live, values in others:
+            if live:
+                merged.update({key + (str(pid),): value for key, value in values.items()})
+        return self.labelnames + ('pid',), merged
+
+    def _render_samples(self, labelnames, items):
+        return [f"{self.name}{_format_labels(labelnames, key)} {value}" for key, value in items]
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def samples(self):
+        with self._lock:
+            return {key: {**entry, 'counts': list(entry['counts'])} for key, entry in self._values.items()}
+
+    def merge(self, samples, others):
+        for _, _, values in others:
+            for key, entry in values.items():
+                merged = samples.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                merged['counts'] = [a + b for a, b in zip(merged['counts'], entry['counts'])]
+                merged['sum'] += entry['sum']
+                merged['count'] += entry['count']
+        return self.labelnames, samples
+
+    def _render_samples(self, labelnames, items):
+        lines = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, key, [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labelnames, key, [('le', '+Inf')])} {entry['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labelnames, key)} {entry['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labelnames, key)} {entry['count']}")
+        return lines
+
+def _pid_alive(pid):
+    """Whether a process with this pid is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def write_metrics():
+    """Write this process's metrics to METRICS_DIR for the other workers' /metrics"""
+    with _registry_lock:
+        metrics = list(_registry)
+    pid = os.getpid()
+    document = {
+        metric.name: [[list(key), value] for key, value in metric.samples().items()]
+        for metric in metrics
+    }
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    # Written aside and renamed, so readers never see half a file
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(document, f)
+    os.replace(f"{path}.tmp", path)
+
+def _read_other_workers():
+    """(pid, live, {metric name: samples}) for every other worker that has written metrics"""
+    others = []
+    own = os.getpid()
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith('.json') or filename == f"{own}.json":
+            continue
+        pid = int(filename[:-len('.json')])
+        try:
+            with open(os.path.join(METRICS_DIR, filename)) as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            continue
+        others.append((pid, _pid_alive(pid), {
+            name: {tuple(key): value for key, value in samples} for name, samples in document.items()
+        }))
+    return others
+
+def _run_flusher():
+    """Background loop writing this worker's metrics to METRICS_DIR"""
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_metrics()
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+
+def start_metrics_flusher():
+    """Share this worker's metrics through METRICS_DIR, if set"""
+    global _flusher
+    if not METRICS_DIR:
+        return
+    with _registry_lock:
+        if _flusher is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _flusher = threading.Thread(target=_run_flusher, name='metrics-flusher', daemon=True)
+        _flusher.start()
+    atexit.register(write_metrics)
+
+def render_metrics():
+    """
+    Render every registered metric in Prometheus text exposition format.
+
+    With METRICS_DIR set, counters and histograms are summed over every
+    worker that has written there, including ones that have exited so
+    totals never go backwards, and gauges are reported per live worker
+    with a pid label.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    others = _read_other_workers() if _flusher is not None else []
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render(
+            (pid, live, samples[metric.name]) for pid, live, samples in others if metric.name in samples
+        ))
+    return "\n".join(lines) + "\n"
+
+# Shared metrics for the voice pipeline and its external providers
+TURN_STAGE_SECONDS = Histogram(
+    'boardy_turn_stage_seconds',
+    'Time spent in each stage of a voice turn',
+    ['stage']
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    'boardy_http_request_seconds',
+    'Time to serve each HTTP endpoint',
+    ['endpoint', 'method', 'status']
+)
+PROVIDER_REQUEST_SECONDS = Histogram(
+    'boardy_provider_request_seconds',
+    'Latency of individual requests to external providers',
+    ['provider', 'outcome']
+)
+PROVIDER_EVENTS = Counter(
+    'boardy_provider_events_total',
+    'Resilience events per external provider (hedges, timeouts, rejections, errors)',
+    ['provider', 'event']
+)
+LLM_ROUTES = Counter(
+    'boardy_llm_routes_total',
+    'Model routing decisions',
+    ['model', 'reason']
+)
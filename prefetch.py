@@ -0,0 +1,191 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logs import get_logger
+from database import MongoDB
+from generations import Generations
+from profiles import PERSON_RESPONSE_FIELDS
+
+logger = get_logger('prefetch')
+
+def normalize_caller_number(number):
+    """Convert a Vonage caller number (e.g. 14155552671) to E.164"""
+    if not number:
+        return None
+    number = str(number).strip()
+    return number if number.startswith('+') else f"+{number}"
+
+class CallerPrefetch:
+    """
+    Loads what we know about a caller as soon as their call comes in.
+
+    The inbound webhook starts loading the caller's persons record, their
+    previous conversations and their stored embedding in the background,
+    before the first utterance. Later turns use it for returning-caller
+    context in the prompt, the similarity search uses it to exclude the
+    caller, and GET /api/person is served from it during the call while
+    the persons generation it was read at is still current.
+    """
+    # Number of previous conversations loaded for context
+    PREVIOUS_CONVERSATIONS = 3
+    # Drop state for calls that never sent a completed event
+    STATE_TTL = 3600
+
+    _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+    _calls = {}
+    _by_phone = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls, call_uuid, phone_number):
+        """Start prefetching the caller's data for a new call"""
+        if not call_uuid or not phone_number:
+            return
+        with cls._lock:
+            cls._prune()
+            cls._calls[call_uuid] = {
+                'phone_number': phone_number,
+                'future': cls._executor.submit(cls._load, call_uuid, phone_number),
+                'touched': time.monotonic()
+            }
+            cls._by_phone[phone_number] = call_uuid
+
+    @classmethod
+    def get(cls, call_uuid, timeout=0.0):
+        """
+        Get the prefetched data for a call.
+
+        Args:
+            call_uuid (str): The call to look up
+            timeout (float): Seconds to wait if the prefetch is still running
+
+        Returns:
+            dict or None: Keys person, conversations and embedding, or None if
+                nothing was prefetched or it isn't ready yet
+        """
+        with cls._lock:
+            entry = cls._calls.get(call_uuid)
+            if entry is not None:
+                entry['touched'] = time.monotonic()
+        if entry is None:
+            return None
+        try:
+            return entry['future'].result(timeout=timeout)
+        except Exception:
+            return None
+
+    @classmethod
+    def caller_phone(cls, call_uuid):
+        """The caller's phone number for a call, if known"""
+        with cls._lock:
+            entry = cls._calls.get(call_uuid)
+        return entry['phone_number'] if entry else None
+
+    @classmethod
+    def get_person(cls, phone_number):
+        """
+        Get a caller's person record if it was prefetched for a live call
+        and the persons generation hasn't moved since it was read, so no
+        worker has written it since. Costs no database round trip.
+
+        Returns:
+            dict or None: A copy of the person without _id and vectorEmbedding
+        """
+        with cls._lock:
+            call_uuid = cls._by_phone.get(phone_number)
+        data = cls.get(call_uuid) if call_uuid else None
+        if not data:
+            return None
+        generation = Generations.current()
+        with cls._lock:
+            if data['generation'] is None or data['generation'] != generation:
+                return None
+            person = copy.deepcopy(data['person'])
+        if not person:
+            return None
+        person.pop('_id', None)
+        person.pop('vectorEmbedding', None)
+        return person
+
+    @classmethod
+    def refresh_person(cls, phone_number, person):
+        """Replace a live caller's cached person record after this worker wrote and re-read it"""
+        with cls._lock:
+            call_uuid = cls._by_phone.get(phone_number)
+        data = cls.get(call_uuid) if call_uuid else None
+        if data is not None:
+            # The writer's bump is already this worker's current generation
+            generation = Generations.current()
+            with cls._lock:
+                data['generation'] = generation
+                data['person'] = person
+                data['embedding'] = person.get('vectorEmbedding') if person else None
+
+    @classmethod
+    def prompt_context(cls, call_uuid):
+        """Returning-caller context to append to the system prompt ('' for new callers)"""
+        data = cls.get(call_uuid)
+        if not data:
+            return ""
+        with cls._lock:
+            person = data['person']
+        if not person:
+            return ""
+
+        lines = [
+            "",
+            "",
+            "This is a returning caller. Here's what we already have on file for them, so don't ask for it again, just confirm anything that might have changed:",
+            f"- Name: {person.get('name', '')}"
+        ]
+        if person.get('location'):
+            lines.append(f"- Location: {person['location']}")
+        if person.get('interests'):
+            lines.append(f"- Interests: {', '.join(person['interests'])}")
+        if person.get('skills'):
+            lines.append(f"- Skills: {', '.join(person['skills'])}")
+        if person.get('bio'):
+            lines.append(f"- Bio: {person['bio']}")
+        if data['conversations']:
+            lines.append(f"They have called {len(data['conversations'])} time(s) before.")
+        return "\n".join(lines)
+
+    @classmethod
+    def discard(cls, call_uuid):
+        """Forget a call's prefetched data once it has completed"""
+        with cls._lock:
+            entry = cls._calls.pop(call_uuid, None)
+            if entry and cls._by_phone.get(entry['phone_number']) == call_uuid:
+                del cls._by_phone[entry['phone_number']]
+
+    @classmethod
+    def _prune(cls):
+        """Drop state for stale calls (caller must hold the lock)"""
+        cutoff = time.monotonic() - cls.STATE_TTL
+        for call_uuid in [k for k, v in cls._calls.items() if v['touched'] < cutoff]:
+            entry = cls._calls.pop(call_uuid)
+            if cls._by_phone.get(entry['phone_number']) == call_uuid:
+                del cls._by_phone[entry['phone_number']]
+
+    @classmethod
+    def _load(cls, call_uuid, phone_number):
+        """Load the caller's person record, previous conversations and embedding"""
+        db = MongoDB().get_db()
+        # Read first, so a write racing the load makes the record look older rather than newer
+        generation = Generations.current()
+        person = db.persons.find_one({'phoneNumber': phone_number}, PERSON_RESPONSE_FIELDS)
+        conversations = list(db.conversations.find(
+            {'phoneNumber': phone_number, 'call_uuid': {'$ne': call_uuid}},
+            {'_id': 0, 'call_uuid': 1, 'messages': 1, 'updated_at': 1}
+        ).sort('updated_at', -1).limit(cls.PREVIOUS_CONVERSATIONS))
+        logger.info(
+            "Prefetched caller", call_uuid=call_uuid,
+            caller='returning' if person else 'new', previous_conversations=len(conversations)
+        )
+        return {
+            'person': person,
+            'generation': generation,
+            'conversations': conversations,
+            'embedding': person.get('vectorEmbedding') if person else None
+        }
@@ -0,0 +1,79 @@
+from database import MongoDB
+from embeddings import EmbeddingGenerator, EMBEDDING_VERSION, build_profile_text, text_hash
+from logs import get_logger
+
+logger = get_logger('profiles')
+
+# embeddingStatus values; persons written before the queue existed have none and count as ready
+EMBEDDING_PENDING = 'pending'
+EMBEDDING_READY = 'ready'
+EMBEDDING_FAILED = 'failed'
+
+# What a shadow re-embedding run writes next to the live fields (see jobs.reembed)
+SHADOW_FIELDS = ('vectorEmbeddingNext', 'profileHashNext', 'embeddingVersionNext')
+SHADOW_ONLY_FIELDS = list(SHADOW_FIELDS) + ['sourceUpdatedAtNext']
+# Projection for person reads that are returned by the API, leaving out the
+# shadow fields and the LSH band keys (see dedup)
+PERSON_RESPONSE_FIELDS = {field: 0 for field in SHADOW_ONLY_FIELDS + ['lshBands']}
+
+def embedding_is_current(person, profile_hash):
+    """Whether a person's embedding for this profile text is stored or already queued"""
+    if person.get('profileHash') != profile_hash or person.get('embeddingVersion') != EMBEDDING_VERSION:
+        return False
+    status = person.get('embeddingStatus', EMBEDDING_READY)
+    return status == EMBEDDING_PENDING or (status == EMBEDDING_READY and bool(person.get('vectorEmbedding')))
+
+def find_shared_embedding(profile_hash):
+    """Embedding already stored for another person with the exact same profile text"""
+    match = MongoDB().get_db().persons.find_one(
+        {
+            'profileHash': profile_hash,
+            'embeddingVersion': EMBEDDING_VERSION,
+            'vectorEmbedding': {'$ne': None},
+            'embeddingStatus': {'$ne': EMBEDDING_PENDING}
+        },
+        {'_id': 0, 'vectorEmbedding': 1}
+    )
+    return match.get('vectorEmbedding') if match else None
+
+def profile_embedding_fields(interests, skills, bio=None, existing=None):
+    """
+    Work out the embedding fields to store for a profile, without running the model.
+
+    An unchanged profile returns {}. Text that is already cached in this
+    process or stored for another person reuses that embedding. Anything
+    else is marked embeddingStatus: pending, keeping the previous
+    embedding (if any) until the embedding queue replaces it; the caller
+    enqueues the job once the person is written.
+
+    Args:
+        interests (list): Merged interests
+        skills (list): Merged skills
+        bio (str, optional): Bio
+        existing (dict, optional): The stored person, when updating
+
+    Returns:
+        dict: Fields to $set, or {} when the stored embedding is still current
+    """
+    text = build_profile_text(interests, skills, bio)
+    profile_hash = text_hash(text)
+
+    if existing is not None and embedding_is_current(existing, profile_hash):
+        logger.debug("Profile unchanged, keeping stored embedding")
+        return {}
+
+    fields = {
+        'profileHash': profile_hash,
+        'embeddingVersion': EMBEDDING_VERSION
+    }
+    if not text:
+        return {**fields, 'vectorEmbedding': None, 'embeddingStatus': EMBEDDING_READY}
+
+    embedding = EmbeddingGenerator.cached_embedding(text) or find_shared_embedding(profile_hash)
+    if embedding is not None:
+        return {**fields, 'vectorEmbedding': embedding, 'embeddingStatus': EMBEDDING_READY}
+
+    fields['embeddingStatus'] = EMBEDDING_PENDING
+    if existing is None:
+        fields['vectorEmbedding'] = None
+    return fields
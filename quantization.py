@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+# First-pass representation of large partitions. VECTOR_REDUCTION projects
+# embeddings onto VECTOR_REDUCED_DIMENSIONS directions (pca: the data's
+# principal directions; projection: a random orthonormal basis) and
+# VECTOR_QUANTIZATION=int8 stores each dimension as one byte. With both
+# empty every search scans the float32 embeddings.
+VECTOR_REDUCTION = os.getenv('VECTOR_REDUCTION', '')
+VECTOR_REDUCED_DIMENSIONS = int(os.getenv('VECTOR_REDUCED_DIMENSIONS', 96))
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION', '')
+
+# Only partitions of at least this many people get a first pass; smaller
+# ones scan the float32 embeddings in about the time rescoring takes
+FIRST_STAGE_MIN_PARTITION = int(os.getenv('FIRST_STAGE_MIN_PARTITION', 20000))
+
+# The best RESCORE_FACTOR x (results wanted) first-pass scores, and at
+# least RESCORE_MIN, are recomputed exactly from the float32 embeddings
+RESCORE_FACTOR = int(os.getenv('RESCORE_FACTOR', 10))
+RESCORE_MIN = int(os.getenv('RESCORE_MIN', 200))
+
+REDUCTIONS = ('pca', 'projection')
+QUANTIZATIONS = ('int8',)
+
+# Embeddings the encoder is fitted on, and rows encoded or scored per block
+FIT_SAMPLE = 20000
+BLOCK_ROWS = 16384
+
+class FirstStageEncoder:
+    """
+    A compact encoding of unit embeddings for approximate first-pass scoring.
+
+    PCA keeps the directions along which the embeddings vary most
+    (uncentered, since dot products depend on the whole vector); a random
+    orthonormal projection needs no fitting and preserves dot products in
+    expectation. int8 quantization scales each dimension so the sample's
+    99.9th percentile magnitude maps to 127. Scoring folds the scales into
+    the query, so a code row dotted with it approximates the cosine.
+
+    Encoders are fitted per index build on a sample of its embeddings.
+    """
+
+    def __init__(self, reduction, components, scales):
+        # 'pca' or 'projection' and its (dimensions, reduced) matrix, or None; per-dimension int8 step, or None
+        self.reduction = reduction or None
+        self.components = components
+        self.scales = scales
+
+    @classmethod
+    def configured(cls):
+        """Whether the environment asks for a first pass"""
+        return bool(VECTOR_REDUCTION or VECTOR_QUANTIZATION)
+
+    @classmethod
+    def fit(cls, sample, reduction=VECTOR_REDUCTION, dimensions=VECTOR_REDUCED_DIMENSIONS,
+            quantization=VECTOR_QUANTIZATION, seed=0):
+        """
+        Fit an encoder.
+
+        Args:
+            sample (np.ndarray): Unit embeddings, one per row
+            reduction (str): 'pca', 'projection' or '' for none
+            dimensions (int): Dimensions to reduce to
+            quantization (str): 'int8' or '' for none
+            seed (int): Random projection seed
+
+        Returns:
+            FirstStageEncoder: The fitted encoder
+        """
+        if reduction and reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown VECTOR_REDUCTION {reduction!r}, expected one of {REDUCTIONS}")
+        if quantization and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown VECTOR_QUANTIZATION {quantization!r}, expected one of {QUANTIZATIONS}")
+        sample = np.asarray(sample, dtype=np.float32)
+        dimensions = min(dimensions, sample.shape[1])
+        components = None
+        if reduction == 'pca':
+            _, _, directions = np.linalg.svd(sample, full_matrices=False)
+            components = np.ascontiguousarray(directions[:dimensions].T, dtype=np.float32)
+        elif reduction == 'projection':
+            rng = np.random.default_rng(seed)
+            basis, _ = np.linalg.qr(rng.standard_normal((sample.shape[1], dimensions)))
+            components = basis.astype(np.float32)
+        scales = None
+        if quantization == 'int8':
+            reduced = sample @ components if components is not None else sample
+            # Clip the outermost 0.1% so a few outliers don't coarsen a whole dimension
+            scales = (np.percentile(np.abs(reduced), 99.9, axis=0) / 127).astype(np.float32)
+            scales[scales == 0] = 1
+        return cls(reduction, components, scales)
+
+    def describe(self):
+        """Short name of the encoding, e.g. pca96+int8"""
+        parts = []
+        if self.components is not None:
+            parts.append(f"{self.reduction}{self.components.shape[1]}")
+        if self.scales is not None:
+            parts.append('int8')
+        return '+'.join(parts) or 'float32'
+
+    def encode(self, matrix):
+        """
+        Codes for unit embeddings, a block at a time so a memory-mapped
+        matrix is never copied whole.
+
+        Args:
+            matrix (np.ndarray): Unit embeddings, one per row
+
+        Returns:
+            np.ndarray: int8 codes when quantized, else float32 reduced embeddings
+        """
+        dimensions = self.components.shape[1] if self.components is not None else matrix.shape[1]
+        codes = np.empty((len(matrix), dimensions), dtype=np.int8 if self.scales is not None else np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            if self.components is not None:
+                block = block @ self.components
+            if self.scales is not None:
+                block = np.clip(np.rint(block / self.scales), -127, 127)
+            codes[start:start + len(block)] = block
+        return codes
+
+    def score(self, codes, query):
+        """
+        Approximate cosine of every code row with a unit query.
+
+        Args:
+            codes (np.ndarray): Codes from encode()
+            query (np.ndarray): Unit-normalized query embedding
+
+        Returns:
+            np.ndarray: float32 scores
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.components is not None:
+            query = query @ self.components
+        if self.scales is None:
+            return codes @ query
+        # x.q ~= sum(code_j * step_j * q_j); BLAS has no int8 product, so
+        # each block of codes is widened to float32 in a reused buffer
+        query = query * self.scales
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((min(BLOCK_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = buffer[:min(BLOCK_ROWS, len(codes) - start)]
+            block[...] = codes[start:start + len(block)]
+            np.dot(block, query, out=scores[start:start + len(block)])
+        return scores
+
+    def rescored(self, codes, matrix, query, depth, penalties=None):
+        """
+        First-pass scores for every row, with the best `depth` recomputed
+        exactly from the float32 embeddings.
+
+        Args:
+            codes (np.ndarray): Codes of the rows
+            matrix (np.ndarray): The rows' unit embeddings
+            query (np.ndarray): Unit-normalized query embedding
+            depth (int): How many of the best to rescore
+            penalties (np.ndarray, optional): Score multiplier per row
+
+        Returns:
+            tuple: (scores, rescored rows in row order)
+        """
+        scores = self.score(codes, query)
+        if penalties is not None:
+            scores *= penalties
+        if depth < len(scores):
+            top = np.sort(np.argpartition(-scores, depth - 1)[:depth])
+        else:
+            top = np.arange(len(scores))
+        # In row order, so a memory-mapped matrix is read front to back
+        exact = matrix[top] @ query
+        scores[top] = exact * penalties[top] if penalties is not None else exact
+        return scores, top
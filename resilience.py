@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from logs import get_logger
+from metrics import PROVIDER_REQUEST_SECONDS, PROVIDER_EVENTS, Gauge
+
+logger = get_logger('resilience')
+
+class DeadlineExceeded(Exception):
+    """Raised when a turn's latency budget runs out"""
+
+class CircuitOpenError(Exception):
+    """Raised when a provider's circuit breaker is rejecting calls"""
+
+class Deadline:
+    """A latency budget shared by every outbound call made for one turn"""
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left in the budget (never negative)"""
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+class CircuitBreaker:
+    """
+    Fails fast once a provider keeps failing.
+
+    After FAILURE_THRESHOLD consecutive failures the breaker opens and
+    rejects calls for COOLDOWN seconds. It then lets a single trial call
+    through (half-open); success closes it again, failure re-opens it.
+    """
+    FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+    COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 30))
+
+    def __init__(self, name):
+        self.name = name
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may be attempted right now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.COOLDOWN:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self.state != 'closed':
+                logger.info("Circuit for %s closed", self.name)
+            self.state = 'closed'
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.FAILURE_THRESHOLD:
+                if self.state != 'open':
+                    logger.warning("Circuit for %s opened after %d failures", self.name, self._failures)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+class Provider:
+    """Latency window, counters and circuit breaker for one external provider"""
+    WINDOW = 500
+    # Don't derive a hedge delay until we have this many samples
+    MIN_SAMPLES = 20
+
+    def __init__(self, name, hedge_delay):
+        self.name = name
+        self.default_hedge_delay = hedge_delay
+        self.breaker = CircuitBreaker(name)
+        self._latencies = deque(maxlen=self.WINDOW)
+        self._counts = {
+            'requests': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'hedged': 0,
+            'hedge_wins': 0
+        }
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        PROVIDER_EVENTS.inc(provider=self.name, event=name)
+        with self._lock:
+            self._counts[name] += 1
+
+    def observe(self, latency):
+        PROVIDER_REQUEST_SECONDS.observe(latency, provider=self.name, outcome='success')
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, p):
+        """Latency percentile in seconds over the recent window, or None without data"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def hedge_delay(self):
+        """Wait this long for the first attempt before sending a duplicate (its p95)"""
+        with self._lock:
+            enough = len(self._latencies) >= self.MIN_SAMPLES
+        return self.percentile(0.95) if enough else self.default_hedge_delay
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **counts,
+            'breaker': self.breaker.state,
+            'latency_ms': {
+                name: round(value * 1000, 1) if value is not None else None
+                for name, value in (
+                    ('p50', self.percentile(0.5)),
+                    ('p95', self.percentile(0.95)),
+                    ('p99', self.percentile(0.99))
+                )
+            }
+        }
+
+class Resilience:
+    """
+    Outbound call wrapper with deadlines, hedged requests and circuit breakers.
+
+    Usage:
+        Resilience.call('groq', lambda timeout: client.create(..., timeout=timeout), deadline)
+
+    The wrapped function receives the time left in the budget and must pass
+    it on as its own request timeout, so abandoned attempts don't outlive
+    the turn.
+    """
+    # Per-turn latency budget for handle_input
+    TURN_BUDGET = float(os.getenv('TURN_LATENCY_BUDGET', 8))
+    # Give up on a call when less than this is left in the budget
+    MIN_ATTEMPT_TIME = 0.25
+
+    _providers = {
+        'groq': Provider('groq', hedge_delay=float(os.getenv('GROQ_HEDGE_DELAY', 2.0))),
+        'elevenlabs': Provider('elevenlabs', hedge_delay=float(os.getenv('ELEVENLABS_HEDGE_DELAY', 1.5))),
+        'similar': Provider('similar', hedge_delay=float(os.getenv('SIMILAR_HEDGE_DELAY', 1.0)))
+    }
+    _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='outbound')
+
+    @classmethod
+    def provider(cls, name):
+        return cls._providers[name]
+
+    @classmethod
+    def call(cls, name, fn, deadline=None, hedge=True):
+        """
+        Call a provider within the deadline, hedging once after its p95 latency.
+
+        Args:
+            name (str): Provider name ('groq', 'elevenlabs' or 'similar')
+            fn (callable): Takes the timeout in seconds and performs the request
+            deadline (Deadline, optional): Budget for the call, defaults to a full turn
+            hedge (bool): Whether to send a duplicate request if the first is slow
+
+        Returns:
+            The result of the first attempt to succeed
+
+        Raises:
+            CircuitOpenError: The provider is degraded and is being skipped
+            DeadlineExceeded: The budget ran out before any attempt succeeded
+            Exception: The error from the last failed attempt
+        """
+        provider = cls._providers[name]
+        deadline = deadline or Deadline(cls.TURN_BUDGET)
+
+        # Before allow(), which may hand this call the half-open trial that must end in a success or failure
+        if deadline.remaining() < cls.MIN_ATTEMPT_TIME:
+            provider.count('timeouts')
+            raise DeadlineExceeded(f"No time left in the budget for {name}")
+        if not provider.breaker.allow():
+            provider.count('rejected')
+            raise CircuitOpenError(f"{name} circuit is open")
+
+        def attempt(hedged):
+            provider.count('requests')
+            started = time.perf_counter()
+            try:
+                result = fn(deadline.remaining())
+            except Exception:
+                PROVIDER_REQUEST_SECONDS.observe(time.perf_counter() - started, provider=name, outcome='error')
+                raise
+            provider.observe(time.perf_counter() - started)
+            return result, hedged
+
+        pending = {cls._executor.submit(attempt, False)}
+        hedge_at = time.monotonic() + provider.hedge_delay() if hedge else None
+        last_error = None
+
+        while pending or hedge_at is not None:
+            now = time.monotonic()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if deadline.remaining() >= cls.MIN_ATTEMPT_TIME:
+                    provider.count('hedged')
+                    pending.add(cls._executor.submit(attempt, True))
+            if not pending:
+                break
+
+            wake = min(deadline.expires, hedge_at) if hedge_at is not None else deadline.expires
+            done, pending = wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    result, hedged = future.result()
+                except Exception as e:
+                    last_error = e
+                    # A fast failure sends the hedge right away, as a retry
+                    if hedge_at is not None:
+                        hedge_at = time.monotonic()
+                    continue
+                if hedged:
+                    provider.count('hedge_wins')
+                provider.breaker.record_success()
+                return result
+
+            if not done and deadline.expired():
+                provider.count('timeouts')
+                provider.breaker.record_failure()
+                raise DeadlineExceeded(f"{name} did not respond within the turn budget")
+
+        provider.count('errors')
+        provider.breaker.record_failure()
+        raise last_error
+
+    @classmethod
+    def stats(cls):
+        """Per-provider tail latency, counters and breaker state"""
+        return {name: provider.stats() for name, provider in cls._providers.items()}
+
+BREAKER_OPEN = Gauge(
+    'boardy_provider_circuit_open',
+    'Whether a provider\'s circuit breaker is rejecting calls (1) or not (0)',
+    ['provider'],
+    callback=lambda: {
+        (name,): int(provider.breaker.state == 'open')
+        for name, provider in Resilience._providers.items()
+    }
+)
@@ -0,0 +1,96 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app, jsonify, request
+from metrics import Counter
+
+# A serialized JSON body and its validators; last_modified may be None
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'last_modified'])
+
+class ResponseCache:
+    """
+    A small per-worker LRU of serialized JSON responses.
+
+    Each body is stored with the version it is valid for, typically
+    collection generations (see Generations), and is only returned while
+    the caller's current version matches. Responses carry an ETag (and
+    Last-Modified when given), so clients revalidating an unchanged
+    resource get a 304 with no body.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._entries = OrderedDict()  # key -> (version, CachedResponse)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """The cached response for key if it was stored at this version, else None"""
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                RESPONSE_CACHE.inc(cache=self.name, result='hit')
+                return entry[1]
+        RESPONSE_CACHE.inc(cache=self.name, result='miss')
+        return None
+
+    def put(self, key, version, payload, etag=None, last_modified=None):
+        """
+        Serialize a payload as jsonify() would and cache it.
+
+        Args:
+            key: What the response is for
+            version: What it depends on; None serializes without caching
+            payload (dict): The response body
+            etag (str, optional): Defaults to a digest of the body
+            last_modified (datetime, optional): For Last-Modified
+
+        Returns:
+            CachedResponse: The serialized response
+        """
+        body = jsonify(payload).get_data()
+        cached = CachedResponse(body, etag or hashlib.blake2b(body, digest_size=12).hexdigest(), last_modified)
+        if version is not None and self.size > 0:
+            with self._lock:
+                self._entries[key] = (version, cached)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def discard(self, key):
+        """Forget a key after this worker changed what it describes"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def not_modified(self, etag):
+        """A 304 when the request's If-None-Match holds etag, else None; for ETags known before the body"""
+        if not request.if_none_match.contains_weak(etag):
+            return None
+        RESPONSE_CACHE.inc(cache=self.name, result='not_modified')
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    def respond(self, cached):
+        """The cached response, or a 304 when the request's validators still match it"""
+        response = current_app.response_class(cached.body, mimetype='application/json')
+        response.set_etag(cached.etag)
+        if cached.last_modified is not None:
+            response.last_modified = cached.last_modified
+        # Browsers revalidate every time instead of reusing a copy unasked
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code == 304:
+            RESPONSE_CACHE.inc(cache=self.name, result='not_modified')
+        return response
+
+RESPONSE_CACHE = Counter(
+    'boardy_response_cache_total',
+    'Cached person read responses by cache and result (hit, miss, or not_modified for a 304)',
+    ['cache', 'result']
+)
@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+from collections import deque, Counter
+from logs import get_logger
+from history import SUMMARY_HEADER
+from metrics import LLM_ROUTES
+
+logger = get_logger('router')
+
+# Phrases that suggest the caller has shared each part of their profile
+PROFILE_SIGNALS = {
+    'location': re.compile(r"\b(i'?m from|i am from|live in|living in|based in|moved to|grew up in|out of)\b", re.I),
+    'interests': re.compile(r"\b(love|into|interested in|enjoy|hobby|hobbies|passion|passionate|fan of)\b", re.I),
+    'skills': re.compile(r"\b(good at|skilled|i work|i'?m an? |i am an? |for a living|my job|engineer|developer|programmer|designer|teacher|nurse)\b", re.I),
+    'bio': re.compile(r"\b(years|experience|background|career|worked|studied|degree|founded|started)\b", re.I),
+}
+
+# Labeled bullets in the running summary of older turns
+SUMMARY_LABEL = re.compile(r"^\s*-?\s*(location|interests|skills|bio)\s*:", re.I | re.M)
+
+# Caller explicitly asking to be matched
+MATCH_REQUEST = re.compile(r"\b(who should i meet|connect me|introduce me|recommend|match me|find (me )?(someone|people))\b", re.I)
+
+class ModelRouter:
+    """
+    Routes each turn to a fast model or the large model.
+
+    Ordinary conversational turns go to the fast model. The turn is
+    escalated to the large model when the caller's profile looks complete
+    (so a getSimilarPeople tool call is likely) or the caller asks for a
+    match. Fast-model output that fails validation is retried on the large
+    model. Every decision and per-model latency is recorded so the
+    thresholds can be tuned.
+    """
+    FAST_MODEL = os.getenv('LLM_FAST_MODEL', 'llama-3.1-8b-instant')
+    LARGE_MODEL = os.getenv('LLM_LARGE_MODEL', 'llama-3.3-70b-versatile')
+    # Fraction of profile signals (location, interests, skills, bio) needed to escalate
+    ESCALATE_SCORE = float(os.getenv('ROUTER_ESCALATE_SCORE', 0.75))
+    # Longest fast-model reply accepted for a voice turn
+    MAX_REPLY_CHARS = int(os.getenv('ROUTER_MAX_REPLY_CHARS', 400))
+    LATENCY_WINDOW = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._decisions = Counter()
+        self._latencies = {}
+
+    @staticmethod
+    def profile_score(messages):
+        """Fraction of profile parts (location, interests, skills, bio) the caller has shared"""
+        found = set()
+        for msg in messages:
+            content = msg.get('content') or ''
+            if msg.get('role') == 'user':
+                found.update(name for name, pattern in PROFILE_SIGNALS.items() if pattern.search(content))
+            elif msg.get('role') == 'system' and SUMMARY_HEADER in content:
+                # Older turns may only survive in the running summary
+                summary = content.split(SUMMARY_HEADER, 1)[1]
+                found.update(label.lower() for label in SUMMARY_LABEL.findall(summary))
+        return len(found) / len(PROFILE_SIGNALS)
+
+    def choose_model(self, messages):
+        """
+        Pick the model for a turn.
+
+        Returns:
+            tuple: (model, reason)
+        """
+        last_user = next((msg.get('content') or '' for msg in reversed(messages) if msg.get('role') == 'user'), '')
+        if MATCH_REQUEST.search(last_user):
+            return self.LARGE_MODEL, 'match_request'
+
+        score = self.profile_score(messages)
+        if score >= self.ESCALATE_SCORE:
+            return self.LARGE_MODEL, f'profile_complete:{score:.2f}'
+
+        return self.FAST_MODEL, f'conversational:{score:.2f}'
+
+    def validate(self, content):
+        """
+        Check a fast-model reply is usable as-is.
+
+        Returns:
+            str or None: Why the reply failed validation, or None if it passed
+        """
+        if not content or not content.strip():
+            return 'empty'
+        if 'getSimilarPeople' in content:
+            # Leave tool calls to the large model, which formats them reliably
+            return 'tool_call'
+        if '{' in content or '}' in content:
+            return 'stray_json'
+        if len(content) > self.MAX_REPLY_CHARS:
+            return 'too_long'
+        return None
+
+    def record(self, model, reason, latency):
+        """Record a routing decision and the latency of the request it made"""
+        decision = reason.split(':')[0]
+        LLM_ROUTES.inc(model=model, reason=decision)
+        with self._lock:
+            self._decisions[decision] += 1
+            self._latencies.setdefault(model, deque(maxlen=self.LATENCY_WINDOW)).append(latency)
+        logger.info("Model routed", model=model, reason=reason, latency_ms=round(latency * 1000))
+
+    def stats(self):
+        """Decision counts and per-model latency percentiles (in ms)"""
+        with self._lock:
+            latencies = {model: sorted(samples) for model, samples in self._latencies.items()}
+            decisions = dict(self._decisions)
+
+        def percentile(samples, p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            'decisions': decisions,
+            'latency_ms': {
+                model: {
+                    'count': len(samples),
+                    'p50': percentile(samples, 0.5),
+                    'p95': percentile(samples, 0.95)
+                }
+                for model, samples in latencies.items() if samples
+            }
+        }
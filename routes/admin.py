@@ -0,0 +1,68 @@
+from flask import Blueprint, jsonify
+from db_monitor import DatabaseMonitor
+from embedding_queue import EmbeddingQueue
+from dedup import DuplicateDetector
+from snapshot import EmbeddingSnapshot
+
+# Create blueprint
+admin_bp = Blueprint('admin', __name__)
+
+@admin_bp.route('/db-stats', methods=['GET'])
+def db_stats():
+    """Per-command MongoDB latency, recent slow queries with their query plans, and pool state"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': DatabaseMonitor.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
+
+@admin_bp.route('/embedding-queue', methods=['GET'])
+def embedding_queue():
+    """Embedding jobs by status and the most recent dead letters"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': EmbeddingQueue.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
+
+@admin_bp.route('/duplicates', methods=['GET'])
+def duplicates():
+    """Near-duplicate persons flagged and merged, and the largest clusters"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': DuplicateDetector.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
+
+@admin_bp.route('/embedding-snapshot', methods=['GET'])
+def embedding_snapshot():
+    """The on-disk embedding snapshot: generation, rows, dead rows and delta size"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': EmbeddingSnapshot.stats() if EmbeddingSnapshot.enabled() else None
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
@@ -1,14 +1,31 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from database import MongoDB
 from datetime import datetime, timezone
 from embeddings import EmbeddingGenerator
-import re
-import numpy as np
+from search import build_similar_response, format_match
+from vector_index import VectorIndex
+from locations import Gazetteer, location_fields
+from prefetch import CallerPrefetch
+from tracing import Tracer
+from logs import get_logger, lazy_json
+from inference import InferenceOverloaded
+from profiles import profile_embedding_fields, EMBEDDING_PENDING, PERSON_RESPONSE_FIELDS
+from embedding_queue import EmbeddingQueue
+from matches import MatchTable
+from dedup import DuplicateDetector
+from snapshot import EmbeddingSnapshot
+from generations import Generations
+from similar_cache import SimilarCache, similar_cache_key
+from response_cache import ResponseCache
 import json
+import os
+import re
 
 # Create blueprint
 person_bp = Blueprint('person', __name__)
 
+log = get_logger('search')
+
 # Phone number validation regex
 PHONE_REGEX = re.compile(r'^\+[1-9]\d{1,14}$')
 
@@ -16,6 +33,85 @@ def validate_phone_number(phone_number):
     """Validate phone number format using E.164 standard"""
     return bool(PHONE_REGEX.match(phone_number))
 
+# Most matches /similar returns with top_k
+SIMILAR_MAX_TOP_K = 20
+
+# Search radius when /similar gets near without radius_km
+DEFAULT_RADIUS_KM = float(os.getenv('SIMILAR_DEFAULT_RADIUS_KM', 50))
+
+# /similar/batch limits, and how many queries are scored (and streamed) together
+BATCH_MAX_QUERIES = int(os.getenv('SIMILAR_BATCH_MAX_QUERIES', 1000))
+BATCH_MAX_TOP_K = int(os.getenv('SIMILAR_BATCH_MAX_TOP_K', 50))
+BATCH_BLOCK_SIZE = int(os.getenv('SIMILAR_BATCH_BLOCK_SIZE', 64))
+
+# Serialized GET /api/person responses by phone number, and /list pages,
+# served while the persons (and for /list, conversations) generations hold
+PERSON_RESPONSES = ResponseCache('person', int(os.getenv('PERSON_CACHE_SIZE', 1024)))
+LIST_RESPONSES = ResponseCache('list', int(os.getenv('PERSON_LIST_CACHE_SIZE', 32)))
+
+def parse_location_filters(args):
+    """
+    Parse the /similar location filters from the query string.
+
+    Args:
+        args: Request args with optional region (name or code), near
+            ("lat,lon" or a place name) and radius_km
+
+    Returns:
+        tuple: (filters for VectorIndex.search, error message or None)
+    """
+    filters = {}
+    region = args.get('region', '').strip()
+    if region:
+        filters['region'] = Gazetteer.resolve_region(region)
+        if not filters['region']:
+            return None, f"Unknown region: {region}"
+
+    near = args.get('near', '').strip()
+    radius = args.get('radius_km')
+    if radius is not None and not near:
+        return None, 'radius_km requires near'
+    if near:
+        try:
+            lat, lon = (float(part) for part in near.split(','))
+        except ValueError:
+            place = Gazetteer.resolve(near)
+            if not place or place['lat'] is None:
+                return None, f"Unknown place: {near}"
+            lat, lon = place['lat'], place['lon']
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None, 'near must be a valid latitude,longitude'
+        try:
+            radius_km = float(radius) if radius is not None else DEFAULT_RADIUS_KM
+        except ValueError:
+            return None, 'radius_km must be a number'
+        if radius_km <= 0:
+            return None, 'radius_km must be positive'
+        filters['near'] = (lat, lon)
+        filters['radius_km'] = radius_km
+    return filters, None
+
+def overloaded_response(error):
+    """Fast 503 when the inference executor is saturated, so clients back off and retry"""
+    log.warning("Shedding %s: %s", request.path, error)
+    response = jsonify({
+        'success': False,
+        'error': 'Server is busy, please retry shortly',
+        'code': 503
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def stored_embedding(phone_number):
+    """A person's stored embedding, used instead of encoding the query when inference is saturated"""
+    if not phone_number:
+        return None
+    person = MongoDB().get_db().persons.find_one(
+        {'phoneNumber': phone_number},
+        {'_id': 0, 'vectorEmbedding': 1}
+    )
+    return person.get('vectorEmbedding') if person else None
+
 @person_bp.route('/create', methods=['POST'])
 def create_person():
     try:
@@ -45,7 +141,7 @@ def create_person():
             }), 400
             
         # Get database instance
-        db = MongoDB().get_db()
+        db = MongoDB().get_db('profiles')
         
         # Check if phone number already exists
         if db.persons.find_one({'phoneNumber': data['phoneNumber']}):
@@ -55,13 +151,14 @@ def create_person():
                 'code': 409
             }), 409
             
-        # Get interests and skills
+        # Get interests, skills and bio
         interests = data.get('interests', [])
         skills = data.get('skills', [])
+        bio = data.get('bio', '')
         
-        # Generate embedding for interests and skills
-        embedding_generator = EmbeddingGenerator.get_instance()
-        vector_embedding = embedding_generator.generate_combined_embedding(interests, skills)
+        # Reuse an existing embedding of the canonical profile text, or mark it
+        # pending for the embedding queue so the write doesn't wait on the model
+        embedding_fields = profile_embedding_fields(interests, skills, bio)
             
         # Prepare person document
         now = datetime.now(timezone.utc)
@@ -70,15 +167,28 @@ def create_person():
             'name': data['name'],
             'interests': interests,
             'skills': skills,
-            'bio': data.get('bio', ''),
+            'bio': bio,
             'location': data.get('location', ''),
-            'vectorEmbedding': vector_embedding,
+            **location_fields(data.get('location', '')),
+            **embedding_fields,
             'createdAt': now,
             'updatedAt': now
         }
         
         # Insert person into database
         result = db.persons.insert_one(person)
+        VectorIndex.invalidate()
+        Generations.bump()
+        PERSON_RESPONSES.discard(person['phoneNumber'])
+        
+        if person.get('embeddingStatus') == EMBEDDING_PENDING:
+            EmbeddingQueue.enqueue(person['phoneNumber'], person['profileHash'])
+        else:
+            MatchTable.schedule(person['phoneNumber'], person.get('vectorEmbedding'))
+            DuplicateDetector.schedule(person['phoneNumber'], person.get('vectorEmbedding'))
+        
+        # Keep a live caller's prefetched record current
+        CallerPrefetch.refresh_person(person['phoneNumber'], dict(person))
         
         # Remove _id and vectorEmbedding from response
         person.pop('_id', None)
@@ -100,9 +210,6 @@ def create_person():
 @person_bp.route('/list', methods=['GET'])
 def list_persons():
     try:
-        # Get database instance
-        db = MongoDB().get_db()
-        
         # Get pagination parameters from query string
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 100))
@@ -113,6 +220,24 @@ def list_persons():
         if per_page < 1 or per_page > 100:
             per_page = 100
             
+        # Pages only change with the persons or conversations generation, so
+        # a client holding the current ETag gets a 304 without any query
+        generations = (Generations.current('persons'), Generations.current('conversations'))
+        version = None if None in generations else generations
+        etag = f"list-{page}-{per_page}-{generations[0]}-{generations[1]}" if version else None
+        if version:
+            response = LIST_RESPONSES.not_modified(etag)
+            if response is not None:
+                return response
+            cached = LIST_RESPONSES.get((page, per_page), version)
+            if cached is not None:
+                return LIST_RESPONSES.respond(cached)
+            
+        # A page cached under the current generations must include their
+        # writes, which a lagging secondary may not have yet; the cache keeps
+        # these primary reads down to one per page per write
+        db = MongoDB().get_db() if version else MongoDB().get_db('analytics')
+            
         # Calculate skip value for pagination
         skip = (page - 1) * per_page
         
@@ -120,7 +245,7 @@ def list_persons():
         total_count = db.persons.count_documents({})
         
         # Get paginated results
-        cursor = db.persons.find({}).skip(skip).limit(per_page)
+        cursor = db.persons.find({}, PERSON_RESPONSE_FIELDS).skip(skip).limit(per_page)
         
         # Convert cursor to list and process each document
         persons = []
@@ -160,7 +285,7 @@ def list_persons():
             
             persons.append(person)
             
-        return jsonify({
+        cached = LIST_RESPONSES.put((page, per_page), version, {
             'success': True,
             'data': {
                 'persons': persons,
@@ -171,7 +296,8 @@ def list_persons():
                     'total_pages': (total_count + per_page - 1) // per_page
                 }
             }
-        })
+        }, etag=etag)
+        return LIST_RESPONSES.respond(cached)
         
     except Exception as e:
         return jsonify({
@@ -188,6 +314,10 @@ def delete_all_persons():
         
         # Delete all documents from persons collection
         result = db.persons.delete_many({})
+        VectorIndex.invalidate()
+        Generations.bump()
+        MatchTable.remove_all()
+        EmbeddingSnapshot.clear()
         
         return jsonify({
             'success': True,
@@ -218,11 +348,22 @@ def get_person():
                 'code': 400
             }), 400
             
-        # Get database instance
-        db = MongoDB().get_db()
-        
-        # Find person by phone number
-        person = db.persons.find_one({'phoneNumber': phone_number})
+        # Unchanged since this worker last read it: no database round trip,
+        # and a 304 when the client's ETag or Last-Modified still matches
+        generation = Generations.current()
+        cached = PERSON_RESPONSES.get(phone_number, generation)
+        if cached is not None:
+            return PERSON_RESPONSES.respond(cached)
+            
+        # Callers on a live call come from their prefetched record, which is
+        # only returned while it is current at this generation
+        person = CallerPrefetch.get_person(phone_number)
+        if not person:
+            # Get database instance
+            db = MongoDB().get_db()
+            
+            # Find person by phone number
+            person = db.persons.find_one({'phoneNumber': phone_number}, PERSON_RESPONSE_FIELDS)
         
         # Return 404 if person not found
         if not person:
@@ -236,10 +377,12 @@ def get_person():
         person.pop('_id', None)
         person.pop('vectorEmbedding', None)
         
-        return jsonify({
-            'success': True,
-            'data': person
-        })
+        # Embedding writes don't touch updatedAt, so the later of the two
+        last_modified = max(filter(None, (person.get('updatedAt'), person.get('embeddedAt'))), default=None)
+        cached = PERSON_RESPONSES.put(
+            phone_number, generation, {'success': True, 'data': person}, last_modified=last_modified
+        )
+        return PERSON_RESPONSES.respond(cached)
         
     except Exception as e:
         return jsonify({
@@ -263,7 +406,7 @@ def update_person():
             }), 400
             
         # Get database instance
-        db = MongoDB().get_db()
+        db = MongoDB().get_db('profiles')
         
         # Find person by phone number
         person = db.persons.find_one({'phoneNumber': phone_number})
@@ -331,21 +474,17 @@ def update_person():
             bio_updated = True
         if 'location' in data:
             update_data['location'] = data['location']
+            update_data.update(location_fields(data['location']))
             
-        # Update vector embedding if interests, skills, or bio changed
+        # Queue a new embedding if interests, skills, or bio were sent and the
+        # merged profile text changed
         if interests_updated or skills_updated or bio_updated:
             # Get current or updated values
             interests = update_data.get('interests', person.get('interests', []))
             skills = update_data.get('skills', person.get('skills', []))
             bio = update_data.get('bio', person.get('bio', ''))
             
-            # Generate new embedding
-            embedding_generator = EmbeddingGenerator.get_instance()
-            update_data['vectorEmbedding'] = embedding_generator.generate_combined_embedding(
-                interests=interests,
-                skills=skills,
-                bio=bio
-            )
+            update_data.update(profile_embedding_fields(interests, skills, bio, existing=person))
             
         # Update timestamp
         update_data['updatedAt'] = datetime.now(timezone.utc)
@@ -363,8 +502,20 @@ def update_person():
                 'code': 400
             }), 400
             
+        VectorIndex.invalidate()
+        Generations.bump()
+        PERSON_RESPONSES.discard(phone_number)
+        if update_data.get('embeddingStatus') == EMBEDDING_PENDING:
+            EmbeddingQueue.enqueue(phone_number, update_data['profileHash'])
+        elif update_data.get('vectorEmbedding'):
+            MatchTable.schedule(phone_number, update_data['vectorEmbedding'])
+            DuplicateDetector.schedule(phone_number, update_data['vectorEmbedding'])
+            
         # Get updated person
-        updated_person = db.persons.find_one({'phoneNumber': phone_number})
+        updated_person = db.persons.find_one({'phoneNumber': phone_number}, PERSON_RESPONSE_FIELDS)
+        
+        # Keep a live caller's prefetched record current
+        CallerPrefetch.refresh_person(phone_number, dict(updated_person))
         
         # Remove _id and vectorEmbedding from response
         updated_person.pop('_id', None)
@@ -386,19 +537,27 @@ def update_person():
 @person_bp.route('/similar', methods=['GET'])
 def find_similar_people():
     try:
-        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        print(f"\n[{timestamp}] === Similar People Search Request ===")
-        print(f"[{timestamp}] Query Parameters: {dict(request.args)}")
-        print(f"[{timestamp}] Headers: {dict(request.headers)}")
-        print(f"[{timestamp}] Remote Address: {request.remote_addr}")
-        print(f"[{timestamp}] ===================================\n")
+        # Request details are only gathered when debug logging is on for search
+        if log.enabled():
+            log.debug(
+                "Similar people search request",
+                args=dict(request.args),
+                headers=dict(request.headers),
+                remote_addr=request.remote_addr
+            )
 
+        # Join the calling voice turn's trace when the tool call passes its call
+        Tracer.bind(request.headers.get('X-Call-UUID'))
+        
         # Get and validate query parameter
         query_text = request.args.get('query')
         
+        # Optional phone number to leave out of the results (the caller themselves)
+        exclude_phone = request.args.get('exclude')
+        
         # Validate query is present and is a string
         if not isinstance(query_text, str):
-            print(f"[{timestamp}] Error: Query must be a string, got {type(query_text)}")
+            log.warning("Query must be a string, got %s", type(query_text).__name__)
             return jsonify({
                 'success': False,
                 'error': 'Query must be a string',
@@ -408,94 +567,279 @@ def find_similar_people():
         # Validate query is not empty after stripping whitespace
         query_text = query_text.strip()
         if not query_text:
-            print(f"[{timestamp}] Error: Empty query after stripping whitespace")
+            log.warning("Empty query after stripping whitespace")
             return jsonify({
                 'success': False,
                 'error': 'Query cannot be empty',
                 'code': 400
             }), 400
             
-        print(f"[{timestamp}] Processing search query: '{query_text}'")
+        # Optional location pre-filters: region, near and radius_km
+        filters, error = parse_location_filters(request.args)
+        if error:
+            log.warning("Invalid location filter: %s", error)
+            return jsonify({
+                'success': False,
+                'error': error,
+                'code': 400
+            }), 400
             
-        # Get database instance
-        db = MongoDB().get_db()
-        
-        # Generate embedding for the query text
-        embedding_generator = EmbeddingGenerator.get_instance()
-        query_embedding = embedding_generator.generate_embedding(query_text)
-        
-        if not query_embedding:
-            print(f"[{timestamp}] Error: Could not generate embedding for query")
+        # Hybrid (embedding + BM25) ranking unless mode=vector
+        mode = request.args.get('mode', 'hybrid')
+        if mode not in ('hybrid', 'vector'):
+            return jsonify({
+                'success': False,
+                'error': 'mode must be hybrid or vector',
+                'code': 400
+            }), 400
+            
+        # Near-duplicate profiles count once unless collapse=false
+        collapse = request.args.get('collapse', 'true').lower() != 'false'
+        
+        # Optionally return the top few matches besides the best one
+        try:
+            top_k = int(request.args.get('top_k', 1))
+        except ValueError:
+            top_k = 0
+        if not 1 <= top_k <= SIMILAR_MAX_TOP_K:
+            return jsonify({
+                'success': False,
+                'error': f'top_k must be between 1 and {SIMILAR_MAX_TOP_K}',
+                'code': 400
+            }), 400
+            
+        log.info("Processing search query: '%s'", query_text, mode=mode, **filters)
+
+        def run_search():
+            """Embed the query and score it: the response body (None without an embedding) and whether it may be cached"""
+            cacheable = True
+            # Generate embedding for the query text
+            embedding_generator = EmbeddingGenerator.get_instance()
+            with Tracer.span('search_embed'):
+                try:
+                    query_embedding = embedding_generator.generate_embedding(query_text)
+                except InferenceOverloaded:
+                    # Degrade: search with the caller's own stored profile embedding
+                    query_embedding = stored_embedding(exclude_phone)
+                    if not query_embedding:
+                        raise
+                    log.warning("Inference saturated, searching with the caller's stored embedding")
+                    cacheable = False
+
+            if not query_embedding:
+                return None, False
+
+            # Score only the index partitions the filters select, best match first
+            with Tracer.span('search_score'):
+                results, scanned = VectorIndex.search(
+                    query_embedding,
+                    exclude_phone,
+                    query_text=query_text if mode == 'hybrid' else None,
+                    limit=top_k,
+                    collapse=collapse,
+                    **filters
+                )
+
+            response = build_similar_response(results)
+            if top_k > 1:
+                response['matches'] = [format_match(result) for result in results]
+            if results:
+                log.info(
+                    "Best match: %s with similarity %.3f",
+                    results[0]['name'], results[0]['similarity'],
+                    candidates=scanned
+                )
+            else:
+                log.info("No matches found", candidates=scanned)
+            return response, cacheable
+
+        # Identical searches share one result until a person changes or the index is rebuilt
+        generation = Generations.current()
+        key = similar_cache_key(
+            query_text, exclude=exclude_phone, mode=mode, collapse=collapse, top_k=top_k, **filters
+        )
+        try:
+            response = SimilarCache.get_or_compute(
+                key, (generation, VectorIndex.build_number()) if generation is not None else None, run_search
+            )
+        except InferenceOverloaded as e:
+            return overloaded_response(e)
+
+        if response is None:
+            log.warning("Could not generate embedding for query")
             return jsonify({
                 'success': False,
                 'error': 'Could not generate embedding for query',
                 'code': 400
             }), 400
+        log.debug("Returning response: %s", lazy_json(response))
+        return jsonify(response)
+        
+    except Exception as e:
+        log.exception("Error in find_similar_people: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
+
+@person_bp.route('/similar/batch', methods=['POST'])
+def find_similar_people_batch():
+    """
+    Top-k similar people for many queries in one call.
+
+    Body: {"queries": ["query" or {"query": ..., "exclude": phone}, ...],
+    "top_k": 5, plus optional region, near and radius_km as for /similar}.
+    All queries are encoded in one model call, then scored a block at a
+    time; the response is newline-delimited JSON with one line per query,
+    {"index", "query", "matches"}, streamed as each block finishes, and a
+    final {"done": true} line.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        queries = data.get('queries')
+        if not isinstance(queries, list) or not queries:
+            return jsonify({
+                'success': False,
+                'error': 'queries must be a non-empty list',
+                'code': 400
+            }), 400
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {BATCH_MAX_QUERIES} queries per batch',
+                'code': 400
+            }), 400
+
+        texts = []
+        excludes = []
+        for query in queries:
+            if isinstance(query, dict):
+                text, exclude = query.get('query'), query.get('exclude')
+            else:
+                text, exclude = query, None
+            if not isinstance(text, str) or not text.strip():
+                return jsonify({
+                    'success': False,
+                    'error': 'Every query must be a non-empty string',
+                    'code': 400
+                }), 400
+            texts.append(text.strip())
+            excludes.append(exclude)
+
+        try:
+            top_k = int(data.get('top_k', 5))
+        except (TypeError, ValueError):
+            top_k = 0
+        if not 1 <= top_k <= BATCH_MAX_TOP_K:
+            return jsonify({
+                'success': False,
+                'error': f'top_k must be between 1 and {BATCH_MAX_TOP_K}',
+                'code': 400
+            }), 400
+
+        filters, error = parse_location_filters({
+            name: str(data[name]) for name in ('region', 'near', 'radius_km') if data.get(name) is not None
+        })
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error,
+                'code': 400
+            }), 400
+
+        log.info("Processing batch search", queries=len(texts), top_k=top_k, **filters)
+        with Tracer.span('search_embed', queries=len(texts)):
+            try:
+                embeddings = EmbeddingGenerator.get_instance().generate_embeddings(texts)
+            except InferenceOverloaded as e:
+                return overloaded_response(e)
+
+        def generate():
+            try:
+                blocks = VectorIndex.search_batch(
+                    embeddings, top_k, excludes=excludes, block_size=BATCH_BLOCK_SIZE, **filters
+                )
+                for start, block in blocks:
+                    lines = []
+                    for offset, results in enumerate(block):
+                        lines.append(json.dumps({
+                            'index': start + offset,
+                            'query': texts[start + offset],
+                            'matches': [format_match(result) for result in results]
+                        }) + '\n')
+                    yield ''.join(lines)
+                yield json.dumps({'done': True, 'count': len(texts)}) + '\n'
+            except Exception as e:
+                # Headers are gone by now; report the failure in the stream
+                log.exception("Error in batch search: %s", e)
+                yield json.dumps({'done': False, 'error': str(e)}) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        log.exception("Error in find_similar_people_batch: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'code': 500
+        }), 500
+
+@person_bp.route('/matches', methods=['GET'])
+def get_matches():
+    """A person's precomputed top matches from the match table (one _id lookup plus their details)"""
+    try:
+        phone_number = request.args.get('phone_number')
+        if not phone_number:
+            return jsonify({
+                'success': False,
+                'error': 'Phone number is required as a query parameter',
+                'code': 400
+            }), 400
             
-        # Get all candidates
-        candidates = list(db.persons.find({
-            'vectorEmbedding': {'$exists': True, '$ne': None}
-        }))
-        print(f"[{timestamp}] Found {len(candidates)} candidates with embeddings")
-        
-        # Calculate cosine similarity for each candidate
-        results = []
-        query_norm = np.linalg.norm(query_embedding)
-        
-        for candidate in candidates:
-            candidate_embedding = candidate['vectorEmbedding']
-            candidate_norm = np.linalg.norm(candidate_embedding)
-            
-            # Calculate cosine similarity
-            similarity = np.dot(query_embedding, candidate_embedding) / (query_norm * candidate_norm)
-            
-            if similarity > 0:
-                results.append({
-                    'phoneNumber': candidate['phoneNumber'],
-                    'name': candidate['name'],
-                    'interests': candidate.get('interests', []),
-                    'skills': candidate.get('skills', []),
-                    'bio': candidate.get('bio', ''),
-                    'location': candidate.get('location', ''),
-                    'similarity': float(similarity)
-                })
-        
-        print(f"[{timestamp}] Found {len(results)} candidates with positive similarity")
-        
-        # Sort by similarity and get only the best match
-        results.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        if not results:
-            print(f"[{timestamp}] No matches found")
+        try:
+            limit = int(request.args.get('limit', 5))
+        except ValueError:
+            limit = 0
+        if limit < 1:
             return jsonify({
-                'success': True,
-                'best_match': None,
-                'found': False
-            })
+                'success': False,
+                'error': 'limit must be a positive integer',
+                'code': 400
+            }), 400
+            
+        document = MatchTable.get(phone_number)
+        if not document:
+            return jsonify({
+                'success': False,
+                'error': 'No matches computed for this person',
+                'code': 404
+            }), 404
             
-        best_match = results[0]
-        print(f"[{timestamp}] Best match: {best_match['name']} with similarity {best_match['similarity']:.3f}")
+        entries = document['matches'][:limit]
+        db = MongoDB().get_db('analytics')
+        people = {
+            person['phoneNumber']: person
+            for person in db.persons.find(
+                {'phoneNumber': {'$in': [entry['phone'] for entry in entries]}},
+                {'_id': 0, 'phoneNumber': 1, 'name': 1, 'interests': 1, 'skills': 1, 'bio': 1, 'location': 1}
+            )
+        }
+        matches = [
+            format_match(dict(people[entry['phone']], similarity=entry['score']))
+            for entry in entries if entry['phone'] in people
+        ]
         
-        # Format response for easy extraction by Bland AI
-        response = {
+        return jsonify({
             'success': True,
-            'found': True,
-            'best_match': {
-                'phone': best_match['phoneNumber'],  # Simplified key name
-                'name': best_match['name'],
-                'interests': ', '.join(best_match['interests']),  # Join lists for easier extraction
-                'skills': ', '.join(best_match['skills']),
-                'bio': best_match['bio'],
-                'location': best_match['location'],
-                'match_score': round(best_match['similarity'] * 100, 1)  # Convert to percentage
+            'data': {
+                'matches': matches,
+                'computed_at': document['computedAt']
             }
-        }
-        print(f"[{timestamp}] Returning response: {json.dumps(response, indent=2)}")
-        return jsonify(response)
+        })
         
     except Exception as e:
-        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-        print(f"[{timestamp}] Error in find_similar_people: {str(e)}")
+        log.exception("Error in get_matches: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
@@ -510,6 +854,7 @@ def delete_all_conversations():
         
         # Delete all documents from conversations collection
         result = db.conversations.delete_many({})
+        Generations.bump('conversations')
         
         return jsonify({
             'success': True,
@@ -530,7 +875,7 @@ def delete_all_conversations():
 def get_conversations():
     try:
         # Get database instance
-        db = MongoDB().get_db()
+        db = MongoDB().get_db('analytics')
         
         # Get phone number from query parameters (optional)
         phone_number = request.args.get('phone_number')
@@ -2,12 +2,20 @@ from flask import Blueprint, Response, send_from_directory, request, jsonify
 import json
 import os
 import uuid
+import threading
+import time
 from vonage import Vonage, Auth
 from dotenv import load_dotenv
 from datetime import datetime
-from llm import LLMGeneration
+from llm import LLMGeneration, FALLBACK_REPLY
+from history import HistoryManager
 from voice import Voice
-from database import MongoDB
+from session import SessionStore
+from speculative import SpeculativeSearch
+from prefetch import CallerPrefetch, normalize_caller_number
+from resilience import Resilience, Deadline
+from tracing import Tracer
+from logs import get_logger, lazy_json
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +23,10 @@ load_dotenv()
 # Create blueprint
 vonage_bp = Blueprint('vonage', __name__)
 
+log = get_logger('vonage')
+# Separate logger so the high-volume event webhook can be sampled on its own
+event_log = get_logger('vonage.event')
+
 # Get the absolute path of the project root directory
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -38,14 +50,69 @@ client = Vonage(
 AUDIO_DIR = os.path.join(BASE_DIR, 'generated_audio')
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# Pre-generated audio played when ElevenLabs is degraded
+FALLBACK_AUDIO_DIR = os.path.join(BASE_DIR, 'fallback_audio')
+FALLBACK_PHRASES = [FALLBACK_REPLY]
+
 # Initialize LLM and Voice instances
 llm_generator = LLMGeneration()
+history_manager = HistoryManager(llm_generator.client)
 voice_generator = Voice()
 
 def generate_audio_filename():
     """Generate a unique filename for audio files"""
     return f"{uuid.uuid4()}.mp3"
 
+def warm_fallback_audio():
+    """Generate and cache the fallback phrases' audio while ElevenLabs is healthy"""
+    for phrase in FALLBACK_PHRASES:
+        try:
+            voice_generator.cache_fallback(phrase, FALLBACK_AUDIO_DIR)
+        except Exception as e:
+            log.warning("Error caching fallback audio: %s", e)
+
+threading.Thread(target=warm_fallback_audio, name='fallback-audio', daemon=True).start()
+
+def build_speech_action(text, deadline):
+    """
+    Build the NCCO action that speaks the reply.
+    
+    Uses ElevenLabs within the turn's deadline. When it is degraded, plays
+    cached fallback audio for fallback phrases and otherwise falls back to
+    Vonage's built-in text-to-speech so the caller still hears the reply.
+    """
+    try:
+        audio = Resilience.call(
+            'elevenlabs',
+            lambda timeout: voice_generator.generate_speech(text, timeout=timeout),
+            deadline
+        )
+        audio_filename = generate_audio_filename()
+        with open(os.path.join(AUDIO_DIR, audio_filename), 'wb') as f:
+            f.write(audio)
+        log.debug("Generated audio: %s", audio_filename)
+        return {
+            'action': 'stream',
+            'streamUrl': [f"{SERVER_URL}/api/vonage/audio/{audio_filename}"],
+            'bargeIn': True
+        }
+    except Exception as e:
+        log.warning("ElevenLabs unavailable, using fallback: %s", e)
+        
+    fallback_filename = voice_generator.fallback_filename(text)
+    if os.path.exists(os.path.join(FALLBACK_AUDIO_DIR, fallback_filename)):
+        return {
+            'action': 'stream',
+            'streamUrl': [f"{SERVER_URL}/api/vonage/fallback-audio/{fallback_filename}"],
+            'bargeIn': True
+        }
+    return {
+        'action': 'talk',
+        'text': text,
+        'language': 'en-US',
+        'bargeIn': True
+    }
+
 def cleanup_old_audio_files():
     """Clean up audio files older than 1 hour"""
     try:
@@ -55,25 +122,31 @@ def cleanup_old_audio_files():
             if os.path.getctime(filepath) < current_time - 3600:  # 1 hour
                 os.remove(filepath)
     except Exception as e:
-        print(f"Error cleaning up audio files: {e}")
+        log.warning("Error cleaning up audio files: %s", e)
 
 @vonage_bp.route('/intro-audio')
 def serve_intro_audio():
     """Serve the intro.mp3 file"""
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Serving intro audio file from {BASE_DIR}")
+    log.debug("Serving intro audio file from %s", BASE_DIR)
     return send_from_directory(BASE_DIR, 'intro.mp3')
 
 @vonage_bp.route('/webhooks/inbound', methods=['GET'])
 def handle_inbound_call():
     """Handle inbound calls from Vonage"""
     call_uuid = request.args.get('uuid', 'No UUID provided')
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Received inbound call - UUID: {call_uuid}")
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Call parameters: {request.args}")
+    Tracer.bind(call_uuid)
+    log.info("Received inbound call", call_uuid=call_uuid, caller=request.args.get('from'))
+    if log.enabled():
+        log.debug("Call parameters: %s", lazy_json(request.args.to_dict()))
     
-    # Store initial greeting in MongoDB
-    initial_greeting = "Hey I'm Boardy, it's nice to meet you. Who am I speaking with?"
-    db = MongoDB()
-    db.update_conversation(call_uuid, assistant_message=initial_greeting)
+    with Tracer.span('inbound_setup'):
+        # Start loading what we know about the caller before they say anything
+        caller_phone = normalize_caller_number(request.args.get('from'))
+        CallerPrefetch.start(call_uuid, caller_phone)
+        
+        # Start the call's session with the initial greeting (persisted in the background)
+        initial_greeting = "Hey I'm Boardy, it's nice to meet you. Who am I speaking with?"
+        SessionStore.seed(call_uuid, assistant_message=initial_greeting, phone_number=caller_phone)
     
     # Create NCCO with both stream and input actions
     ncco = [{
@@ -92,29 +165,31 @@ def handle_inbound_call():
         }
     }]
     
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Returning NCCO for call {call_uuid}")
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] NCCO content: {json.dumps(ncco, indent=2)}")
+    log.debug("Returning NCCO: %s", lazy_json(ncco), call_uuid=call_uuid)
     return Response(json.dumps(ncco), mimetype='application/json')
 
 @vonage_bp.route('/webhooks/input', methods=['POST'])
 def handle_input():
     """Handle speech input from the call"""
     try:
+        received_at = time.time()
+        received = time.perf_counter()
         input_data = request.json
         call_uuid = input_data.get('uuid', '')  # Get call UUID
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Speech input received for call: {call_uuid}")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Input data: {json.dumps(input_data, indent=2)}")
+        Tracer.bind(call_uuid)
+        log.debug("Input data: %s", lazy_json(input_data), call_uuid=call_uuid)
         
         # Extract speech text from results
         speech_text = ""
         if input_data.get('speech') and input_data['speech'].get('results'):
             result = input_data['speech']['results'][0]  # Get first result
             speech_text = result.get('text', '')
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Speech text: {speech_text}")
+            log.info("Speech text: %s", speech_text, call_uuid=call_uuid)
+        Tracer.record(call_uuid, 'webhook_receipt', received_at, time.perf_counter() - received)
 
         # Skip LLM processing if speech text is empty or None
         if not speech_text:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] No valid speech text received, sending retry NCCO")
+            log.info("No valid speech text received, sending retry NCCO", call_uuid=call_uuid)
             ncco = [{
                 'action': 'input',
                 'eventUrl': [f"{SERVER_URL}/api/vonage/webhooks/input"],
@@ -131,44 +206,47 @@ def handle_input():
         # Clean up old audio files
         cleanup_old_audio_files()
 
-        # Get conversation history from MongoDB
-        db = MongoDB()
-        conversation_history = db.get_conversation_history(call_uuid)
-        
-        # Build messages list with system prompt and conversation history
-        messages = [
-            {"role": "system", "content": llm_generator.get_system_prompt()},
-        ]
+        # Get conversation history from the call's session
+        with Tracer.span('history_fetch'):
+            conversation_history = SessionStore.get_history(call_uuid)
         
-        # Add conversation history
-        messages.extend(conversation_history)
+        # Feed the running profile and search ahead in the background
+        SpeculativeSearch.observe(
+            call_uuid,
+            speech_text,
+            history=conversation_history,
+            exclude_phone=CallerPrefetch.caller_phone(call_uuid)
+        )
         
-        # Add current user message
-        messages.append({"role": "user", "content": speech_text})
+        # Every outbound call for this turn shares one latency budget
+        deadline = Deadline(Resilience.TURN_BUDGET)
         
-        # Generate LLM response
-        llm_response = "".join(list(llm_generator.generate_response(messages)))
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] LLM response: {llm_response}")
-
-        # Update conversation history with new messages
-        db.update_conversation(
+        # Build messages list with system prompt, conversation history and the
+        # current user message, summarizing older turns to fit the token budget
+        messages = history_manager.build_messages(
             call_uuid,
-            user_message=speech_text,
-            assistant_message=llm_response
+            llm_generator.get_system_prompt() + CallerPrefetch.prompt_context(call_uuid),
+            conversation_history,
+            speech_text
         )
+        
+        # Generate LLM response
+        with Tracer.span('llm'):
+            llm_response = "".join(list(llm_generator.generate_response(messages, call_uuid=call_uuid, deadline=deadline)))
+        log.info("LLM response: %s", llm_response, call_uuid=call_uuid)
 
-        # Generate audio from LLM response
-        audio_filename = generate_audio_filename()
-        audio_path = os.path.join(AUDIO_DIR, audio_filename)
-        voice_generator.generate_speech(llm_response, output_path=audio_path)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Generated audio: {audio_filename}")
+        # Update conversation history with new messages (persisted in the background)
+        with Tracer.span('db_enqueue'):
+            SessionStore.append(
+                call_uuid,
+                user_message=speech_text,
+                assistant_message=llm_response
+            )
 
-        # Create NCCO response
-        ncco = [{
-            'action': 'stream',
-            'streamUrl': [f"{SERVER_URL}/api/vonage/audio/{audio_filename}"],
-            'bargeIn': True
-        }, {
+        # Generate audio from LLM response and create NCCO response
+        with Tracer.span('tts'):
+            speech_action = build_speech_action(llm_response, deadline)
+        ncco = [speech_action, {
             'action': 'input',
             'eventUrl': [f"{SERVER_URL}/api/vonage/webhooks/input"],
             'type': ['speech'],
@@ -180,11 +258,14 @@ def handle_input():
             }
         }]
 
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Returning NCCO: {json.dumps(ncco, indent=2)}")
-        return Response(json.dumps(ncco), mimetype='application/json')
+        with Tracer.span('ncco_return'):
+            log.debug("Returning NCCO: %s", lazy_json(ncco), call_uuid=call_uuid)
+            response = Response(json.dumps(ncco), mimetype='application/json')
+        Tracer.record(call_uuid, 'turn', received_at, time.perf_counter() - received)
+        return response
 
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Error processing speech input: {str(e)}")
+        log.exception("Error processing speech input: %s", e)
         return "Error", 500
 
 @vonage_bp.route('/webhooks/event', methods=['POST'])
@@ -195,12 +276,19 @@ def handle_event():
         event_type = event_data.get('type', 'unknown')
         call_uuid = event_data.get('uuid', 'No UUID')
         
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Received event type: {event_type} for call: {call_uuid}")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Full event data: {json.dumps(event_data, indent=2)}")
+        event_log.info("Received event", type=event_type, status=event_data.get('status'), call_uuid=call_uuid)
+        event_log.debug("Full event data: %s", lazy_json(event_data), call_uuid=call_uuid)
+        
+        # Per-call state is only useful while the call is live
+        if event_data.get('status') == 'completed':
+            SessionStore.evict(call_uuid)
+            SpeculativeSearch.discard(call_uuid)
+            history_manager.discard(call_uuid)
+            CallerPrefetch.discard(call_uuid)
         
         return "OK", 200
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Error processing event: {str(e)}")
+        event_log.exception("Error processing event: %s", e)
         return "Error", 500
 
 @vonage_bp.route('/audio/<filename>')
@@ -209,5 +297,48 @@ def serve_audio(filename):
     try:
         return send_from_directory(AUDIO_DIR, filename)
     except Exception as e:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Error serving audio file: {str(e)}")
-        return "Error", 500
\ No newline at end of file
+        log.error("Error serving audio file: %s", e)
+        return "Error", 500
+
+@vonage_bp.route('/fallback-audio/<filename>')
+def serve_fallback_audio(filename):
+    """Serve cached fallback audio files"""
+    try:
+        return send_from_directory(FALLBACK_AUDIO_DIR, filename)
+    except Exception as e:
+        log.error("Error serving fallback audio file: %s", e)
+        return "Error", 500
+
+@vonage_bp.route('/provider-stats')
+def provider_stats():
+    """Expose per-provider tail latency, hedging counters and circuit breaker state"""
+    return jsonify({
+        'success': True,
+        'data': Resilience.stats()
+    })
+
+@vonage_bp.route('/trace/<call_uuid>')
+def call_trace(call_uuid):
+    """Latency waterfall of a call's turns, for debugging slow calls"""
+    spans = Tracer.waterfall(call_uuid)
+    if spans is None:
+        return jsonify({
+            'success': False,
+            'error': 'No trace for this call',
+            'code': 404
+        }), 404
+    return jsonify({
+        'success': True,
+        'data': {
+            'call_uuid': call_uuid,
+            'spans': spans
+        }
+    })
+
+@vonage_bp.route('/routing-stats')
+def routing_stats():
+    """Expose model routing decisions and per-model latency for threshold tuning"""
+    return jsonify({
+        'success': True,
+        'data': llm_generator.router.stats()
+    })
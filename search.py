@@ -0,0 +1,37 @@
+from vector_index import VectorIndex
+
+def format_match(result):
+    """Format a ranked result the way /similar returns its best match"""
+    match = {
+        'phone': result['phoneNumber'],  # Simplified key name
+        'name': result['name'],
+        'interests': ', '.join(result['interests']),  # Join lists for easier extraction
+        'skills': ', '.join(result['skills']),
+        'bio': result['bio'],
+        'location': result['location'],
+        'match_score': round(result['similarity'] * 100, 1)  # Convert to percentage
+    }
+    if 'distance_km' in result:
+        match['distance_km'] = result['distance_km']
+    return match
+
+def build_similar_response(results):
+    """Build the /similar response body from ranked results"""
+    if not results:
+        return {
+            'success': True,
+            'best_match': None,
+            'found': False
+        }
+
+    # Format response for easy extraction by Bland AI
+    return {
+        'success': True,
+        'found': True,
+        'best_match': format_match(results[0])
+    }
+
+def search_similar(query_embedding, exclude_phone=None, **filters):
+    """Run a similarity search (see VectorIndex.search for filters) and return the /similar response body"""
+    results, _ = VectorIndex.search(query_embedding, exclude_phone, limit=1, **filters)
+    return build_similar_response(results)
@@ -0,0 +1,269 @@
+import os
+import atexit
+import queue
+import threading
+import time
+from logs import get_logger
+from database import MongoDB
+from generations import Generations
+from metrics import TURN_STAGE_SECONDS
+from tracing import Tracer
+
+logger = get_logger('session')
+
+class SessionStore:
+    """
+    In-memory per-call conversation history with write-behind persistence.
+
+    The history for a live call is kept hot in memory so a turn never has to
+    re-read the whole conversation document. New messages are queued and a
+    background writer appends them to MongoDB in batches with bulk_write,
+    off the request's critical path. Sessions expire after SESSION_TTL
+    seconds without activity and are evicted when the call completes.
+
+    Sessions are per worker process, and a call's webhooks can land on any
+    worker. Each session remembers the conversations generation (see
+    Generations) at which it was known to be complete, and this worker's
+    own writes carry it forward when nobody else wrote in between. While
+    the generation is unchanged a turn makes no database call. Once it
+    moves, the session's count of persisted messages is checked against
+    the document's, and when another worker has added messages the history
+    is reloaded from MongoDB, with this worker's still-queued messages
+    after it.
+    """
+    TTL = int(os.getenv('SESSION_TTL', 1800))
+    FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 0.5))
+    BATCH_SIZE = int(os.getenv('SESSION_BATCH_SIZE', 100))
+    MAX_WRITE_ATTEMPTS = 3
+
+    _sessions = {}
+    _lock = threading.Lock()
+    _queue = queue.Queue()
+    _flush_lock = threading.Lock()
+    _retry = []
+    _attempts = 0
+    _writer = None
+
+    @classmethod
+    def seed(cls, call_uuid, user_message=None, assistant_message=None, phone_number=None):
+        """Start a fresh session for a new call with its opening messages"""
+        # Nothing else has written a call that has only just come in
+        generation = Generations.current('conversations')
+        with cls._lock:
+            cls._sessions[call_uuid] = cls._session([], time.monotonic(), generation=generation)
+        if phone_number:
+            # Link the conversation to the caller so later calls can find it
+            cls._queue.put((call_uuid, [], {'phoneNumber': phone_number}))
+        cls.append(call_uuid, user_message=user_message, assistant_message=assistant_message)
+
+    @classmethod
+    def get_history(cls, call_uuid):
+        """
+        Get the conversation history for a call.
+
+        Returns:
+            list: Message dictionaries with role and content
+        """
+        now = time.monotonic()
+        generation = Generations.current('conversations')
+        with cls._lock:
+            cls._expire(now)
+            session = cls._sessions.get(call_uuid)
+            if session is not None:
+                session['expires'] = now + cls.TTL
+                # No conversation written anywhere since it was last complete
+                if generation is not None and session['generation'] == generation:
+                    return list(session['messages'])
+                persisted = session['persisted']
+
+        # Complete unless another worker has persisted messages to this call since
+        if session is not None and cls._persisted_count(call_uuid) == persisted:
+            with cls._lock:
+                session['generation'] = generation
+                return list(session['messages'])
+
+        # Not cached in this worker yet, or out of date: load it from MongoDB
+        conversation = MongoDB().get_db().conversations.find_one(
+            {'call_uuid': call_uuid}, {'_id': 0, 'messages': 1}
+        )
+        stored = (conversation or {}).get('messages') or []
+        with cls._lock:
+            session = cls._sessions.get(call_uuid)
+            # Messages this worker queued that haven't reached MongoDB yet go after the stored ones
+            unsaved = [msg for msg in session['unsaved'] if msg not in stored] if session else []
+            session = cls._sessions[call_uuid] = cls._session(
+                stored + unsaved, now, persisted=len(stored), generation=generation
+            )
+            session['unsaved'] = unsaved
+            return list(session['messages'])
+
+    @classmethod
+    def _session(cls, messages, now, persisted=0, generation=None):
+        """A new session holding messages (role and content only), persisted of them in MongoDB"""
+        return {
+            'messages': [{'role': msg['role'], 'content': msg['content']} for msg in messages],
+            # Queued messages with their timestamps, until the writer persists them
+            'unsaved': [],
+            'persisted': persisted,
+            # Conversations generation at which the messages were complete
+            'generation': generation,
+            'expires': now + cls.TTL
+        }
+
+    @classmethod
+    def _persisted_count(cls, call_uuid):
+        """How many messages the call's conversation document holds"""
+        for row in MongoDB().get_db().conversations.aggregate([
+            {'$match': {'call_uuid': call_uuid}},
+            {'$project': {'_id': 0, 'count': {'$size': {'$ifNull': ['$messages', []]}}}}
+        ]):
+            return row['count']
+        return 0
+
+    @classmethod
+    def append(cls, call_uuid, user_message=None, assistant_message=None):
+        """Add messages to the session and queue them for persistence"""
+        messages = MongoDB.build_conversation_messages(user_message, assistant_message)
+        if not messages:
+            return
+
+        with cls._lock:
+            session = cls._sessions.get(call_uuid)
+            if session is not None:
+                session['messages'].extend(
+                    {'role': msg['role'], 'content': msg['content']} for msg in messages
+                )
+                session['unsaved'].extend(messages)
+                session['expires'] = time.monotonic() + cls.TTL
+
+        cls._queue.put((call_uuid, messages, {}))
+        cls._ensure_writer()
+
+    @classmethod
+    def evict(cls, call_uuid):
+        """Drop a call's session; its queued writes are still persisted"""
+        with cls._lock:
+            cls._sessions.pop(call_uuid, None)
+
+    @classmethod
+    def flush(cls):
+        """Synchronously persist everything that is queued"""
+        for _ in range(cls.MAX_WRITE_ATTEMPTS):
+            while cls._write_batch(block=False):
+                pass
+            if not cls._retry:
+                break
+
+    @classmethod
+    def _ensure_writer(cls):
+        """Start the background writer thread on first use"""
+        with cls._lock:
+            if cls._writer is None:
+                cls._writer = threading.Thread(
+                    target=cls._run_writer,
+                    name='session-writer',
+                    daemon=True
+                )
+                cls._writer.start()
+                atexit.register(cls.flush)
+
+    @classmethod
+    def _run_writer(cls):
+        """Background loop that persists queued messages in batches"""
+        while True:
+            try:
+                if not cls._write_batch(block=True) and cls._retry:
+                    # Back off before retrying a failed batch
+                    time.sleep(cls.FLUSH_INTERVAL)
+            except Exception as e:
+                logger.exception("Writer error: %s", e)
+                time.sleep(cls.FLUSH_INTERVAL)
+
+    @classmethod
+    def _write_batch(cls, block):
+        """
+        Write one batch of queued messages to MongoDB.
+
+        Returns:
+            bool: Whether anything was written
+        """
+        with cls._flush_lock:
+            batch = cls._retry
+            cls._retry = []
+
+            if not batch:
+                try:
+                    batch.append(cls._queue.get(block=block, timeout=cls.FLUSH_INTERVAL if block else None))
+                except queue.Empty:
+                    return False
+
+            # Take whatever else is already queued, up to the batch size
+            while len(batch) < cls.BATCH_SIZE:
+                try:
+                    batch.append(cls._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Coalesce messages for the same call into one update, keeping their order
+            updates = {}
+            for call_uuid, messages, fields in batch:
+                update = updates.setdefault(call_uuid, ([], {}))
+                update[0].extend(messages)
+                update[1].update(fields)
+
+            try:
+                started_at = time.time()
+                started = time.perf_counter()
+                MongoDB().bulk_update_conversations(
+                    [(call_uuid, messages, fields) for call_uuid, (messages, fields) in updates.items()]
+                )
+                duration = time.perf_counter() - started
+                TURN_STAGE_SECONDS.observe(duration, stage='db_write')
+                generation = Generations.bump('conversations')
+                cls._saved(updates, generation)
+                for call_uuid, (messages, _) in updates.items():
+                    Tracer.record(call_uuid, 'db_write', started_at, duration, messages=len(messages), batch=len(updates))
+            except Exception as e:
+                attempts = cls._attempts + 1
+                if attempts < cls.MAX_WRITE_ATTEMPTS:
+                    logger.warning("Error persisting %d queued writes (attempt %d), retrying: %s", len(batch), attempts, e)
+                    cls._retry = batch
+                    cls._attempts = attempts
+                else:
+                    logger.error("Dropping %d queued writes after %d attempts: %s", len(batch), attempts, e)
+                    cls._attempts = 0
+                return False
+
+            cls._attempts = 0
+            return True
+
+    @classmethod
+    def _saved(cls, updates, generation):
+        """
+        Count messages the writer just persisted as no longer unsaved.
+
+        Args:
+            updates (dict): call_uuid -> (messages, fields) just written
+            generation (int): What the write bumped the conversations
+                generation to, or None when the bump failed
+        """
+        with cls._lock:
+            if generation is not None:
+                # Only this write happened since generation - 1, and it is reflected in every session
+                for session in cls._sessions.values():
+                    if session['generation'] == generation - 1:
+                        session['generation'] = generation
+            for call_uuid, (messages, _) in updates.items():
+                session = cls._sessions.get(call_uuid)
+                if session is None:
+                    continue
+                unsaved = [msg for msg in session['unsaved'] if msg not in messages]
+                # A reload racing the write may already have counted them
+                session['persisted'] += len(session['unsaved']) - len(unsaved)
+                session['unsaved'] = unsaved
+
+    @classmethod
+    def _expire(cls, now):
+        """Drop sessions that have been idle past the TTL (caller must hold the lock)"""
+        for call_uuid in [k for k, v in cls._sessions.items() if v['expires'] < now]:
+            del cls._sessions[call_uuid]
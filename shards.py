@@ -0,0 +1,352 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+from locations import distances_km
+from logs import get_logger
+from metrics import Counter
+
+logger = get_logger('shards')
+
+# Processes the similarity index is split across; 0 scans in the request thread
+VECTOR_SHARDS = int(os.getenv('VECTOR_SHARDS', 0))
+
+# Scans of fewer people than this stay in the request thread, where they
+# take less time than the round trip to the shards
+SHARD_MIN_ROWS = int(os.getenv('SHARD_MIN_ROWS', 100000))
+
+# Each shard is one core's worth of work, so its BLAS gets one thread
+BLAS_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+def _layout(rows, dimensions):
+    """Byte offsets of the coordinates, embeddings and penalties in a segment, and its size"""
+    matrix_at = rows * 2 * 8
+    penalties_at = matrix_at + rows * dimensions * 4
+    return 0, matrix_at, penalties_at, penalties_at + rows * 4
+
+def _views(buffer, rows, dimensions):
+    """(embeddings, penalties, coordinates) arrays over a segment's buffer"""
+    coords_at, matrix_at, penalties_at, _ = _layout(rows, dimensions)
+    return (
+        np.ndarray((rows, dimensions), dtype=np.float32, buffer=buffer, offset=matrix_at),
+        np.ndarray(rows, dtype=np.float32, buffer=buffer, offset=penalties_at),
+        np.ndarray((rows, 2), dtype=np.float64, buffer=buffer, offset=coords_at)
+    )
+
+class _Shard:
+    """A shard process's view of one index build: the whole segment, of which it scans rows start:stop"""
+
+    def __init__(self, name, rows, dimensions, start, stop):
+        self.segment = shared_memory.SharedMemory(name=name)
+        self.matrix, self.penalties, self.coords = _views(self.segment.buf, rows, dimensions)
+        self.start = start
+        self.stop = stop
+
+    def close(self):
+        self.matrix = self.penalties = self.coords = None
+        self.segment.close()
+
+    def search(self, query, ranges, wanted, near, excluded, probes, probe_rows):
+        """
+        Score this shard's part of the selected rows.
+
+        Args:
+            query (np.ndarray): Unit-normalized query embedding
+            ranges (list): (start, stop) global rows of the partitions searched
+            wanted (int): How many of the best to return, None for all
+            near (tuple): (lat, lon, radius_km) to keep only people within, or None
+            excluded (np.ndarray): Global rows to leave out
+            probes (np.ndarray): Scores to rank among the kept people
+            probe_rows (np.ndarray): Global row of each probe, to break ties
+
+        Returns:
+            tuple: (rows, scores) of the best kept people, best first; how
+                many people were kept; and per probe, how many kept people
+                rank above it (a higher score, or the same score on an
+                earlier row, as a stable sort would have it)
+        """
+        rows = []
+        scores = []
+        for start, stop in ranges:
+            start, stop = max(start, self.start), min(stop, self.stop)
+            if start >= stop:
+                continue
+            similarity = self.matrix[start:stop] @ query
+            similarity *= self.penalties[start:stop]
+            inside = excluded[(excluded >= start) & (excluded < stop)]
+            similarity[inside - start] = 0.0
+            keep = similarity > 0
+            if near is not None:
+                lat, lon, radius_km = near
+                keep &= distances_km(self.coords[start:stop], lat, lon) <= radius_km
+            kept = np.flatnonzero(keep)
+            rows.append(kept + start)
+            scores.append(similarity[kept])
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+        above = np.zeros(len(probes), dtype=np.int64)
+        if len(probes):
+            ranked = np.sort(scores)
+            above = len(ranked) - np.searchsorted(ranked, probes, side='right')
+            tied = np.searchsorted(ranked, probes, side='right') - np.searchsorted(ranked, probes, side='left')
+            for i in np.flatnonzero(tied):
+                above[i] += np.count_nonzero((scores == probes[i]) & (rows < probe_rows[i]))
+
+        if wanted is not None and wanted < len(scores):
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return rows[top], scores[top], len(scores), above
+
+def _shard_main(connection):
+    """A shard process: attach to index builds and answer searches until told to stop"""
+    shard = None
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        command, arguments = message
+        try:
+            if command == 'attach':
+                if shard is not None:
+                    shard.close()
+                shard = _Shard(*arguments)
+                connection.send(('ok', None))
+            elif command == 'search':
+                connection.send(('ok', shard.search(*arguments)))
+        except Exception as e:
+            connection.send(('error', repr(e)))
+    if shard is not None:
+        shard.close()
+
+class ShardPool:
+    """
+    Worker processes that each scan a slice of the similarity index.
+
+    A scan is one matrix-vector product plus a partial sort, and under the
+    GIL a gunicorn worker runs it on one core however many it has. With
+    VECTOR_SHARDS set, every index build is copied once into a shared
+    memory segment, the request thread's arrays become views onto it, and
+    each shard process maps the same segment and owns a contiguous slice
+    of its rows. A search sends the query to every shard at once; each
+    returns the best of its slice, and the request thread merges them.
+
+    The pool is per gunicorn worker, like the index. Shards are started
+    with spawn (never fork) since the parent runs threads and holds
+    MongoDB connections. Searches are answered only for the build the
+    shards hold; any other build (or a failed shard) scans in-process.
+    """
+    _connections = []
+    _processes = []
+    _segment = None
+    _generation = 0
+    # Replaced segments, closed once no request holds views onto them
+    _retired = []
+    _lock = threading.Lock()
+
+    @classmethod
+    def enabled(cls):
+        return VECTOR_SHARDS > 0
+
+    @classmethod
+    def _start(cls):
+        context = multiprocessing.get_context('spawn')
+        saved = {name: os.environ.get(name) for name in BLAS_THREAD_VARIABLES}
+        os.environ.update({name: '1' for name in BLAS_THREAD_VARIABLES})
+        try:
+            for number in range(VECTOR_SHARDS):
+                parent, child = context.Pipe()
+                process = context.Process(
+                    target=_shard_main, args=(child,), name=f'vector-shard-{number}', daemon=True
+                )
+                process.start()
+                child.close()
+                cls._connections.append(parent)
+                cls._processes.append(process)
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        logger.info("Vector shards started", shards=VECTOR_SHARDS)
+
+    @classmethod
+    def _stop(cls):
+        for connection in cls._connections:
+            try:
+                connection.send(None)
+                connection.close()
+            except OSError:
+                pass
+        for process in cls._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        cls._connections = []
+        cls._processes = []
+
+    @classmethod
+    def _retire_segment(cls):
+        if cls._segment is not None:
+            cls._segment.unlink()
+            cls._retired.append(cls._segment)
+            cls._segment = None
+        still_mapped = []
+        for segment in cls._retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_mapped.append(segment)
+        cls._retired = still_mapped
+
+    @classmethod
+    def _exchange(cls, message):
+        """Send a message to every shard, then collect every reply"""
+        for connection in cls._connections:
+            connection.send(message)
+        replies = [connection.recv() for connection in cls._connections]
+        errors = [reply for status, reply in replies if status == 'error']
+        if errors:
+            raise RuntimeError(f"Vector shard failed: {errors[0]}")
+        return [reply for _, reply in replies]
+
+    @classmethod
+    def publish(cls, partitions):
+        """
+        Move a new index build into shared memory and hand each shard its rows.
+
+        Each partition's matrix, penalties and coords are replaced by views
+        onto the segment, at the partition's offset, and the partition is
+        stamped with the generation the shards now hold.
+
+        Args:
+            partitions (list): The build's partitions, in offset order
+        """
+        for partition in partitions:
+            partition.shard_generation = None
+        rows = sum(len(partition) for partition in partitions)
+        with cls._lock:
+            if rows < SHARD_MIN_ROWS:
+                # Too small to be worth it; searches stay in-process
+                cls._retire_segment()
+                return
+            dimensions = partitions[0].matrix.shape[1]
+            try:
+                if not cls._processes:
+                    cls._start()
+                segment = shared_memory.SharedMemory(create=True, size=_layout(rows, dimensions)[3])
+            except OSError as e:
+                # Typically /dev/shm too small (Docker defaults to 64MB: raise --shm-size)
+                logger.warning("Could not share the vector index, searching in-process: %s", e)
+                return
+            matrix, penalties, coords = _views(segment.buf, rows, dimensions)
+            for partition in partitions:
+                start, stop = partition.offset, partition.offset + len(partition)
+                matrix[start:stop] = partition.matrix
+                penalties[start:stop] = partition.penalties
+                coords[start:stop] = partition.coords
+                partition.matrix = matrix[start:stop]
+                partition.penalties = penalties[start:stop]
+                partition.coords = coords[start:stop]
+
+            cls._retire_segment()
+            cls._segment = segment
+            cls._generation += 1
+            bounds = np.linspace(0, rows, len(cls._connections) + 1).astype(int)
+            try:
+                for number, connection in enumerate(cls._connections):
+                    connection.send(('attach', (segment.name, rows, dimensions, bounds[number], bounds[number + 1])))
+                for connection in cls._connections:
+                    status, reply = connection.recv()
+                    if status == 'error':
+                        raise RuntimeError(reply)
+            except (OSError, EOFError, RuntimeError) as e:
+                logger.error("Vector shards failed to attach, searching in-process: %s", e)
+                cls._stop()
+                return
+            for partition in partitions:
+                partition.shard_generation = cls._generation
+            SHARD_OPERATIONS.inc(operation='publish')
+            logger.info("Vector index shared", rows=rows, shards=len(cls._connections), generation=cls._generation)
+
+    @classmethod
+    def serves(cls, partitions):
+        """Whether a search over these partitions should go to the shards"""
+        return (
+            bool(partitions)
+            and partitions[0].shard_generation is not None
+            and partitions[0].shard_generation == cls._generation
+            and sum(len(partition) for partition in partitions) >= SHARD_MIN_ROWS
+        )
+
+    @classmethod
+    def search(cls, partitions, query, wanted=None, near=None, excluded=None, probes=None, probe_rows=None):
+        """
+        Scan partitions on the shards and merge their best rows.
+
+        Args:
+            partitions (list): Partitions of the published build to search
+            query (np.ndarray): Unit-normalized query embedding
+            wanted (int, optional): How many of the best to return, None for all
+            near (tuple, optional): (lat, lon, radius_km) to keep only people within
+            excluded (np.ndarray, optional): Global rows to leave out
+            probes (np.ndarray, optional): Scores to rank among everyone kept
+            probe_rows (np.ndarray, optional): Global row of each probe
+
+        Returns:
+            tuple: (global rows, scores) of the best kept people, best
+                first; how many people were kept; and per probe, how many
+                kept people rank above it. None when the shards no longer
+                hold this build or failed.
+        """
+        ranges = [(partition.offset, partition.offset + len(partition)) for partition in partitions]
+        excluded = np.asarray(excluded if excluded is not None else [], dtype=np.int64)
+        probes = np.asarray(probes if probes is not None else [], dtype=np.float32)
+        probe_rows = np.asarray(probe_rows if probe_rows is not None else [], dtype=np.int64)
+        with cls._lock:
+            if not cls._connections or partitions[0].shard_generation != cls._generation:
+                SHARD_OPERATIONS.inc(operation='stale')
+                return None
+            try:
+                replies = cls._exchange(('search', (query, ranges, wanted, near, excluded, probes, probe_rows)))
+            except (OSError, EOFError, RuntimeError) as e:
+                logger.error("Vector shard search failed, searching in-process until the next build: %s", e)
+                SHARD_OPERATIONS.inc(operation='failed')
+                cls._stop()
+                return None
+        SHARD_OPERATIONS.inc(operation='search')
+
+        rows = np.concatenate([reply[0] for reply in replies])
+        scores = np.concatenate([reply[1] for reply in replies])
+        if wanted is not None and wanted < len(scores):
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        kept = sum(reply[2] for reply in replies)
+        above = np.sum([reply[3] for reply in replies], axis=0) if len(probes) else np.zeros(0, dtype=np.int64)
+        return rows[top], scores[top], kept, above
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            cls._stop()
+            if cls._segment is not None:
+                cls._segment.unlink()
+                cls._segment = None
+
+atexit.register(ShardPool.shutdown)
+
+SHARD_OPERATIONS = Counter(
+    'boardy_vector_shard_operations_total',
+    'Vector shard pool publishes, searches, and searches handed back to the request thread',
+    ['operation']
+)
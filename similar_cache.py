@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from metrics import Counter
+
+# Responses kept per worker, and the longest one is served whatever its version
+SIMILAR_CACHE_SIZE = int(os.getenv('SIMILAR_CACHE_SIZE', 1024))
+SIMILAR_CACHE_TTL = float(os.getenv('SIMILAR_CACHE_TTL', 300))
+
+def similar_cache_key(query_text, **params):
+    """
+    Cache key of a /similar request: the query with case and whitespace
+    folded (the embedding model and BM25 are both uncased) and the parsed
+    parameters, so e.g. a region given by name or by code shares a key.
+
+    Args:
+        query_text (str): The query
+        **params: Everything else the response depends on
+
+    Returns:
+        tuple: The key
+    """
+    return (' '.join(query_text.split()).casefold(),) + tuple(sorted(params.items()))
+
+class _Flight:
+    """A computation in progress that identical requests wait for instead of repeating"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SimilarCache:
+    """
+    Per-worker LRU of /similar responses, with singleflight.
+
+    Each response is stored with the version it was computed at, the
+    persons generation and the vector index build, and is only served
+    while both are unchanged, so any create, update or delete (in any
+    worker) and any index rebuild retire it. Concurrent misses for the
+    same key and version share one computation: the first request runs
+    it and the rest wait for its result, or its exception.
+    """
+    _entries = OrderedDict()  # key -> (version, time.monotonic() stored, value)
+    _flights = {}  # (key, version) -> _Flight
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_or_compute(cls, key, version, compute):
+        """
+        The cached value for a key at a version, or the one compute() returns.
+
+        Args:
+            key (tuple): From similar_cache_key()
+            version (tuple): What the value depends on; None when it can't
+                be known, which bypasses the cache
+            compute (callable): Returns (value, cacheable); a value that
+                isn't cacheable (e.g. from a degraded search) still goes to
+                the requests waiting on it
+
+        Returns:
+            The value; callers must not modify it
+        """
+        if version is None:
+            SIMILAR_CACHE.inc(result='miss')
+            return compute()[0]
+
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] == version and time.monotonic() - entry[1] < SIMILAR_CACHE_TTL:
+                cls._entries.move_to_end(key)
+                SIMILAR_CACHE.inc(result='hit')
+                return entry[2]
+            flight = cls._flights.get((key, version))
+            leader = flight is None
+            if leader:
+                flight = cls._flights[(key, version)] = _Flight()
+
+        if not leader:
+            SIMILAR_CACHE.inc(result='coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        SIMILAR_CACHE.inc(result='miss')
+        cacheable = False
+        try:
+            flight.value, cacheable = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with cls._lock:
+                del cls._flights[(key, version)]
+                if flight.error is None and cacheable and SIMILAR_CACHE_SIZE > 0:
+                    cls._entries[key] = (version, time.monotonic(), flight.value)
+                    cls._entries.move_to_end(key)
+                    while len(cls._entries) > SIMILAR_CACHE_SIZE:
+                        cls._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+SIMILAR_CACHE = Counter(
+    'boardy_similar_cache_total',
+    'Similar-people result cache lookups by result (hit, miss, or coalesced into a running miss)',
+    ['result']
+)
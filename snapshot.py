@@ -0,0 +1,500 @@
+import fcntl
+import hashlib
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from logs import get_logger
+from metrics import Counter
+
+logger = get_logger('snapshot')
+
+# Where the snapshot lives; shared by every worker (and restart) on the host.
+# Empty keeps embeddings in MongoDB only
+SNAPSHOT_DIR = os.getenv(
+    'EMBEDDING_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+)
+
+# Fold the delta into a new snapshot once it holds this many records, or
+# this fraction of the snapshot's rows if that is more
+SNAPSHOT_COMPACT_RECORDS = int(os.getenv('SNAPSHOT_COMPACT_RECORDS', 1000))
+SNAPSHOT_COMPACT_FRACTION = float(os.getenv('SNAPSHOT_COMPACT_FRACTION', 0.05))
+
+SNAPSHOT_FILE = 'embeddings.snap'
+DELTA_FILE = 'embeddings.delta'
+LOCK_FILE = 'embeddings.lock'
+FORMAT_VERSION = 1
+PAGE_SIZE = 4096
+
+# Snapshot header: magic, format version, dimensions, rows, generation,
+# created (unix time), then byte offsets of the id table, tombstone bitmap
+# and (page-aligned) float32 matrix
+SNAPSHOT_HEADER = struct.Struct('<8sIIQQdQQQ')
+SNAPSHOT_MAGIC = b'BRDYSNAP'
+# Delta header: magic, format version, dimensions, and the snapshot
+# generation its records apply on top of
+DELTA_HEADER = struct.Struct('<8sIIQ')
+DELTA_MAGIC = b'BRDYDLTA'
+
+ID_DTYPE = np.dtype([('phone', 'S32'), ('region', 'S16'), ('stamp', 'S16')])
+PUT = 1
+DELETE = 2
+
+def embedding_stamp(profile_hash, embedding_version):
+    """Short digest of what an embedding was computed from, to tell a current snapshot row from a stale one"""
+    return hashlib.blake2b(f"{profile_hash}|{embedding_version}".encode('utf-8'), digest_size=8).hexdigest()
+
+def _delta_dtype(dimensions):
+    """One fixed-size delta record; crc covers every byte before it"""
+    return np.dtype([
+        ('op', 'u1'), ('phone', 'S32'), ('region', 'S16'), ('stamp', 'S16'),
+        ('vector', '<f4', (dimensions,)), ('crc', '<u4')
+    ])
+
+class SnapshotView:
+    """
+    One consistent reading of the snapshot and its delta.
+
+    matrix is the snapshot's unit-normalized embeddings, memory-mapped
+    read-only, so every process reading the same file shares one copy in
+    the page cache. Rows tombstoned since the file was written are left
+    out of rows_by_phone; their replacements, and everything else written
+    since, come from the delta and are held in memory.
+    """
+
+    def __init__(self, dimensions, generation, matrix, ids, live, delta):
+        self.dimensions = dimensions
+        self.generation = generation
+        self.matrix = matrix
+        self.ids = ids
+        self.dead = int(len(live) - live.sum())
+        live_rows = np.flatnonzero(live)
+        self.rows_by_phone = dict(zip(
+            (phone.decode('utf-8') for phone in ids['phone'][live_rows]), live_rows.tolist()
+        ))
+        # phone -> (stamp, region, vector), or None once deleted
+        self.delta = delta
+
+    def lookup(self, phone_number, stamp):
+        """
+        Where a person's embedding is, if the snapshot has the current one.
+
+        Args:
+            phone_number (str): The person
+            stamp (str): embedding_stamp of their profileHash and embeddingVersion
+
+        Returns:
+            int or np.ndarray: Their snapshot row, or their vector from the
+                delta; None when neither holds an embedding with this stamp
+        """
+        if phone_number in self.delta:
+            entry = self.delta[phone_number]
+            return entry[2] if entry is not None and entry[0] == stamp else None
+        row = self.rows_by_phone.get(phone_number)
+        if row is not None and self.ids['stamp'][row].decode('utf-8') == stamp:
+            return row
+        return None
+
+    def gather(self, sources):
+        """
+        The embedding matrix for lookup() results, in order.
+
+        Consecutive snapshot rows (a region's people right after a
+        compaction) are returned as a view onto the mapped file; anything
+        else is copied.
+        """
+        if not sources:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+        if all(isinstance(source, int) for source in sources):
+            rows = np.array(sources, dtype=np.int64)
+            if (np.diff(rows) == 1).all():
+                return self.matrix[rows[0]:rows[-1] + 1]
+        return np.vstack([
+            self.matrix[source] if isinstance(source, int) else source for source in sources
+        ]).astype(np.float32, copy=False)
+
+class EmbeddingSnapshot:
+    """
+    Unit-normalized embeddings on local disk, shared by every worker on the host.
+
+    A snapshot file holds a header, an id table (phone, region, and a
+    stamp of the profileHash and embeddingVersion each embedding was
+    computed from), a tombstone bitmap and a float32 matrix, with rows
+    sorted by region. Workers memory-map it read-only, so they build the
+    similarity index without reading vectors from MongoDB and the page
+    cache holds one copy for all of them.
+
+    New embeddings are appended to a delta file of fixed-size,
+    checksummed records; the snapshot row each one replaces is tombstoned
+    in place. Once the delta grows past SNAPSHOT_COMPACT_RECORDS (or
+    SNAPSHOT_COMPACT_FRACTION of the rows), it is folded into a new
+    snapshot, written to a temporary file and renamed over the old one,
+    and an empty delta for the new generation replaces the old delta.
+    Writers hold an exclusive flock on the lock file and readers a shared
+    one, so a reader always sees a snapshot with its matching delta.
+
+    MongoDB stays the source of truth: a row is used only when its stamp
+    matches the person's current profileHash and embeddingVersion, and
+    anything missing is read from MongoDB and appended.
+    """
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot')
+    # Phone -> row of the snapshot last appended against, by (generation, created)
+    _base_rows = (None, {})
+
+    @classmethod
+    def enabled(cls):
+        return bool(SNAPSHOT_DIR)
+
+    @classmethod
+    def _path(cls, name):
+        return os.path.join(SNAPSHOT_DIR, name)
+
+    @classmethod
+    @contextmanager
+    def _locked(cls, exclusive):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(cls._path(LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @classmethod
+    def _header(cls):
+        """The snapshot's header fields, or None when there is no snapshot"""
+        try:
+            with open(cls._path(SNAPSHOT_FILE), 'rb') as f:
+                fields = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+        except FileNotFoundError:
+            return None
+        magic, version, dimensions, rows, generation, created, ids_at, tombstones_at, matrix_at = fields
+        if magic != SNAPSHOT_MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{cls._path(SNAPSHOT_FILE)} is not a format {FORMAT_VERSION} snapshot")
+        return {
+            'dimensions': dimensions, 'rows': rows, 'generation': generation, 'created': created,
+            'ids_at': ids_at, 'tombstones_at': tombstones_at, 'matrix_at': matrix_at
+        }
+
+    @classmethod
+    def _delta_records(cls, generation, dimensions):
+        """
+        The delta's intact records if it applies to this snapshot generation.
+
+        Returns:
+            tuple: (dimensions, records); records is None when there is no
+                delta for this generation (one left over from before the
+                last compaction is ignored)
+        """
+        path = cls._path(DELTA_FILE)
+        try:
+            with open(path, 'rb') as f:
+                magic, version, delta_dimensions, delta_generation = DELTA_HEADER.unpack(f.read(DELTA_HEADER.size))
+                data = f.read()
+        except (FileNotFoundError, struct.error):
+            return dimensions, None
+        if (magic != DELTA_MAGIC or version != FORMAT_VERSION or delta_generation != generation
+                or (dimensions is not None and delta_dimensions != dimensions)):
+            return dimensions, None
+        dtype = _delta_dtype(delta_dimensions)
+        count = len(data) // dtype.itemsize
+        # Stop at the first torn or corrupt record
+        for number in range(count):
+            record = data[number * dtype.itemsize:(number + 1) * dtype.itemsize]
+            if zlib.crc32(record[:-4]) != int.from_bytes(record[-4:], 'little'):
+                count = number
+                break
+        return delta_dimensions, np.frombuffer(data, dtype=dtype, count=count)
+
+    @classmethod
+    def _read(cls):
+        """A SnapshotView of the files as they are (the caller holds the lock)"""
+        header = cls._header()
+        generation = header['generation'] if header else 0
+        dimensions = header['dimensions'] if header else None
+        path = cls._path(SNAPSHOT_FILE)
+        if header and header['rows']:
+            rows = header['rows']
+            ids = np.fromfile(path, dtype=ID_DTYPE, count=rows, offset=header['ids_at'])
+            tombstones = np.fromfile(path, dtype=np.uint8, count=(rows + 7) // 8, offset=header['tombstones_at'])
+            live = ~np.unpackbits(tombstones, count=rows, bitorder='little').astype(bool)
+            matrix = np.memmap(path, dtype=np.float32, mode='r', offset=header['matrix_at'], shape=(rows, dimensions))
+        else:
+            ids = np.empty(0, dtype=ID_DTYPE)
+            live = np.empty(0, dtype=bool)
+            matrix = None
+
+        dimensions, records = cls._delta_records(generation, dimensions)
+        if matrix is None:
+            # Without a base file the delta decides the width
+            matrix = np.empty((0, dimensions or 0), dtype=np.float32)
+        delta = {}
+        for record in records if records is not None else ():
+            phone = record['phone'].decode('utf-8')
+            if record['op'] == DELETE:
+                delta[phone] = None
+            else:
+                delta[phone] = (record['stamp'].decode('utf-8'), record['region'].decode('utf-8'), np.array(record['vector']))
+        return SnapshotView(dimensions, generation, matrix, ids, live, delta)
+
+    @classmethod
+    def open(cls):
+        """
+        Read the current snapshot and delta.
+
+        Returns:
+            SnapshotView: The embeddings on disk, or None when the snapshot
+                is disabled or can't be read
+        """
+        if not cls.enabled():
+            return None
+        started = time.perf_counter()
+        try:
+            with cls._locked(exclusive=False):
+                view = cls._read()
+        except (OSError, ValueError) as e:
+            logger.warning("Embedding snapshot unreadable, loading embeddings from MongoDB: %s", e)
+            return None
+        SNAPSHOT_OPERATIONS.inc(operation='open')
+        logger.info(
+            "Embedding snapshot opened",
+            generation=view.generation,
+            rows=len(view.rows_by_phone),
+            delta=len(view.delta),
+            seconds=round(time.perf_counter() - started, 3)
+        )
+        return view
+
+    @classmethod
+    def append(cls, entries):
+        """
+        Record new embeddings (or deletions) in the delta.
+
+        Args:
+            entries (list): (phone_number, region, stamp, embedding) tuples;
+                an embedding of None deletes the person's row
+        """
+        if not cls.enabled() or not entries:
+            return
+        try:
+            with cls._locked(exclusive=True):
+                records = cls._append(entries)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not append to the embedding snapshot: %s", e)
+            return
+        SNAPSHOT_OPERATIONS.inc(len(entries), operation='append')
+        header = cls._header() or {'rows': 0}
+        if records >= max(SNAPSHOT_COMPACT_RECORDS, SNAPSHOT_COMPACT_FRACTION * header['rows']):
+            cls._executor.submit(cls._compact_logged)
+
+    @classmethod
+    def _append(cls, entries):
+        """Write records and tombstones (the caller holds the exclusive lock); returns the delta's record count"""
+        header = cls._header()
+        generation = header['generation'] if header else 0
+        dimensions = next((len(vector) for _, _, _, vector in entries if vector is not None), None)
+        snapshot_dimensions, records = cls._delta_records(generation, header['dimensions'] if header else None)
+        if dimensions is None:
+            dimensions = snapshot_dimensions
+        if dimensions is None:
+            return 0
+        if snapshot_dimensions is not None and snapshot_dimensions != dimensions:
+            # A different model: start over, everyone is re-read from MongoDB
+            logger.warning("Embedding dimensions changed, discarding the snapshot", old=snapshot_dimensions, new=dimensions)
+            cls._remove()
+            header, generation, records = None, 0, None
+        if records is None:
+            with open(cls._path(DELTA_FILE), 'wb') as f:
+                f.write(DELTA_HEADER.pack(DELTA_MAGIC, FORMAT_VERSION, dimensions, generation))
+            records = ()
+
+        dtype = _delta_dtype(dimensions)
+        batch = np.zeros(len(entries), dtype=dtype)
+        for number, (phone_number, region, stamp, vector) in enumerate(entries):
+            batch[number]['phone'] = phone_number.encode('utf-8')
+            batch[number]['region'] = (region or '').encode('utf-8')
+            batch[number]['stamp'] = (stamp or '').encode('utf-8')
+            if vector is None:
+                batch[number]['op'] = DELETE
+            else:
+                vector = np.asarray(vector, dtype=np.float32)
+                batch[number]['op'] = PUT
+                batch[number]['vector'] = vector / (np.linalg.norm(vector) or 1.0)
+        raw = bytearray(batch.tobytes())
+        for number in range(len(batch)):
+            end = (number + 1) * dtype.itemsize
+            raw[end - 4:end] = zlib.crc32(raw[end - dtype.itemsize:end - 4]).to_bytes(4, 'little')
+        descriptor = os.open(cls._path(DELTA_FILE), os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(descriptor, bytes(raw))
+        finally:
+            os.close(descriptor)
+
+        if header and header['rows']:
+            cls._tombstone(header, [phone_number for phone_number, _, _, _ in entries])
+        return len(records) + len(entries)
+
+    @classmethod
+    def _tombstone(cls, header, phone_numbers):
+        """Mark the snapshot rows of these people dead, in place"""
+        key = (header['generation'], header['created'])
+        if cls._base_rows[0] != key:
+            ids = np.fromfile(cls._path(SNAPSHOT_FILE), dtype=ID_DTYPE, count=header['rows'], offset=header['ids_at'])
+            cls._base_rows = (key, {phone.decode('utf-8'): row for row, phone in enumerate(ids['phone'])})
+        rows = [cls._base_rows[1][phone] for phone in phone_numbers if phone in cls._base_rows[1]]
+        if not rows:
+            return
+        descriptor = os.open(cls._path(SNAPSHOT_FILE), os.O_RDWR)
+        try:
+            for byte in sorted({row // 8 for row in rows}):
+                mask = sum(1 << (row % 8) for row in rows if row // 8 == byte)
+                position = header['tombstones_at'] + byte
+                current = os.pread(descriptor, 1, position)[0]
+                os.pwrite(descriptor, bytes([current | mask]), position)
+        finally:
+            os.close(descriptor)
+
+    @classmethod
+    def _compact_logged(cls):
+        try:
+            cls.compact()
+        except Exception as e:
+            logger.exception("Embedding snapshot compaction failed: %s", e)
+
+    @classmethod
+    def compact(cls):
+        """Fold the delta into a new snapshot, dropping dead rows, and start an empty delta"""
+        started = time.perf_counter()
+        with cls._locked(exclusive=True):
+            view = cls._read()
+            if not view.delta and not view.dead:
+                return
+            base_rows = np.array(sorted(
+                row for phone, row in view.rows_by_phone.items() if phone not in view.delta
+            ), dtype=np.int64)
+            puts = [(phone, entry) for phone, entry in view.delta.items() if entry is not None]
+            added = np.zeros(len(puts), dtype=ID_DTYPE)
+            for number, (phone, (stamp, region, _)) in enumerate(puts):
+                added[number] = (phone.encode('utf-8'), region.encode('utf-8'), stamp.encode('utf-8'))
+            added_matrix = np.vstack([entry[2] for _, entry in puts]) if puts else None
+
+            ids = np.concatenate([view.ids[base_rows], added])
+            # Region-major order keeps each region's partition one slice of the file
+            order = np.lexsort((ids['phone'], ids['region']))
+
+            def rows(chunk):
+                from_base = chunk < len(base_rows)
+                block = np.empty((len(chunk), view.dimensions), dtype=np.float32)
+                block[from_base] = view.matrix[base_rows[chunk[from_base]]]
+                block[~from_base] = added_matrix[chunk[~from_base] - len(base_rows)] if added_matrix is not None else 0
+                return block
+
+            cls._write(ids[order], view.dimensions, view.generation + 1,
+                       (rows(order[start:start + 65536]) for start in range(0, len(order), 65536)))
+        SNAPSHOT_OPERATIONS.inc(operation='compact')
+        logger.info(
+            "Embedding snapshot compacted",
+            generation=view.generation + 1,
+            rows=len(ids),
+            folded=len(view.delta),
+            dropped=view.dead,
+            seconds=round(time.perf_counter() - started, 3)
+        )
+
+    @classmethod
+    def replace(cls, phone_numbers, regions, stamps, matrix):
+        """
+        Write a whole new snapshot (see jobs.snapshot_embeddings).
+
+        Args:
+            phone_numbers, regions, stamps (list): One per row
+            matrix (np.ndarray): Their embeddings, one per row
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        ids = np.zeros(len(phone_numbers), dtype=ID_DTYPE)
+        ids['phone'] = [phone.encode('utf-8') for phone in phone_numbers]
+        ids['region'] = [(region or '').encode('utf-8') for region in regions]
+        ids['stamp'] = [stamp.encode('utf-8') for stamp in stamps]
+        order = np.lexsort((ids['phone'], ids['region']))
+        with cls._locked(exclusive=True):
+            header = cls._header()
+            generation = header['generation'] + 1 if header else 1
+            cls._write(ids[order], matrix.shape[1], generation,
+                       (matrix[order[start:start + 65536]] for start in range(0, len(order), 65536)))
+        SNAPSHOT_OPERATIONS.inc(operation='replace')
+
+    @classmethod
+    def _write(cls, ids, dimensions, generation, blocks):
+        """Write a snapshot and its empty delta atomically (the caller holds the exclusive lock)"""
+        rows = len(ids)
+        ids_at = SNAPSHOT_HEADER.size
+        tombstones_at = ids_at + rows * ID_DTYPE.itemsize
+        matrix_at = -(-(tombstones_at + (rows + 7) // 8) // PAGE_SIZE) * PAGE_SIZE
+        temporary = cls._path(SNAPSHOT_FILE + '.tmp')
+        with open(temporary, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, FORMAT_VERSION, dimensions, rows, generation, time.time(),
+                ids_at, tombstones_at, matrix_at
+            ))
+            f.write(ids.tobytes())
+            f.write(bytes(matrix_at - tombstones_at))
+            for block in blocks:
+                f.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, cls._path(SNAPSHOT_FILE))
+        temporary = cls._path(DELTA_FILE + '.tmp')
+        with open(temporary, 'wb') as f:
+            f.write(DELTA_HEADER.pack(DELTA_MAGIC, FORMAT_VERSION, dimensions, generation))
+        os.replace(temporary, cls._path(DELTA_FILE))
+
+    @classmethod
+    def _remove(cls):
+        for name in (SNAPSHOT_FILE, DELTA_FILE):
+            try:
+                os.remove(cls._path(name))
+            except FileNotFoundError:
+                pass
+        cls._base_rows = (None, {})
+
+    @classmethod
+    def clear(cls):
+        """Delete the snapshot and delta, e.g. after every person was deleted"""
+        if not cls.enabled():
+            return
+        try:
+            with cls._locked(exclusive=True):
+                cls._remove()
+        except OSError as e:
+            logger.warning("Could not clear the embedding snapshot: %s", e)
+
+    @classmethod
+    def stats(cls):
+        """Generation, rows, dead rows, people in the delta and file sizes"""
+        with cls._locked(exclusive=False):
+            view = cls._read()
+            sizes = {
+                name: os.path.getsize(cls._path(name)) if os.path.exists(cls._path(name)) else 0
+                for name in (SNAPSHOT_FILE, DELTA_FILE)
+            }
+        return {
+            'directory': SNAPSHOT_DIR,
+            'generation': view.generation,
+            'dimensions': view.dimensions,
+            'rows': len(view.ids),
+            'dead_rows': view.dead,
+            'delta_people': len(view.delta),
+            'snapshot_bytes': sizes[SNAPSHOT_FILE],
+            'delta_bytes': sizes[DELTA_FILE]
+        }
+
+SNAPSHOT_OPERATIONS = Counter(
+    'boardy_embedding_snapshot_operations_total',
+    'Embedding snapshot opens, appended records, compactions and replacements',
+    ['operation']
+)
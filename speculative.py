@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logs import get_logger
+import numpy as np
+from embeddings import EmbeddingGenerator
+from search import search_similar
+from inference import InferenceOverloaded
+
+logger = get_logger('speculative')
+
+class SpeculativeSearch:
+    """
+    Runs similarity searches in the background while a call is still in progress.
+
+    Every caller utterance is added to a running profile summary for the call.
+    Once the summary holds enough words a search is started off the request
+    thread, and it is re-run whenever the summary grows noticeably. When the
+    model finally calls getSimilarPeople, the cached result is reused if the
+    tool query embeds close enough to the summary that was searched.
+    """
+    # Don't speculate until the caller has said enough to describe themselves
+    MIN_WORDS = int(os.getenv('SPECULATIVE_MIN_WORDS', 20))
+    # Re-run the search once the summary has grown by this many words
+    REFRESH_WORDS = int(os.getenv('SPECULATIVE_REFRESH_WORDS', 15))
+    # Maximum cosine distance between tool query and summary to reuse a result
+    MAX_DISTANCE = float(os.getenv('SPECULATIVE_MAX_DISTANCE', 0.35))
+    # Drop state for calls that never sent a completed event
+    STATE_TTL = 3600
+
+    _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='speculative')
+    _calls = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def observe(cls, call_uuid, user_message, history=None, exclude_phone=None):
+        """
+        Add a caller utterance to the call's profile summary and start a
+        background search if the summary has grown enough.
+
+        Args:
+            call_uuid (str): The call the utterance belongs to
+            user_message (str): What the caller just said
+            history (list, optional): Conversation history used to seed the
+                summary when this worker hasn't seen the call before
+            exclude_phone (str, optional): The caller's own phone number, which
+                is excluded from the results
+        """
+        if not call_uuid or not user_message:
+            return
+
+        with cls._lock:
+            cls._prune()
+            state = cls._calls.get(call_uuid)
+            if state is None:
+                state = {
+                    'utterances': [
+                        msg['content'] for msg in (history or [])
+                        if msg.get('role') == 'user' and msg.get('content')
+                    ],
+                    'searched_words': 0,
+                    'pending': None,
+                    'result': None,
+                    'exclude_phone': exclude_phone
+                }
+                cls._calls[call_uuid] = state
+
+            state['utterances'].append(user_message)
+            state['touched'] = time.monotonic()
+
+            summary = cls._summary(state)
+            words = len(summary.split())
+            if words < cls.MIN_WORDS or state['pending'] is not None:
+                return
+            if state['result'] is not None and words - state['searched_words'] < cls.REFRESH_WORDS:
+                return
+
+            state['searched_words'] = words
+            state['pending'] = cls._executor.submit(cls._run, call_uuid, summary, state['exclude_phone'])
+
+    @classmethod
+    def lookup(cls, call_uuid, query, wait=0.0):
+        """
+        Return the cached search result for a call if it matches the query.
+
+        Args:
+            call_uuid (str): The call the tool call belongs to
+            query (str): The getSimilarPeople query produced by the model
+            wait (float): Seconds to wait for an in-flight search to finish
+
+        Returns:
+            dict or None: A /similar response body, or None on a cache miss
+        """
+        with cls._lock:
+            state = cls._calls.get(call_uuid)
+            pending = state['pending'] if state else None
+
+        if state is None:
+            return None
+
+        if pending is not None and wait > 0:
+            try:
+                pending.result(timeout=wait)
+            except Exception:
+                pass
+
+        with cls._lock:
+            cached = state['result']
+        if cached is None:
+            return None
+
+        summary_embedding, response = cached
+        try:
+            query_embedding = EmbeddingGenerator.get_instance().generate_embedding(query)
+        except InferenceOverloaded:
+            # No slot to compare the query with; let /similar handle it (or shed it)
+            return None
+        if not query_embedding:
+            return None
+
+        distance = 1.0 - float(
+            np.dot(query_embedding, summary_embedding)
+            / (np.linalg.norm(query_embedding) * np.linalg.norm(summary_embedding))
+        )
+        if distance > cls.MAX_DISTANCE:
+            logger.info("Cache miss: distance %.3f > %s", distance, cls.MAX_DISTANCE, call_uuid=call_uuid)
+            return None
+
+        logger.info("Cache hit: distance %.3f", distance, call_uuid=call_uuid)
+        return response
+
+    @classmethod
+    def discard(cls, call_uuid):
+        """Forget everything about a call once it has completed"""
+        with cls._lock:
+            cls._calls.pop(call_uuid, None)
+
+    @classmethod
+    def _run(cls, call_uuid, summary, exclude_phone):
+        """Embed the summary and run a search, caching the result on the call"""
+        try:
+            started = time.perf_counter()
+            # Speculation is optional work: only use a slot that is free right now
+            embedding = EmbeddingGenerator.get_instance().generate_embedding(summary, wait=0)
+            response = search_similar(embedding, exclude_phone, query_text=summary) if embedding else None
+            logger.info("Searched in %.0fms", (time.perf_counter() - started) * 1000, call_uuid=call_uuid)
+        except Exception as e:
+            logger.warning("Search failed: %s", e, call_uuid=call_uuid)
+            embedding, response = None, None
+
+        with cls._lock:
+            state = cls._calls.get(call_uuid)
+            if state is None:
+                return
+            state['pending'] = None
+            if response is not None:
+                state['result'] = (embedding, response)
+
+    @staticmethod
+    def _summary(state):
+        """Running profile summary: everything the caller has said so far"""
+        return " ".join(state['utterances'])
+
+    @classmethod
+    def _prune(cls):
+        """Drop state for stale calls (caller must hold the lock)"""
+        cutoff = time.monotonic() - cls.STATE_TTL
+        for call_uuid in [k for k, v in cls._calls.items() if v.get('touched', 0) < cutoff]:
+            del cls._calls[call_uuid]
@@ -0,0 +1,63 @@
+import sys
+import time
+import numpy as np
+
+# Run from the project root: python testing_scripts/bench_dedup.py [persons]
+sys.path.insert(0, '.')
+from dedup import DUPLICATE_THRESHOLD, lsh_duplicate_pairs
+
+DIMENSIONS = 384
+TOPICS = 50
+DUPLICATE_FRACTION = 0.1
+
+def synthetic_embeddings(count, seed=7):
+    """
+    Unit embeddings clustered around topics (so unrelated profiles still
+    score 0.3-0.6, like MiniLM profiles do), with DUPLICATE_FRACTION of
+    them near-copies of another profile
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((TOPICS, DIMENSIONS))
+    matrix = topics[rng.integers(0, TOPICS, count)] + 0.9 * rng.standard_normal((count, DIMENSIONS))
+    copies = rng.choice(count, int(count * DUPLICATE_FRACTION), replace=False)
+    sources = rng.integers(0, count, len(copies))
+    noise = rng.uniform(0.05, 0.2, (len(copies), 1))
+    matrix[copies] = matrix[sources] + noise * np.linalg.norm(matrix[sources], axis=1, keepdims=True) \
+        * rng.standard_normal((len(copies), DIMENSIONS)) / np.sqrt(DIMENSIONS)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(np.float32)
+
+def exact_duplicate_pairs(matrix, threshold, block=2048):
+    """Every pair above the threshold by blocked all-pairs comparison"""
+    pairs = []
+    for start in range(0, len(matrix), block):
+        scores = matrix[start:start + block] @ matrix.T
+        rows, columns = np.nonzero(scores >= threshold)
+        rows += start
+        upper = rows < columns
+        pairs.append(np.stack([rows[upper], columns[upper]], axis=1))
+    return np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    matrix = synthetic_embeddings(count)
+
+    started = time.perf_counter()
+    exact = exact_duplicate_pairs(matrix, DUPLICATE_THRESHOLD)
+    exact_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    found, candidates = lsh_duplicate_pairs(matrix, DUPLICATE_THRESHOLD)
+    lsh_seconds = time.perf_counter() - started
+
+    exact_set = set(map(tuple, exact.tolist()))
+    found_set = set(map(tuple, found.tolist()))
+    recall = len(exact_set & found_set) / len(exact_set) if exact_set else 1.0
+    all_pairs = count * (count - 1) // 2
+
+    print(f"{count} persons, {len(exact_set)} duplicate pairs at cosine >= {DUPLICATE_THRESHOLD}")
+    print(f"Exact pairwise: {exact_seconds:.2f}s ({count / exact_seconds:.0f} persons/sec), {all_pairs} pairs compared")
+    print(
+        f"LSH:            {lsh_seconds:.2f}s ({count / lsh_seconds:.0f} persons/sec), "
+        f"{candidates} candidate pairs verified ({candidates / all_pairs:.4%} of all pairs), recall {recall:.4f}"
+    )
@@ -0,0 +1,71 @@
+import io
+import json
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+import logs
+from logs import get_logger, lazy_json, flush_logs
+
+# Run from the project root: python -m testing_scripts.bench_logging
+ITERATIONS = 5000
+
+# Roughly what Vonage posts to the input webhook
+INPUT_DATA = {
+    'uuid': 'aaaaaaaa-bbbb-cccc-dddd-0123456789ab',
+    'conversation_uuid': 'CON-aaaaaaaa-bbbb-cccc-dddd-0123456789ab',
+    'from': '14155552671',
+    'to': '14155550000',
+    'timestamp': '2026-01-01T00:00:00.000Z',
+    'speech': {
+        'timeout_reason': 'end_on_silence_timeout',
+        'results': [
+            {'confidence': '0.93', 'text': "I'm a backend engineer in Toronto, I love climbing and distributed systems"},
+            {'confidence': '0.81', 'text': "I'm a backend engineer in Toronto I love climbing and distributed system"}
+        ]
+    }
+}
+NCCO = [
+    {'action': 'stream', 'streamUrl': ['https://example.com/api/vonage/audio/x.mp3'], 'bargeIn': True},
+    {'action': 'input', 'eventUrl': ['https://example.com/api/vonage/webhooks/input'], 'type': ['speech'],
+     'speech': {'uuid': [INPUT_DATA['uuid']], 'endOnSilence': 1, 'sensitivity': '30', 'language': 'en-US'}}
+]
+
+def old_style():
+    """What the input webhook used to print on every turn"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] Speech input received for call: {INPUT_DATA['uuid']}")
+    print(f"[{timestamp}] Input data: {json.dumps(INPUT_DATA, indent=2)}")
+    print(f"[{timestamp}] Speech text: {INPUT_DATA['speech']['results'][0]['text']}")
+    print(f"[{timestamp}] LLM response: Nice, tell me more about the climbing.")
+    print(f"[{timestamp}] Returning NCCO: {json.dumps(NCCO, indent=2)}")
+
+log = get_logger('bench')
+
+def new_style():
+    """The same turn through the structured logger, payloads at debug level"""
+    call_uuid = INPUT_DATA['uuid']
+    log.debug("Input data: %s", lazy_json(INPUT_DATA), call_uuid=call_uuid)
+    log.info("Speech text: %s", INPUT_DATA['speech']['results'][0]['text'], call_uuid=call_uuid)
+    log.info("LLM response: %s", "Nice, tell me more about the climbing.", call_uuid=call_uuid)
+    log.debug("Returning NCCO: %s", lazy_json(NCCO), call_uuid=call_uuid)
+
+def time_per_turn(fn):
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        fn()
+    return (time.perf_counter() - started) / ITERATIONS * 1e6
+
+if __name__ == "__main__":
+    # Old prints go to an in-memory buffer, so this understates their cost on a real pipe
+    with redirect_stdout(io.StringIO()):
+        old_us = time_per_turn(old_style)
+
+    # Only time the request thread; the writer thread drains to stdout separately
+    writer = logs._listener.handlers[0]
+    real_stream = writer.setStream(io.StringIO())
+    new_us = time_per_turn(new_style)
+    flush_logs()
+    writer.setStream(real_stream)
+
+    print(f"print + json.dumps(indent=2): {old_us:.1f}us per turn")
+    print(f"structured logger (INFO):     {new_us:.1f}us per turn on the request thread")
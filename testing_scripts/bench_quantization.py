@@ -0,0 +1,102 @@
+import argparse
+import statistics
+import sys
+import time
+import numpy as np
+
+# Run from the project root: python testing_scripts/bench_quantization.py [--synthetic 500000]
+# Without --synthetic the embeddings come from MongoDB, which is what the
+# settings should be chosen on.
+sys.path.insert(0, '.')
+from quantization import FIT_SAMPLE, FirstStageEncoder
+
+DIMENSIONS = 384
+TOPICS = 50
+
+def synthetic_embeddings(count, seed=7):
+    """
+    Unit embeddings around topics with most of their variance in a 64
+    dimensional subspace, roughly the shape of sentence-embedding data
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((TOPICS, DIMENSIONS))
+    basis = rng.standard_normal((64, DIMENSIONS)) * np.linspace(2.0, 0.2, 64)[:, None]
+    matrix = np.empty((count, DIMENSIONS), dtype=np.float32)
+    for start in range(0, count, 100000):
+        size = min(100000, count - start)
+        block = (topics[rng.integers(0, TOPICS, size)] + rng.standard_normal((size, 64)) @ basis
+                 + 0.3 * rng.standard_normal((size, DIMENSIONS)))
+        matrix[start:start + size] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return matrix
+
+def stored_embeddings():
+    """Every unit embedding in MongoDB"""
+    from database import MongoDB
+    vectors = []
+    for person in MongoDB().get_db('analytics').persons.find(
+        {'vectorEmbedding': {'$exists': True, '$ne': None}}, {'_id': 0, 'vectorEmbedding': 1}
+    ):
+        vector = np.asarray(person['vectorEmbedding'], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vectors.append(vector / norm)
+    return np.vstack(vectors)
+
+def top_k(scores, k):
+    """Rows of the k best scores, best first"""
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def timed(search, queries):
+    """Median latency in ms and each query's result"""
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall and latency of first-pass encodings against exact cosine")
+    parser.add_argument('--synthetic', type=int, help="use this many synthetic embeddings instead of MongoDB's")
+    parser.add_argument('--queries', type=int, default=200, help="embeddings held out as queries")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dimensions', type=int, nargs='+', default=[64, 96, 128])
+    parser.add_argument('--rescore', type=int, nargs='+', default=[0, 100, 200, 1000],
+                        help="candidates rescored in float32 (0: rank by the first pass alone)")
+    args = parser.parse_args()
+
+    matrix = synthetic_embeddings(args.synthetic) if args.synthetic else stored_embeddings()
+    rng = np.random.default_rng(3)
+    held_out = rng.choice(len(matrix), min(args.queries, len(matrix) // 10), replace=False)
+    queries = matrix[held_out]
+    corpus = np.delete(matrix, held_out, axis=0)
+    del matrix
+    k = min(args.k, len(corpus))
+    print(f"{len(corpus)} embeddings x {corpus.shape[1]} dimensions, {len(queries)} held-out queries, recall@{k}")
+
+    exact_latency, expected = timed(lambda query: top_k(corpus @ query, k), queries)
+    print(f"{'encoding':<18}{'bytes/person':>13}{'MB':>9}{'rescored':>10}{'recall':>8}{'ms':>8}")
+    print(f"{'float32 (exact)':<18}{corpus.shape[1] * 4:>13}{corpus.nbytes / 2**20:>9.0f}{'-':>10}{1:>8.3f}{exact_latency:>8.1f}")
+
+    settings = [('', None, 'int8')]
+    for dimensions in args.dimensions:
+        for reduction in ('pca', 'projection'):
+            settings += [(reduction, dimensions, ''), (reduction, dimensions, 'int8')]
+    sample = corpus[np.sort(rng.choice(len(corpus), min(FIT_SAMPLE, len(corpus)), replace=False))]
+    for reduction, dimensions, quantization in settings:
+        encoder = FirstStageEncoder.fit(sample, reduction, dimensions or corpus.shape[1], quantization)
+        codes = encoder.encode(corpus)
+        for depth in args.rescore:
+            if depth:
+                search = lambda query: top_k(encoder.rescored(codes, corpus, query, max(depth, k))[0], k)
+            else:
+                search = lambda query: top_k(encoder.score(codes, query), k)
+            latency, found = timed(search, queries)
+            recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, expected)])
+            print(
+                f"{encoder.describe():<18}{codes.shape[1] * codes.itemsize:>13}{codes.nbytes / 2**20:>9.0f}"
+                f"{depth or '-':>10}{recall:>8.3f}{latency:>8.1f}"
+            )
+        del codes
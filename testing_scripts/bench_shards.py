@@ -0,0 +1,102 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+# Run from the project root: python testing_scripts/bench_shards.py [--sizes 100000 1000000 5000000]
+sys.path.insert(0, '.')
+import shards
+from lexical import LexicalIndex, document_frequencies
+from shards import ShardPool
+from vector_index import VectorIndex, _Partition
+
+DIMENSIONS = 384
+REGIONS = 4
+VOCABULARY = [f'topic{number}' for number in range(2000)]
+
+def synthetic_partitions(count, hybrid, seed=11):
+    """REGIONS partitions of random unit embeddings, with three interests each when hybrid"""
+    rng = np.random.default_rng(seed)
+    partitions = {}
+    offset = 0
+    for region, size in enumerate(np.diff(np.linspace(0, count, REGIONS + 1).astype(int))):
+        matrix = np.empty((size, DIMENSIONS), dtype=np.float32)
+        for start in range(0, size, 100000):
+            block = rng.standard_normal((min(100000, size - start), DIMENSIONS)).astype(np.float32)
+            matrix[start:start + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+        people = [
+            {'phoneNumber': f'+1{region}{row:09d}', 'name': str(row), 'interests': [], 'skills': [], 'bio': '', 'location': ''}
+            for row in range(size)
+        ]
+        terms = [
+            {word: 1 for word in rng.choice(VOCABULARY, 3)} if hybrid else {} for _ in range(size)
+        ]
+        partition = _Partition(people, matrix, np.ones(size), np.full((size, 2), np.nan), terms, [p['phoneNumber'] for p in people])
+        partition.offset = offset
+        offset += size
+        partitions[f'R{region}'] = partition
+    all_terms = [terms for partition in partitions.values() for terms in partition.terms]
+    frequencies, average_length = document_frequencies(all_terms)
+    for partition in partitions.values():
+        partition.lexical = LexicalIndex(partition.terms, frequencies, len(all_terms), average_length or 1)
+        partition.terms = None
+    return partitions
+
+def run_queries(queries, texts):
+    """Median latency in ms and the top-5 phone numbers per query"""
+    latencies = []
+    tops = []
+    for query, text in zip(queries, texts):
+        started = time.perf_counter()
+        results, _ = VectorIndex.search(query, query_text=text, limit=5)
+        latencies.append((time.perf_counter() - started) * 1000)
+        tops.append([result['phoneNumber'] for result in results])
+    return statistics.median(latencies), tops
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search latency by shard count")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 5000000])
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--hybrid', action='store_true', help="query with text too (BM25 fused)")
+    args = parser.parse_args()
+
+    shards.SHARD_MIN_ROWS = 0
+    VectorIndex.TTL = float('inf')
+    counts = [1]
+    while counts[-1] * 2 <= args.max_shards:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.max_shards:
+        counts.append(args.max_shards)
+
+    rng = np.random.default_rng(5)
+    for size in args.sizes:
+        partitions = synthetic_partitions(size, args.hybrid)
+        VectorIndex._partitions = partitions
+        VectorIndex._stale = False
+        VectorIndex._built_at = time.monotonic()
+        queries = rng.standard_normal((args.queries, DIMENSIONS)).astype(np.float32)
+        texts = [' '.join(rng.choice(VOCABULARY, 2)) if args.hybrid else None for _ in range(args.queries)]
+
+        baseline, expected = run_queries(queries, texts)
+        print(f"{size} persons, {'hybrid' if args.hybrid else 'vector'} search, median of {args.queries} queries")
+        print(f"  in-process: {baseline:8.1f}ms")
+        for count in counts:
+            with ShardPool._lock:
+                ShardPool._stop()
+            shards.VECTOR_SHARDS = count
+            ShardPool.publish(list(partitions.values()))
+            run_queries(queries[:2], texts[:2])  # warm up the shards
+            latency, tops = run_queries(queries, texts)
+            print(
+                f"  {count:2d} shards:  {latency:8.1f}ms  {baseline / latency:4.1f}x"
+                f"{'' if tops == expected else '  RESULTS DIFFER'}"
+            )
+        with ShardPool._lock:
+            ShardPool._stop()
+        for partition in partitions.values():
+            partition.shard_generation = None
+        del partitions
+        VectorIndex._partitions = None
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import time
+import requests
+
+# Run from the project root with the usual .env: python testing_scripts/bench_startup.py [runs]
+PORT = int(os.getenv('BENCH_PORT', 5055))
+TIMEOUT = 300
+
+def wait_for(url, started):
+    """Poll a URL until it returns 200, returning seconds since start"""
+    while time.perf_counter() - started < TIMEOUT:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready after {TIMEOUT}s")
+
+def run_once():
+    """Start a gunicorn worker and time how long until it serves /health and /ready"""
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{PORT}', 'app:app', '--workers', '1', '--threads', '2'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        health = wait_for(f'http://127.0.0.1:{PORT}/health', started)
+        ready = wait_for(f'http://127.0.0.1:{PORT}/ready', started)
+        phases = requests.get(f'http://127.0.0.1:{PORT}/ready', timeout=1).json()['startup_seconds']
+    finally:
+        server.terminate()
+        server.wait()
+    return health, ready, phases
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for run in range(1, runs + 1):
+        health, ready, phases = run_once()
+        print(f"Run {run}: serving /health after {health:.2f}s, /ready after {ready:.2f}s, phases {phases}")
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fault injection settings for the fake providers, changed by each scenario
+FAULTS = {
+    'groq': {'delays': [], 'errors': 0},
+    'elevenlabs': {'delays': [], 'errors': 0}
+}
+FAULTS_LOCK = threading.Lock()
+
+def next_fault(provider):
+    """Pop the next injected delay/error for a provider"""
+    with FAULTS_LOCK:
+        faults = FAULTS[provider]
+        delay = faults['delays'].pop(0) if faults['delays'] else 0
+        error = faults['errors'] > 0
+        if error:
+            faults['errors'] -= 1
+    return delay, error
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Fake Groq (OpenAI-compatible) and ElevenLabs endpoints"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        provider = 'groq' if self.path.startswith('/openai/') else 'elevenlabs'
+        delay, error = next_fault(provider)
+        time.sleep(delay)
+
+        if error:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        if provider == 'groq':
+            request = json.loads(body)
+            payload = json.dumps({
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request['model'],
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': 'Umm... nice to meet you!'},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+            }).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            payload = b'ID3fake-mp3-bytes'
+            content_type = 'audio/mpeg'
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except BrokenPipeError:
+            # The client gave up on this attempt (deadline or hedge won)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_server():
+    """Start the fake providers on a free local port and point the clients at it"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    os.environ['GROQ_BASE_URL'] = f"http://127.0.0.1:{port}"
+    os.environ['ELEVEN_LABS_BASE_URL'] = f"http://127.0.0.1:{port}/v1"
+    os.environ.setdefault('GROQ_API_KEY', 'fake-key')
+    os.environ.setdefault('ELEVEN_LABS_API_KEY', 'fake-key')
+    return server
+
+def run_scenario(name, llm, voice, deadline_seconds=None):
+    """Run one turn (LLM + TTS) through the resilience layer and report what happened"""
+    from resilience import Resilience, Deadline
+
+    deadline = Deadline(deadline_seconds or Resilience.TURN_BUDGET)
+    started = time.perf_counter()
+    reply = "".join(llm.generate_response([{"role": "user", "content": "hey"}], deadline=deadline))
+    try:
+        Resilience.call('elevenlabs', lambda timeout: voice.generate_speech(reply, timeout=timeout), deadline)
+        audio = 'elevenlabs'
+    except Exception as e:
+        audio = f"fallback ({type(e).__name__})"
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{name}: reply={reply!r} audio={audio} elapsed={elapsed:.0f}ms")
+
+def main():
+    start_fake_server()
+
+    # Import after the fake server URLs are in the environment
+    from llm import LLMGeneration
+    from voice import Voice
+    from resilience import Resilience, Deadline, DeadlineExceeded
+
+    llm = LLMGeneration()
+    voice = Voice()
+
+    print("=== Resilience Test Script ===\n")
+
+    run_scenario("healthy", llm, voice)
+
+    # First Groq attempt is slower than the hedge delay, so the duplicate wins
+    FAULTS['groq']['delays'] = [3.0]
+    run_scenario("slow groq (hedged)", llm, voice)
+
+    # A single error is retried by the hedge
+    FAULTS['elevenlabs']['errors'] = 1
+    run_scenario("one elevenlabs error (retried)", llm, voice)
+
+    # Slower than the whole budget, which is too short to hedge
+    FAULTS['groq']['delays'] = [5.0]
+    run_scenario("groq slower than budget", llm, voice, deadline_seconds=2)
+
+    # Keep failing until the breaker opens, then calls fail fast
+    FAULTS['elevenlabs']['errors'] = 100
+    for i in range(6):
+        run_scenario(f"elevenlabs down #{i + 1}", llm, voice)
+    FAULTS['elevenlabs']['errors'] = 0
+
+    # Once the cooldown is over, a call with no budget left must not use up
+    # the half-open trial, or the breaker would never close again
+    breaker = Resilience.provider('elevenlabs').breaker
+    assert breaker.state == 'open', breaker.state
+    breaker._opened_at -= breaker.COOLDOWN
+    try:
+        Resilience.call('elevenlabs', lambda timeout: voice.generate_speech("hi", timeout=timeout), Deadline(0))
+        raise AssertionError("a call with an exhausted deadline went through")
+    except DeadlineExceeded:
+        pass
+    assert breaker.state == 'open', breaker.state
+    run_scenario("elevenlabs recovered after cooldown", llm, voice)
+    assert breaker.state == 'closed', breaker.state
+
+    print("\n=== Provider Stats ===")
+    print(json.dumps(Resilience.stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
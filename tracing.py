@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from database import MongoDB
+from logs import get_logger
+from metrics import TURN_STAGE_SECONDS
+
+logger = get_logger('tracing')
+
+class Tracer:
+    """
+    Records timed spans for each stage of a voice turn, joined by call_uuid.
+
+    Handlers bind the call they are serving to the current thread, so code
+    further down (LLM, search, TTS) can open spans without being handed the
+    call_uuid. Every span also feeds the boardy_turn_stage_seconds
+    histogram. A background writer appends spans to the call's document in
+    the traces collection every TRACE_FLUSH_INTERVAL seconds, so a call's
+    waterfall includes the turns every worker served; documents expire
+    TRACE_TTL seconds after their last span.
+    """
+    MAX_SPANS_PER_CALL = 1000
+    # Spans waiting for the writer beyond this are dropped
+    MAX_PENDING = 10000
+    FLUSH_INTERVAL = float(os.getenv('TRACE_FLUSH_INTERVAL', 1))
+
+    _pending = OrderedDict()  # call_uuid -> spans not written yet
+    _pending_count = 0
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _writer = None
+    _local = threading.local()
+
+    @classmethod
+    def bind(cls, call_uuid):
+        """Associate the current thread's work with a call"""
+        cls._local.call_uuid = call_uuid
+
+    @classmethod
+    def current_call(cls):
+        return getattr(cls._local, 'call_uuid', None)
+
+    @classmethod
+    @contextmanager
+    def span(cls, stage, call_uuid=None, **attributes):
+        """
+        Time a stage of a turn.
+
+        Args:
+            stage (str): Stage name, e.g. 'llm' or 'tts'
+            call_uuid (str, optional): Call the span belongs to, defaults to
+                the call bound to the current thread
+            **attributes: Extra details stored on the span
+        """
+        call_uuid = call_uuid or cls.current_call()
+        started_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            TURN_STAGE_SECONDS.observe(duration, stage=stage)
+            if call_uuid:
+                cls.record(call_uuid, stage, started_at, duration, error=error, **attributes)
+
+    @classmethod
+    def record(cls, call_uuid, stage, started_at, duration, **attributes):
+        """Store a finished span for a call"""
+        span = {
+            'stage': stage,
+            'start': started_at,
+            'duration_ms': round(duration * 1000, 2),
+            'thread': threading.current_thread().name
+        }
+        span.update({key: value for key, value in attributes.items() if value is not None})
+
+        with cls._lock:
+            if cls._pending_count >= cls.MAX_PENDING:
+                return
+            cls._pending.setdefault(call_uuid, []).append(span)
+            cls._pending_count += 1
+            if cls._writer is None:
+                cls._writer = threading.Thread(target=cls._run_writer, name='trace-writer', daemon=True)
+                cls._writer.start()
+
+    @classmethod
+    def flush(cls):
+        """Write this worker's pending spans to MongoDB; spans that fail to write are dropped"""
+        with cls._flush_lock:
+            with cls._lock:
+                pending = cls._pending
+                cls._pending = OrderedDict()
+                cls._pending_count = 0
+            if not pending:
+                return
+            now = datetime.now(timezone.utc)
+            try:
+                MongoDB().get_db('conversations').traces.bulk_write([
+                    UpdateOne(
+                        {'_id': call_uuid},
+                        {
+                            '$push': {'spans': {'$each': spans, '$slice': cls.MAX_SPANS_PER_CALL}},
+                            '$set': {'updated_at': now}
+                        },
+                        upsert=True
+                    )
+                    for call_uuid, spans in pending.items()
+                ], ordered=False)
+            except Exception as e:
+                logger.warning("Dropping spans of %d calls: %s", len(pending), e)
+
+    @classmethod
+    def _run_writer(cls):
+        """Background loop that writes pending spans"""
+        while True:
+            time.sleep(cls.FLUSH_INTERVAL)
+            cls.flush()
+
+    @classmethod
+    def waterfall(cls, call_uuid):
+        """
+        Get a call's spans in start order, with offsets from the first span.
+
+        Spans other workers recorded in the last TRACE_FLUSH_INTERVAL
+        seconds may not be written yet.
+
+        Returns:
+            list or None: Spans with offset_ms added, or None for unknown calls
+        """
+        cls.flush()
+        trace = MongoDB().get_db().traces.find_one({'_id': call_uuid}, {'_id': 0, 'spans': 1})
+        spans = (trace or {}).get('spans') or []
+        if not spans:
+            return None
+
+        spans.sort(key=lambda span: span['start'])
+        origin = spans[0]['start']
+        for span in spans:
+            span['offset_ms'] = round((span['start'] - origin) * 1000, 2)
+        return spans
@@ -0,0 +1,708 @@
+import math
+import os
+import threading
+import time
+import numpy as np
+from database import MongoDB
+from lexical import LexicalIndex, document_frequencies, person_terms, reciprocal_rank_fusion, tokenize
+from locations import distances_km, haversine_km
+from logs import get_logger
+from metrics import Counter, Gauge
+from profiles import EMBEDDING_READY
+from quantization import FIRST_STAGE_MIN_PARTITION, FIT_SAMPLE, RESCORE_FACTOR, RESCORE_MIN, FirstStageEncoder
+from shards import ShardPool
+from snapshot import EmbeddingSnapshot, embedding_stamp
+
+logger = get_logger('vector_index')
+
+# Score multiplier for people whose embedding is from before their latest
+# profile edit (still queued, or failed); new people have none yet and never match
+STALE_EMBEDDING_PENALTY = float(os.getenv('STALE_EMBEDDING_PENALTY', 0.8))
+
+# Partition for people whose location the gazetteer couldn't place
+UNKNOWN_REGION = ''
+
+# Fields returned with each match
+RESULT_FIELDS = ('phoneNumber', 'name', 'interests', 'skills', 'bio', 'location')
+
+# Hybrid search: RRF constant, and when lexical postings may stand in for a
+# full scan: only partitions of at least HYBRID_PRUNE_MIN_PARTITION people,
+# and only when the query's terms match at least HYBRID_MIN_CANDIDATES of them
+RRF_K = int(os.getenv('RRF_K', 60))
+HYBRID_PRUNE_MIN_PARTITION = int(os.getenv('HYBRID_PRUNE_MIN_PARTITION', 5000))
+HYBRID_MIN_CANDIDATES = int(os.getenv('HYBRID_MIN_CANDIDATES', 200))
+
+# Batch search scores BATCH_ROW_BLOCK people against a block of queries at a
+# time, bounding the score matrix to rows x queries float32s
+BATCH_ROW_BLOCK = int(os.getenv('BATCH_ROW_BLOCK', 65536))
+
+def _normalized(embedding):
+    """An embedding as a unit float32 vector, None when it is empty or zero"""
+    if not embedding:
+        return None
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else None
+
+def _ranked(score, clusters, limit, wanted, total):
+    """
+    Positions of the best limit scores, best first, and with clusters only
+    each cluster's best. Only the top wanted are sorted; None when
+    duplicates crowded the limit out of those and the ranking of total
+    holds more.
+    """
+    if wanted is not None and wanted < len(score):
+        top = np.argpartition(-score, wanted - 1)[:wanted]
+        order = top[np.argsort(-score[top], kind='stable')]
+    else:
+        order = np.argsort(-score, kind='stable')
+    if clusters is None:
+        return order[:limit]
+    seen = set()
+    distinct = []
+    for i in order:
+        if clusters[i] not in seen:
+            seen.add(clusters[i])
+            distinct.append(i)
+    if limit is not None and len(distinct) < limit and len(order) < total:
+        return None
+    return distinct[:limit]
+
+class _Partition:
+    """The unit-normalized embeddings, score penalties, coordinates, duplicate clusters and BM25 postings of one region's people"""
+
+    def __init__(self, people, vectors, penalties, coords, terms, clusters):
+        self.people = people
+        self.terms = terms
+        self.lexical = None
+        # First row in the whole build, and the ShardPool generation holding it
+        self.offset = 0
+        self.shard_generation = None
+        self.phones = np.array([person['phoneNumber'] for person in people], dtype=object)
+        self.rows_by_phone = {phone: row for row, phone in enumerate(self.phones)}
+        # Near-duplicate cluster per row; people without duplicates are their own cluster
+        self.clusters = np.array(clusters, dtype=object)
+        self.cluster_rows = {}
+        for row, cluster in enumerate(self.clusters):
+            if cluster != self.phones[row]:
+                self.cluster_rows.setdefault(cluster, []).append(row)
+        self.matrix = np.asarray(vectors, dtype=np.float32)
+        # First-pass codes of large partitions and their FirstStageEncoder, when configured
+        self.codes = None
+        self.encoder = None
+        self.penalties = np.asarray(penalties, dtype=np.float32)
+        # (lat, lon) in degrees, NaN when unknown
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        located = self.coords[~np.isnan(self.coords[:, 0])]
+        self.bbox = (located.min(axis=0), located.max(axis=0)) if len(located) else None
+
+    def __len__(self):
+        return len(self.people)
+
+    def may_be_within(self, lat, lon, radius_km):
+        """Whether any located person in this partition could be within radius_km of the point"""
+        if self.bbox is None:
+            return False
+        (min_lat, min_lon), (max_lat, max_lon) = self.bbox
+        # Clamping to the box only approximates its nearest point on the sphere,
+        # so allow some slack; people are filtered by exact distance afterwards
+        nearest_lat = min(max(lat, min_lat), max_lat)
+        nearest_lon = min(max(lon, min_lon), max_lon)
+        return haversine_km(lat, lon, nearest_lat, nearest_lon) <= radius_km * 1.1
+
+    def distances_km(self, lat, lon, rows=None):
+        """Haversine distance from the point to everyone in the partition, or to rows (NaN when unlocated)"""
+        return distances_km(self.coords if rows is None else self.coords[rows], lat, lon)
+
+    def rows_of(self, phone_number, cluster=None):
+        """Rows of a person and, with their cluster, of everyone in it"""
+        rows = set(self.cluster_rows.get(cluster, ())) if cluster else set()
+        for phone in (phone_number, cluster):
+            if phone in self.rows_by_phone:
+                rows.add(self.rows_by_phone[phone])
+        return np.array(sorted(rows), dtype=np.int64)
+
+class VectorIndex:
+    """
+    In-memory hybrid (embedding and BM25) index over every embedded person, partitioned by region.
+
+    Embeddings are held as one unit-normalized float32 matrix per region
+    (locationInfo.region, e.g. US-CA), so a search is a matrix-vector
+    product instead of a Python loop, and region and distance filters pick
+    the partitions to scan before any scoring happens. A near/radius_km
+    search skips every partition whose bounding box lies outside the
+    radius.
+
+    The index is per worker process. It is rebuilt from MongoDB when it is
+    older than VECTOR_INDEX_TTL seconds, or on the next search after this
+    process changes a person (invalidate()); while one request rebuilds it,
+    others keep searching the previous build. Vectors come from the
+    EmbeddingSnapshot on local disk when there is one, so a build only
+    reads metadata from MongoDB. With VECTOR_SHARDS set, large scans run
+    on a ShardPool of processes sharing the build's memory. Otherwise,
+    with VECTOR_REDUCTION or VECTOR_QUANTIZATION set, large partitions are
+    scanned through compact first-pass codes and only the best candidates
+    are scored against the float32 embeddings.
+    """
+    TTL = float(os.getenv('VECTOR_INDEX_TTL', 30))
+
+    _partitions = None
+    _built_at = 0.0
+    _builds = 0
+    _stale = True
+    _lock = threading.Lock()
+    _build_lock = threading.Lock()
+
+    @classmethod
+    def invalidate(cls):
+        """Rebuild on the next search, after a person was created, edited or deleted"""
+        cls._stale = True
+
+    @classmethod
+    def build(cls):
+        """Load every embedded person and group them into region partitions"""
+        started = time.perf_counter()
+        db = MongoDB().get_db('analytics')
+        # With a snapshot on disk only metadata comes from MongoDB; vectors are mapped from the file
+        snapshot = EmbeddingSnapshot.open()
+        projection = {'_id': 0, 'embeddingStatus': 1, 'locationInfo': 1, 'geo': 1, 'duplicateCluster': 1,
+                      'profileHash': 1, 'embeddingVersion': 1, **{field: 1 for field in RESULT_FIELDS}}
+        if snapshot is None:
+            projection['vectorEmbedding'] = 1
+        cursor = db.persons.find(
+            # Merged duplicates are left out; their cluster's canonical member stands in
+            {'vectorEmbedding': {'$exists': True, '$ne': None}, 'mergedInto': {'$exists': False}},
+            projection
+        )
+        grouped = {}
+        missing = []
+        for person in cursor:
+            if snapshot is None:
+                source = _normalized(person['vectorEmbedding'])
+            else:
+                source = snapshot.lookup(
+                    person['phoneNumber'], embedding_stamp(person.get('profileHash'), person.get('embeddingVersion'))
+                )
+                if source is None:
+                    missing.append(person)
+                    continue
+            cls._add(grouped, person, source)
+        if missing:
+            embeddings = cls._load_missing(db, missing)
+            for person in missing:
+                cls._add(grouped, person, embeddings.get(person['phoneNumber']))
+
+        partitions = {}
+        for region, (people, sources, penalties, coords, terms, clusters) in grouped.items():
+            if snapshot is not None:
+                # Snapshot rows first and in file order, so a compacted region is one slice of the mapping
+                order = sorted(range(len(sources)), key=lambda i: sources[i] if isinstance(sources[i], int) else len(snapshot.ids))
+                people, sources, penalties, coords, terms, clusters = (
+                    [column[i] for i in order] for column in (people, sources, penalties, coords, terms, clusters)
+                )
+                vectors = snapshot.gather(sources)
+            else:
+                vectors = np.vstack(sources)
+            partitions[region] = _Partition(people, vectors, penalties, coords, terms, clusters)
+        # BM25 statistics come from everyone, so scores compare across partitions
+        all_terms = [terms for partition in partitions.values() for terms in partition.terms]
+        frequencies, average_length = document_frequencies(all_terms)
+        for partition in partitions.values():
+            partition.lexical = LexicalIndex(partition.terms, frequencies, len(all_terms), average_length)
+            partition.terms = None
+        if FirstStageEncoder.configured():
+            cls._encode(partitions.values())
+        offset = 0
+        for partition in partitions.values():
+            partition.offset = offset
+            offset += len(partition)
+        if ShardPool.enabled() and partitions:
+            ShardPool.publish(list(partitions.values()))
+        with cls._lock:
+            cls._partitions = partitions
+            cls._built_at = time.monotonic()
+            cls._builds += 1
+        VECTOR_INDEX_BUILDS.inc()
+        logger.info(
+            "Vector index built",
+            people=sum(len(p) for p in partitions.values()),
+            partitions=len(partitions),
+            seconds=round(time.perf_counter() - started, 3)
+        )
+        return partitions
+
+    @classmethod
+    def _add(cls, grouped, person, source):
+        """Add a person to their region's columns; source is their unit embedding or snapshot row"""
+        if source is None:
+            return
+        info = person.get('locationInfo') or {}
+        geo = person.get('geo') or {}
+        lon, lat = geo.get('coordinates') or (math.nan, math.nan)
+        stale = person.get('embeddingStatus', EMBEDDING_READY) != EMBEDDING_READY
+        people, sources, penalties, coords, terms, clusters = grouped.setdefault(
+            info.get('region') or UNKNOWN_REGION, ([], [], [], [], [], [])
+        )
+        people.append({field: person.get(field) for field in RESULT_FIELDS})
+        sources.append(source)
+        penalties.append(STALE_EMBEDDING_PENALTY if stale else 1.0)
+        coords.append((lat, lon))
+        terms.append(person_terms(person))
+        clusters.append(person.get('duplicateCluster') or person['phoneNumber'])
+
+    @classmethod
+    def _encode(cls, partitions):
+        """Fit a FirstStageEncoder on a sample of the large partitions and encode them"""
+        large = [partition for partition in partitions if len(partition) >= FIRST_STAGE_MIN_PARTITION]
+        if not large:
+            return
+        started = time.perf_counter()
+        total = sum(len(partition) for partition in large)
+        rng = np.random.default_rng(0)
+        # Each partition contributes to the sample in proportion to its size
+        sample = np.vstack([
+            partition.matrix[np.sort(rng.choice(
+                len(partition), min(len(partition), max(1, FIT_SAMPLE * len(partition) // total)), replace=False
+            ))]
+            for partition in large
+        ])
+        encoder = FirstStageEncoder.fit(sample)
+        for partition in large:
+            partition.codes = encoder.encode(partition.matrix)
+            partition.encoder = encoder
+        logger.info(
+            "Vector index first stage encoded",
+            encoding=encoder.describe(),
+            people=total,
+            megabytes=round(sum(partition.codes.nbytes for partition in large) / 2**20, 1),
+            seconds=round(time.perf_counter() - started, 3)
+        )
+
+    @classmethod
+    def _load_missing(cls, db, missing):
+        """
+        Embeddings the snapshot lacks (new, or changed since), read from
+        MongoDB and appended to the snapshot for the next build. A pending
+        person's profileHash is already the edited profile's while their
+        vectorEmbedding is still the old one, so only ready embeddings are
+        appended; a pending one is used for this build and read again once
+        the queue has re-embedded it.
+
+        Returns:
+            dict: phone number -> unit embedding
+        """
+        embeddings = {}
+        entries = []
+        for start in range(0, len(missing), 1000):
+            phones = [person['phoneNumber'] for person in missing[start:start + 1000]]
+            for person in db.persons.find(
+                {'phoneNumber': {'$in': phones}},
+                {
+                    '_id': 0, 'phoneNumber': 1, 'vectorEmbedding': 1, 'profileHash': 1,
+                    'embeddingVersion': 1, 'embeddingStatus': 1, 'locationInfo': 1
+                }
+            ):
+                embedding = _normalized(person.get('vectorEmbedding'))
+                if embedding is None:
+                    continue
+                embeddings[person['phoneNumber']] = embedding
+                if person.get('embeddingStatus', EMBEDDING_READY) != EMBEDDING_READY:
+                    continue
+                entries.append((
+                    person['phoneNumber'],
+                    (person.get('locationInfo') or {}).get('region'),
+                    embedding_stamp(person.get('profileHash'), person.get('embeddingVersion')),
+                    embedding
+                ))
+        EmbeddingSnapshot.append(entries)
+        logger.info("Embeddings missing from the snapshot loaded from MongoDB", people=len(embeddings))
+        return embeddings
+
+    @classmethod
+    def partitions(cls):
+        """The current partitions, rebuilding first if they are stale"""
+        with cls._lock:
+            partitions = cls._partitions
+            fresh = not cls._stale and time.monotonic() - cls._built_at < cls.TTL
+        if partitions is not None and fresh:
+            return partitions
+        # Only one thread rebuilds; the rest use the previous build if there is one
+        if not cls._build_lock.acquire(blocking=partitions is None):
+            return partitions
+        try:
+            if cls._partitions is not partitions:
+                return cls._partitions
+            cls._stale = False
+            return cls.build()
+        except Exception:
+            cls._stale = True
+            raise
+        finally:
+            cls._build_lock.release()
+
+    @classmethod
+    def build_number(cls):
+        """Which build searches use now (rebuilding first if stale), for versioning cached results"""
+        cls.partitions()
+        return cls._builds
+
+    @classmethod
+    def select(cls, region=None, near=None, radius_km=None):
+        """The partitions a search with these filters has to scan"""
+        partitions = cls.partitions()
+        if region is not None:
+            selected = [partitions[region]] if region in partitions else []
+        else:
+            selected = list(partitions.values())
+        if near is not None:
+            lat, lon = near
+            selected = [p for p in selected if p.may_be_within(lat, lon, radius_km)]
+        return selected
+
+    @classmethod
+    def search(cls, query_embedding, exclude_phone=None, region=None, near=None, radius_km=None, query_text=None,
+               limit=None, collapse=True):
+        """
+        Rank people by similarity to the query, best first, dropping non-positive cosine scores.
+
+        With query_text the ranking is hybrid: the cosine ranking and a BM25
+        ranking over interests, skills and bio are fused by reciprocal rank,
+        and in large partitions scanned in-process the people matching the
+        query's terms are the only ones scored against the embedding.
+
+        With a limit, partitions with first-pass codes are scored from the
+        codes and only their best candidates get an exact cosine. Hybrid
+        fusion can still rank someone beyond those into the results, so
+        every returned person's similarity is recomputed exactly.
+
+        With collapse, each near-duplicate cluster contributes only its best
+        hit, and the excluded caller's duplicates are left out with them.
+
+        Args:
+            query_embedding (list): Query embedding
+            exclude_phone (str, optional): Phone number to leave out (the caller)
+            region (str, optional): Only search this region code, e.g. US-CA
+            near (tuple, optional): (lat, lon) to search around
+            radius_km (float, optional): With near, the search radius
+            query_text (str, optional): The query, for lexical matching
+            limit (int, optional): Return only the best this many
+            collapse (bool): Collapse near-duplicate clusters
+
+        Returns:
+            tuple: (results, scanned) where results are dicts of RESULT_FIELDS
+                plus similarity (cosine), lexical_score and score (fused) with
+                query_text, and distance_km with near; scanned is how many
+                embeddings were scored
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if not query_norm:
+            return [], 0
+        query = query / query_norm
+        terms = tokenize(query_text) if query_text else []
+
+        selected = cls.select(region, near, radius_km)
+        excluded_cluster = cls.cluster_of(exclude_phone) if exclude_phone and collapse else None
+        # Only sort the top of the ranking, with room for duplicates when collapsing
+        wanted = limit * 4 + 16 if limit is not None and collapse else limit
+
+        scan = None
+        if ShardPool.serves(selected):
+            scan = cls._scan_shards(selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, wanted)
+        sharded = scan is not None
+        if not sharded:
+            scan = cls._scan(selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, wanted)
+        matches, score, kept, scanned = scan
+        VECTOR_INDEX_SCANNED.inc(scanned)
+
+        while True:
+            if not matches:
+                return [], scanned
+            similarity = np.concatenate([m[2] for m in matches])
+            lexical = np.concatenate([m[3] for m in matches]) if terms else None
+            if score is None:
+                score = reciprocal_rank_fusion(similarity, lexical, k=RRF_K) if terms else similarity
+            # Which partition and row each score belongs to
+            owners = np.repeat(np.arange(len(matches)), [len(m[1]) for m in matches])
+            rows = np.concatenate([m[1] for m in matches])
+            distances = np.concatenate([m[4] for m in matches]) if near is not None else None
+            clusters = np.concatenate([m[0].clusters[m[1]] for m in matches]) if collapse else None
+
+            # The shards already cut the ranking down to their best; sort all of it
+            order = _ranked(score, clusters, limit, None if sharded else wanted, kept)
+            if order is None and not sharded:
+                order = _ranked(score, clusters, limit, None, kept)
+            if order is not None:
+                break
+            # Duplicates crowded out the shards' best; have them send everyone
+            scan = cls._scan_shards(selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, None)
+            if scan is None:
+                sharded = False
+                scan = cls._scan(selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, wanted)
+            matches, score, kept, _ = scan
+
+        results = []
+        for i in order:
+            partition = matches[owners[i]][0]
+            if partition.codes is not None:
+                # May be the first pass's approximation; the response reports the exact cosine
+                similarity[i] = partition.matrix[rows[i]] @ query * partition.penalties[rows[i]]
+            result = dict(partition.people[rows[i]], similarity=float(similarity[i]))
+            if terms:
+                result['lexical_score'] = round(float(lexical[i]), 3)
+                result['score'] = float(score[i])
+            if distances is not None:
+                result['distance_km'] = round(float(distances[i]), 1)
+            results.append(result)
+        return results, scanned
+
+    @classmethod
+    def _scan(cls, selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, wanted=None):
+        """
+        Score the selected partitions in the request thread, from their
+        first-pass codes when they have them and only the best `wanted`
+        are needed.
+
+        Returns:
+            tuple: (matches, score, kept, scanned): per partition, the rows
+                kept and their cosine, BM25 and distance; None for score,
+                which is fused from the full arrays; how many rows were kept;
+                and how many embeddings were scored
+        """
+        if near is not None:
+            lat, lon = near
+        matches = []
+        scanned = 0
+        for partition in selected:
+            rows = None
+            lexical = partition.lexical.score(terms) if terms else None
+            if lexical is not None and len(partition) >= HYBRID_PRUNE_MIN_PARTITION:
+                candidates = partition.lexical.candidates(terms)
+                if len(candidates) >= HYBRID_MIN_CANDIDATES:
+                    rows = candidates
+            if rows is None:
+                rows = np.arange(len(partition))
+                if partition.codes is not None and wanted is not None:
+                    depth = max(RESCORE_MIN, wanted * RESCORE_FACTOR)
+                    similarity, rescored = partition.encoder.rescored(
+                        partition.codes, partition.matrix, query, depth, partition.penalties
+                    )
+                    VECTOR_INDEX_RESCORED.inc(len(rescored))
+                else:
+                    similarity = partition.matrix @ query * partition.penalties
+            else:
+                similarity = partition.matrix[rows] @ query * partition.penalties[rows]
+            scanned += len(rows)
+
+            keep = similarity > 0
+            distances = None
+            if near is not None:
+                distances = partition.distances_km(lat, lon)[rows]
+                # NaN (unlocated) compares False, so they drop out too
+                keep &= distances <= radius_km
+            if excluded_cluster:
+                keep &= partition.clusters[rows] != excluded_cluster
+            elif exclude_phone:
+                keep &= partition.phones[rows] != exclude_phone
+            matches.append((
+                partition,
+                rows[keep],
+                similarity[keep],
+                lexical[rows[keep]] if lexical is not None else None,
+                distances[keep] if distances is not None else None
+            ))
+        return matches, None, sum(len(m[1]) for m in matches), scanned
+
+    @classmethod
+    def _scan_shards(cls, selected, query, terms, exclude_phone, excluded_cluster, near, radius_km, wanted):
+        """
+        Score the selected partitions on the ShardPool.
+
+        The shards return their best `wanted` by cosine. With terms, the
+        lexical matches are scored here too, since they can rank high on
+        BM25 whatever their cosine, and the shards count how many people
+        outscore each of them, so their fused score uses their rank among
+        everyone, as in a full in-process scan (which also skips the
+        lexical pruning of large partitions).
+
+        Returns:
+            tuple: As for _scan, with score already fused when there are
+                terms; None when the shards couldn't serve the search
+        """
+        if near is not None:
+            lat, lon = near
+        offsets = np.array([partition.offset for partition in selected])
+        excluded = [
+            partition.offset + partition.rows_of(exclude_phone, excluded_cluster) for partition in selected
+        ] if exclude_phone else []
+        excluded = np.concatenate(excluded) if excluded else None
+
+        lexicals = [partition.lexical.score(terms) if terms else None for partition in selected]
+        candidate_rows = []
+        candidate_similarity = []
+        for partition, lexical in zip(selected, lexicals):
+            if lexical is None:
+                continue
+            rows = np.flatnonzero(lexical > 0)
+            similarity = partition.matrix[rows] @ query * partition.penalties[rows]
+            keep = similarity > 0
+            if near is not None:
+                keep &= partition.distances_km(lat, lon, rows) <= radius_km
+            if exclude_phone:
+                keep &= ~np.isin(rows, partition.rows_of(exclude_phone, excluded_cluster))
+            candidate_rows.append(partition.offset + rows[keep])
+            candidate_similarity.append(similarity[keep])
+        candidate_rows = np.concatenate(candidate_rows) if candidate_rows else np.empty(0, dtype=np.int64)
+        candidate_similarity = np.concatenate(candidate_similarity) if candidate_similarity else np.empty(0, dtype=np.float32)
+
+        reply = ShardPool.search(
+            selected, query, wanted,
+            near=(lat, lon, radius_km) if near is not None else None,
+            excluded=excluded,
+            probes=candidate_similarity,
+            probe_rows=candidate_rows
+        )
+        if reply is None:
+            return None
+        top_rows, top_similarity, kept, above = reply
+
+        # Everyone either list brought in, in row order, with their cosine rank
+        rows = np.unique(np.concatenate([top_rows, candidate_rows]))
+        similarity = np.empty(len(rows), dtype=np.float32)
+        ranks = np.empty(len(rows), dtype=np.int64)
+        found = np.searchsorted(rows, candidate_rows)
+        similarity[found] = candidate_similarity
+        ranks[found] = above + 1
+        found = np.searchsorted(rows, top_rows)
+        similarity[found] = top_similarity
+        ranks[found] = np.arange(1, len(top_rows) + 1)
+        owners = np.searchsorted(offsets, rows, side='right') - 1
+
+        score = None
+        lexical = np.zeros(len(rows), dtype=np.float32)
+        if terms:
+            for number, partition_lexical in enumerate(lexicals):
+                mine = owners == number
+                lexical[mine] = partition_lexical[rows[mine] - offsets[number]]
+            lexical_ranks = np.empty(len(rows), dtype=np.float64)
+            lexical_ranks[np.argsort(-lexical, kind='stable')] = np.arange(1, len(rows) + 1)
+            score = 1.0 / (RRF_K + ranks) + np.where(lexical > 0, 1.0 / (RRF_K + lexical_ranks), 0.0)
+
+        matches = []
+        for number, partition in enumerate(selected):
+            mine = owners == number
+            if not mine.any():
+                continue
+            local = rows[mine] - partition.offset
+            matches.append((
+                partition,
+                local,
+                similarity[mine],
+                lexical[mine] if terms else None,
+                partition.distances_km(lat, lon, local) if near is not None else None
+            ))
+        # Partitions are in row order, so the matches concatenate back to `rows`
+        return matches, score, kept, sum(len(partition) for partition in selected)
+
+    @classmethod
+    def cluster_of(cls, phone_number):
+        """A person's near-duplicate cluster in the current build, or their own phone number"""
+        for partition in (cls._partitions or {}).values():
+            row = partition.rows_by_phone.get(phone_number)
+            if row is not None:
+                return partition.clusters[row]
+        return phone_number
+
+    @classmethod
+    def search_batch(cls, query_embeddings, top_k, excludes=None, region=None, near=None, radius_km=None,
+                     block_size=64):
+        """
+        Top-k cosine matches for many queries, a block of queries at a time.
+
+        Each block is scored with one matrix-matrix product per
+        BATCH_ROW_BLOCK rows of each partition, keeping only the running
+        top-k per query, so memory stays bounded however many people and
+        queries there are.
+
+        Args:
+            query_embeddings (list): Query embeddings
+            top_k (int): Matches to return per query
+            excludes (list, optional): Phone number to leave out, per query
+            region, near, radius_km: As for search()
+            block_size (int): Queries scored together
+
+        Yields:
+            tuple: (offset of the block's first query, [results per query]),
+                results as for search() with similarity (and distance_km with near)
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = np.divide(queries, norms, out=np.zeros_like(queries), where=norms > 0)
+        excludes = excludes or [None] * len(queries)
+
+        selected = cls.select(region, near, radius_km)
+        distances = [p.distances_km(*near) if near is not None else None for p in selected]
+
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            # Running best per query: (score, partition number, row)
+            best = [[] for _ in block]
+            for number, partition in enumerate(selected):
+                for first in range(0, len(partition), BATCH_ROW_BLOCK):
+                    last = min(first + BATCH_ROW_BLOCK, len(partition))
+                    scores = partition.matrix[first:last] @ block.T
+                    scores *= partition.penalties[first:last, None]
+                    if distances[number] is not None:
+                        scores[~(distances[number][first:last] <= radius_km)] = -np.inf
+                    for column, exclude in enumerate(excludes[start:start + block_size]):
+                        row = partition.rows_by_phone.get(exclude) if exclude else None
+                        if row is not None and first <= row < last:
+                            scores[row - first, column] = -np.inf
+                    keep = min(top_k, last - first)
+                    top = np.argpartition(-scores, keep - 1, axis=0)[:keep]
+                    for column in range(len(block)):
+                        best[column].extend(
+                            (float(scores[row, column]), number, first + int(row)) for row in top[:, column]
+                        )
+                    for column in range(len(block)):
+                        best[column] = sorted(best[column], reverse=True)[:top_k]
+
+            block_results = []
+            for column in best:
+                results = []
+                for score, number, row in column:
+                    if score <= 0:
+                        continue
+                    result = dict(selected[number].people[row], similarity=score)
+                    if distances[number] is not None:
+                        result['distance_km'] = round(float(distances[number][row]), 1)
+                    results.append(result)
+                block_results.append(results)
+            VECTOR_INDEX_SCANNED.inc(sum(len(p) for p in selected) * len(block))
+            yield start, block_results
+
+    @classmethod
+    def size(cls):
+        """People in the current build by partition (no rebuild)"""
+        with cls._lock:
+            partitions = cls._partitions or {}
+            return {region or 'unknown': len(partition) for region, partition in partitions.items()}
+
+VECTOR_INDEX_BUILDS = Counter(
+    'boardy_vector_index_builds_total',
+    'Rebuilds of the in-memory similarity index'
+)
+VECTOR_INDEX_SCANNED = Counter(
+    'boardy_vector_index_scanned_total',
+    'Embeddings scored by similarity searches'
+)
+VECTOR_INDEX_RESCORED = Counter(
+    'boardy_vector_index_rescored_total',
+    'Embeddings rescored in float32 after a first-pass scan of compact codes'
+)
+VECTOR_INDEX_PEOPLE = Gauge(
+    'boardy_vector_index_people',
+    'People in the in-memory similarity index by region partition',
+    ['region'],
+    callback=lambda: {(region,): count for region, count in VectorIndex.size().items()}
+)
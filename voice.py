@@ -1,4 +1,5 @@
 import os
+import hashlib
 import requests
 from dotenv import load_dotenv
 
@@ -9,7 +10,8 @@ class Voice:
     """A class to handle text-to-speech generation using ElevenLabs API"""
     
     # Base URL for ElevenLabs API
-    BASE_URL = "https://api.elevenlabs.io/v1"
+    BASE_URL = os.getenv('ELEVEN_LABS_BASE_URL', "https://api.elevenlabs.io/v1")
+    DEFAULT_VOICE_ID = "pqHfZKP75CvOlQylNhV4"
     
     def __init__(self):
         """Initialize the Voice class with API key from environment variables"""
@@ -23,7 +25,7 @@ class Voice:
             "xi-api-key": self.api_key
         }
 
-    def generate_speech(self, text, voice_id="pqHfZKP75CvOlQylNhV4", output_path=None):
+    def generate_speech(self, text, voice_id=DEFAULT_VOICE_ID, output_path=None, timeout=None):
         """
         Generate speech using ElevenLabs API
         
@@ -31,6 +33,7 @@ class Voice:
             text (str): The text to convert to speech
             voice_id (str): The ID of the voice to use
             output_path (str, optional): Path to save the audio file
+            timeout (float, optional): Request timeout in seconds
             
         Returns:
             bytes or str: Audio bytes or file path
@@ -49,7 +52,7 @@ class Voice:
                 }
             }
             
-            response = requests.post(url, json=data, headers=self.headers)
+            response = requests.post(url, json=data, headers=self.headers, timeout=timeout)
             response.raise_for_status()
             
             if output_path:
@@ -61,4 +64,32 @@ class Voice:
                 
         except Exception as e:
             print(f"Error occurred: {str(e)}")
-            raise 
\ No newline at end of file
+            raise 
+
+    def cache_fallback(self, text, cache_dir):
+        """
+        Generate audio for a fallback phrase once and keep it on disk.
+        
+        Args:
+            text (str): The fallback phrase
+            cache_dir (str): Directory holding cached fallback audio
+            
+        Returns:
+            str: Filename of the cached audio within cache_dir
+        """
+        filename = self.fallback_filename(text)
+        path = os.path.join(cache_dir, filename)
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            audio = self.generate_speech(text, timeout=30)
+            # Write atomically so a half-written file is never served
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        return filename
+
+    @staticmethod
+    def fallback_filename(text):
+        """Stable filename for a fallback phrase's cached audio"""
+        return f"{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}.mp3"